@@ -1,12 +1,32 @@
 import os
 
+
 class Config:
     serial_device: str
     http_port: str
+    log_level: str
+    http_workers: str
+    reach_map: str
+    emulator_faults: str
+    toolpath_dir: str
 
-    def __init__(self, serial_device: str = "/dev/ttyUSB0", http_port: str = "80"):
+    def __init__(
+        self,
+        serial_device: str = "/dev/ttyUSB0",
+        http_port: str = "80",
+        log_level: str = "INFO",
+        http_workers: str = "1",
+        reach_map: str = "reach.bin",
+        emulator_faults: str = "",
+        toolpath_dir: str = "toolpaths",
+    ):
         self.serial_device = serial_device
         self.http_port = http_port
+        self.log_level = log_level
+        self.http_workers = http_workers
+        self.reach_map = reach_map
+        self.emulator_faults = emulator_faults
+        self.toolpath_dir = toolpath_dir
 
     @staticmethod
     def from_env(env_file: str):
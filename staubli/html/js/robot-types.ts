@@ -61,12 +61,18 @@ export type ElbowEnum = "above" | "below";
 export interface RobotState {
   position: Position;
   elbow: ElbowEnum;
+  // False once the elbow is toggled by hand, the server picks it otherwise
+  auto?: boolean;
   speed: number;
   tool_offset: EffectorPosition;
+  busy?: boolean;
+  // Step of the native program running on the controller
+  program_step?: number;
 }
 
 export interface RobotInterface {
   state: () => RobotState;
   name: string;
   execute: (command: Command) => Promise<void>;
+  run?: (program: { commands: Command[]; speed?: number }) => Promise<void>;
 }
@@ -23,7 +23,46 @@ class RobotApi {
   }
 
   load() {
-    this.#withRobotState(get("/api/robot"));
+    this.#subscribe();
+  }
+
+  // Server pushes versioned state deltas, no polling needed.
+  // Every subscribe starts from a full snapshot, so a dropped socket is
+  // reopened and subscribed again.
+  #subscribe(retryMs = 250) {
+    const socket = new WebSocket(`ws://${location.hostname}:8765`);
+    const subscribe = () => socket.send(JSON.stringify({ subscribe: "state" }));
+    let version = -1;
+
+    socket.onopen = () => {
+      retryMs = 250;
+      subscribe();
+    };
+    socket.onerror = () => this.#withRobotState(get("/api/robot"));
+    socket.onclose = () => {
+      setTimeout(() => this.#subscribe(Math.min(retryMs * 2, 5000)), retryMs);
+    };
+    socket.onmessage = (event) => {
+      const message = JSON.parse(event.data);
+      if (message.channel !== "state") {
+        return;
+      }
+      if (message.state) {
+        version = message.version;
+        this.setState({ ...this.state(), ...message.state });
+        return;
+      }
+      if (message.version <= version) {
+        return;
+      }
+      if (message.version !== version + 1) {
+        // Missed a delta, start over from a snapshot
+        subscribe();
+        return;
+      }
+      version = message.version;
+      this.setState({ ...this.state(), ...message.delta });
+    };
   }
 
   async #withRobot(p) {
@@ -49,6 +88,11 @@ class RobotApi {
     await this.#withRobotState(put(`/api/${command.type}`, command.data))
   }
 
+  // Runs the whole program on the controller, progress arrives as program_step
+  async run(program) {
+    await this.#withRobotState(put("/api/program/run", program));
+  }
+
   async elbow() {
     await this.#withRobotState(put("/api/elbow"));
   }
@@ -0,0 +1,255 @@
+"""
+Simulates browser sessions against the full http stack backed by the serial emulator.
+
+    python -m staubli.http.loadtest --duration 10 --scenario mixed
+"""
+
+import argparse
+import http.client
+import json
+import random
+import threading
+import time
+
+from websockets.sync.client import connect
+
+from staubli.config import Config
+from staubli.log import setup_logging
+from staubli.robot.main import EMULATOR_DEVICE
+from .main import RobotHTTPRequestHandler, ThreadingHTTPServer, create_server
+
+WEBSOCKET_URL = "ws://127.0.0.1:8765"
+
+STATIC_ASSETS = [
+    "/",
+    "/style.css",
+    "/pico.amber.css",
+    "/js/app.js",
+    "/js/robot.js",
+    "/js/lib/state.js",
+    "/js/program/state.js",
+]
+
+# A short program as the browser plays it back, one PUT per command
+PROGRAM = [
+    ("speed", {"speed": 50}),
+    ("joints", {"j1": 0, "j2": -90, "j3": 90, "j4": 0, "j5": 0, "j6": 0}),
+    ("effector", {"x": 400, "y": 0, "z": 600, "yaw": 0, "pitch": 90, "roll": 0}),
+    ("effector", {"x": 400, "y": 200, "z": 600, "yaw": 0, "pitch": 90, "roll": 0}),
+    ("tool", {"x": 0, "y": 0, "z": 100, "yaw": 0, "pitch": 0, "roll": 0}),
+    ("joints", {"j1": 20, "j2": -80, "j3": 100, "j4": 0, "j5": 10, "j6": 0}),
+]
+
+# Number of each kind of client per scenario
+SCENARIOS = {
+    "poll": {"poller": 6},
+    "playback": {"operator": 5},
+    "subscribers": {"subscriber": 20, "operator": 1},
+    "static": {"static": 6},
+    "mixed": {"operator": 5, "poller": 1, "subscriber": 1, "static": 2},
+}
+
+
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples: list[tuple[str, float, bool]] = []
+
+    def record(self, kind: str, seconds: float, ok: bool):
+        with self.lock:
+            self.samples.append((kind, seconds, ok))
+
+
+class Client:
+    """One browser tab, a keep-alive connection recording every request."""
+
+    def __init__(self, port: int, recorder: Recorder):
+        self.port = port
+        self.recorder = recorder
+        self.conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+
+    def request(self, kind: str, method: str, path: str, data=None):
+        body = json.dumps(data) if data is not None else None
+        start = time.perf_counter()
+        try:
+            self.conn.request(method, path, body=body)
+            response = self.conn.getresponse()
+            response.read()
+            ok = response.status < 400
+        except (http.client.HTTPException, OSError):
+            ok = False
+            self.conn.close()
+            self.conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=30)
+        self.recorder.record(kind, time.perf_counter() - start, ok)
+
+
+def poller(port, recorder, stop):
+    client = Client(port, recorder)
+    while not stop.is_set():
+        client.request("poll", "GET", "/api/robot")
+        stop.wait(1.0)
+
+
+def operator(port, recorder, stop):
+    client = Client(port, recorder)
+    # Operators don't all press play at the same instant
+    stop.wait(random.uniform(0, 1))
+    while not stop.is_set():
+        for command, data in PROGRAM:
+            if stop.is_set():
+                break
+            client.request(command, "PUT", f"/api/{command}", data)
+
+
+def static(port, recorder, stop):
+    client = Client(port, recorder)
+    while not stop.is_set():
+        client.request("static", "GET", random.choice(STATIC_ASSETS))
+        stop.wait(0.2)
+
+
+def subscriber(port, recorder, stop):
+    """
+    Records the time from connecting to the snapshot, then the interval
+    between deltas. Deltas aren't stamped, so the interval is how often
+    state arrives, not how long a delta took to get here.
+    """
+    start = time.perf_counter()
+    try:
+        with connect(WEBSOCKET_URL) as ws:
+            ws.send(json.dumps({"subscribe": "state"}))
+            while not stop.is_set():
+                try:
+                    message = json.loads(ws.recv(timeout=0.5))
+                except TimeoutError:
+                    continue
+                if message.get("channel") != "state":
+                    continue
+                kind = "snapshot" if "state" in message else "interval"
+                recorder.record(kind, time.perf_counter() - start, True)
+                start = time.perf_counter()
+    except OSError:
+        recorder.record("snapshot", time.perf_counter() - start, False)
+
+
+def wait_for_websocket(timeout: float = 10):
+    """Return once the websocket server accepts connections."""
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            connect(WEBSOCKET_URL, open_timeout=1).close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.05)
+
+
+CLIENTS = {
+    "poller": poller,
+    "operator": operator,
+    "static": static,
+    "subscriber": subscriber,
+}
+
+
+def _percentile(ordered: list[float], q: float) -> float:
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def summarize(samples, duration: float) -> dict:
+    kinds = {}
+    for kind, seconds, ok in samples:
+        kinds.setdefault(kind, []).append((seconds, ok))
+
+    summary = {}
+    for kind, results in sorted(kinds.items()):
+        ordered = sorted(seconds * 1000 for seconds, _ in results)
+        errors = sum(1 for _, ok in results if not ok)
+        summary[kind] = {
+            "count": len(results),
+            "per_second": len(results) / duration,
+            "p50_ms": _percentile(ordered, 0.5),
+            "p95_ms": _percentile(ordered, 0.95),
+            "p99_ms": _percentile(ordered, 0.99),
+            "error_rate": errors / len(results),
+        }
+    return summary
+
+
+def run_scenario(port: int, clients: dict[str, int], duration: float) -> dict:
+    control = Client(port, Recorder())
+    control.request("control", "PUT", "/api/debug/queue/reset")
+
+    recorder = Recorder()
+    stop = threading.Event()
+    threads = [
+        threading.Thread(target=CLIENTS[kind], args=(port, recorder, stop), daemon=True)
+        for kind, count in clients.items()
+        for _ in range(count)
+    ]
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join(timeout=30)
+
+    control.conn.request("GET", "/api/debug/queue")
+    queue_stats = json.loads(control.conn.getresponse().read())
+    return {
+        "requests": summarize(recorder.samples, duration),
+        "serial_queue": queue_stats,
+    }
+
+
+def print_report(name: str, report: dict):
+    print(f"\n== {name}")
+    print(
+        f"{'kind':<10} {'count':>6} {'per s':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}"
+    )
+    for kind, s in report["requests"].items():
+        print(
+            f"{kind:<10} {s['count']:>6} {s['per_second']:>7.1f} {s['p50_ms']:>8.1f}"
+            f" {s['p95_ms']:>8.1f} {s['p99_ms']:>8.1f} {s['error_rate']:>7.1%}"
+        )
+
+    normal = report["serial_queue"]["normal"]
+    if normal["count"]:
+        print(
+            f"serial queue wait: {normal['count']} commands, p95 {normal['p95_ms']:.1f} ms,"
+            f" max {normal['max_ms']:.1f} ms"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--duration", type=float, default=10, help="seconds per scenario"
+    )
+    parser.add_argument(
+        "--scenario", choices=list(SCENARIOS), action="append", help="defaults to all"
+    )
+    parser.add_argument("--json", action="store_true", help="print the reports as json")
+    args = parser.parse_args()
+    setup_logging("WARNING")
+
+    config = Config(serial_device=EMULATOR_DEVICE, http_port="0")
+    httpd = create_server(ThreadingHTTPServer, RobotHTTPRequestHandler, config)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    port = httpd.server_address[1]
+    wait_for_websocket()
+
+    reports = {}
+    for name in args.scenario or list(SCENARIOS):
+        reports[name] = run_scenario(port, SCENARIOS[name], args.duration)
+        if not args.json:
+            print_report(name, reports[name])
+
+    if args.json:
+        print(json.dumps(reports, indent=2))
+    httpd.shutdown()
+
+
+if __name__ == "__main__":
+    main()
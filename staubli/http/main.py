@@ -1,6 +1,10 @@
+import dataclasses
+import logging
 import os
+import queue
 from http.server import HTTPServer
 from functools import partial
+from urllib.parse import parse_qs, urlparse
 import threading
 import socketserver
 
@@ -8,10 +12,20 @@ from staubli.config import Config, env_exists
 from staubli.http.websockets import start_websocket_server
 from staubli.robot.main import Main, ControllerDelegate
 from staubli.robot.machine import EffectorLocation, JointLocation
+from staubli.robot import optimizer, path, reach, toolpath
+from staubli.log import setup_logging
 from .router import RoutingStaticHTTPRequestHandler
 
+log = logging.getLogger(__name__)
+
+
 class RobotHTTPRequestHandler(RoutingStaticHTTPRequestHandler):
     controller: ControllerDelegate
+    error_statuses = {
+        reach.Unreachable: 422,
+        PermissionError: 403,
+        FileNotFoundError: 404,
+    }
 
     def __init__(self, controller, *args, **kwargs):
         self.controller = controller
@@ -24,99 +38,196 @@ class RobotHTTPRequestHandler(RoutingStaticHTTPRequestHandler):
         return {"hello": "world"}
 
     def _format_effector_location(self, effector_location: EffectorLocation):
-        return {
-            "x": effector_location.x,
-            "y": effector_location.y,
-            "z": effector_location.z,
-            "roll": effector_location.roll,
-            "pitch": effector_location.pitch,
-            "yaw": effector_location.yaw
-        }
+        # A copy, the location may be a cached one the controller still holds
+        return dataclasses.asdict(effector_location)
+
     def _position(self):
         where = self.controller.robot.where()
         return {
             "effector": self._format_effector_location(where[0]),
-            "joints": {
-                "j1": where[1].j1,
-                "j2": where[1].j2,
-                "j3": where[1].j3,
-                "j4": where[1].j4,
-                "j5": where[1].j5,
-                "j6": where[1].j6
-            }
+            "joints": dataclasses.asdict(where[1]),
         }
+
     def _tool_offset(self):
         tool_offset = self.controller.robot.tool_offset()
         return self._format_effector_location(tool_offset)
-    
+
     def api_robot(self):
         return {
             "position": self._position(),
             "tool_offset": self._tool_offset(),
             "elbow": self.controller.elbow,
-            "speed": self.controller.speed
+            "speed": self.controller.speed,
         }
+
+    def api_state(self):
+        # Last known state, costs no serial traffic
+        return self.controller.state.snapshot()
+
     def api_position(self):
-        return {
-            "position": self._position()
-        }
+        return {"position": self._position()}
+
     def api_tool_offset(self):
-        return {
-            "tool_offset": self._tool_offset()
-        }
-    
+        return {"tool_offset": self._tool_offset()}
+
     def api_serial(self, data):
-        self.controller.robot.exec(data["command"])
-        return {}
-    
+        if "text/plain" in self.headers.get("Accept", ""):
+            return self._stream_exec(data["command"])
+        return {"output": self.controller.robot.exec(data["command"])}
+
+    def _stream_exec(self, command):
+        chunks = queue.Queue()
+        future = self.controller.robot.submit("exec", command, chunks.put)
+        future.add_done_callback(lambda _: chunks.put(None))
+        while (chunk := chunks.get()) is not None:
+            yield chunk
+        future.result()
+
     def api_effector(self, data):
         effector_location = EffectorLocation(
-            data["x"],
-            data["y"],
-            data["z"],
-            data["yaw"],
-            data["pitch"],
-            data["roll"]
+            data["x"], data["y"], data["z"], data["yaw"], data["pitch"], data["roll"]
         )
-        self.controller.robot.jog_absolute(effector_location)
+        self.controller.jog_absolute(effector_location)
         return self.api_position()
-    
+
     def api_joints(self, data):
         joint_location = JointLocation(
-            data["j1"],
-            data["j2"],
-            data["j3"],
-            data["j4"],
-            data["j5"],
-            data["j6"]
+            data["j1"], data["j2"], data["j3"], data["j4"], data["j5"], data["j6"]
         )
         self.controller.robot.jog_joint(joint_location)
         return self.api_position()
-    
+
     def api_tool(self, data):
         tool_location = EffectorLocation(
-            data["x"],
-            data["y"],
-            data["z"],
-            data["yaw"],
-            data["pitch"],
-            data["roll"]
+            data["x"], data["y"], data["z"], data["yaw"], data["pitch"], data["roll"]
         )
         self.controller.robot.tool_transform(tool_location)
+        return {"position": self._position(), "tool_offset": self._tool_offset()}
+
+    def _effector_location(self, data) -> EffectorLocation:
+        return EffectorLocation(
+            data["x"], data["y"], data["z"], data["yaw"], data["pitch"], data["roll"]
+        )
+
+    def api_path(self, data):
+        samples = path.densify(
+            [self._effector_location(waypoint) for waypoint in data["waypoints"]],
+            step=data.get("step", 10.0),
+            angle_step=data.get("angle_step", 5.0),
+            chord=data.get("chord"),
+            tool=self._effector_location(data["tool"]) if data.get("tool") else None,
+        )
+        if data.get("execute"):
+            # Samples are generated as the robot consumes them
+            return {
+                "count": self.controller.follow(samples),
+                "position": self._position(),
+            }
+        return {"samples": [sample.to_list() for sample in samples]}
+
+    def api_program_run(self, data):
+        # A program/state.js Program, compiled and run on the controller
         return {
+            "program": self.controller.run_program(data["commands"], data.get("speed")),
             "position": self._position(),
-            "tool_offset": self._tool_offset()
         }
-    
-    def api_speed(self, data):
-        self.controller.set_speed(data["speed"])
+
+    def api_program_prune(self, data=None):
+        # Every edit of a program compiles to a new name, old ones stay in controller memory
+        keep = data.get("keep", []) if data else []
+        return {"deleted": self.controller.robot.prune_programs(keep)}
+
+    def api_program_optimize(self, data):
+        # Predicted from where the robot is now, measured only when asked as it moves the robot
+        start = self.controller.robot.where()[1]
+        result = optimizer.report(
+            data["program"], start, data.get("constraints"), self.controller.speed
+        )
+        if data.get("measure"):
+            result["measured"] = optimizer.measure(
+                self.controller.robot, data["program"], result["program"], start
+            )
+        return result
+
+    def api_toolpath(self, data=None, body=None):
+        """
+        Run a CSV or G-code toolpath, either uploaded as the body
+        (Content-Type text/csv or text/x-gcode, ?fixture=x,y,z,yaw,pitch,roll)
+        or read from a file in the toolpath directory ({"path": ..., "format": ..., "fixture": {...}}).
+        """
+        if body is not None:
+            query = parse_qs(urlparse(self.path).query)
+            source = body
+            format = toolpath.CONTENT_TYPES.get(
+                self.headers.get("Content-Type", "").split(";")[0].strip()
+            )
+            format = query.get("format", [format])[0]
+            fixture = query.get("fixture", [None])[0]
+            fixture = (
+                EffectorLocation.from_list([float(v) for v in fixture.split(",")])
+                if fixture
+                else None
+            )
+            execute = query.get("execute", ["true"])[0] != "false"
+        else:
+            source = toolpath.resolve(data["path"], self.controller.toolpath_dir)
+            format = data.get("format") or toolpath.FORMATS.get(
+                os.path.splitext(source)[1].lower()
+            )
+            fixture = (
+                self._effector_location(data["fixture"])
+                if data.get("fixture")
+                else None
+            )
+            execute = data.get("execute", True)
+
+        locations = toolpath.load(source, format, fixture)
+        if not execute:
+            return {"count": sum(1 for _ in locations)}
+        return {"count": self.controller.feed(locations), "position": self._position()}
+
+    def _format_point(self, distance, index):
+        name, location = self.controller.positions[index]
         return {
-            "speed": self.controller.speed
+            "name": name,
+            "index": index,
+            "distance": distance,
+            "location": self._format_effector_location(location),
         }
 
+    def api_points_nearest(self, data=None):
+        # Nearest to the given location, or to where the robot is now
+        location = (
+            self._effector_location(data["location"])
+            if data and "location" in data
+            else None
+        )
+        nearest = self.controller.nearest_position(location)
+        if nearest is None:
+            return {"point": None}
+        if data and data.get("jog"):
+            self.controller.positions_index = nearest[1]
+            self.controller.jog_absolute(self.controller.positions[nearest[1]][1])
+        return {"point": self._format_point(*nearest)}
+
+    def api_points_within(self, data):
+        found = self.controller.positions_within(
+            self._effector_location(data["location"]), data["radius"]
+        )
+        return {"points": [self._format_point(*f) for f in found]}
+
+    def api_speed(self, data):
+        self.controller.set_speed(data["speed"])
+        return {"speed": self.controller.speed}
+
     def api_elbow(self):
         self.controller.on_elbow()
-        return { "elbow": self.controller.elbow }
+        return {"elbow": self.controller.elbow, "auto": self.controller.auto_elbow}
+
+    def api_elbow_auto(self, data):
+        # Toggling the elbow by hand turns automatic selection off, this turns it back on
+        self.controller.auto_elbow = bool(data["auto"])
+        return {"elbow": self.controller.elbow, "auto": self.controller.auto_elbow}
 
     def api_flail(self):
         self.controller.on_flail()
@@ -124,30 +235,87 @@ class RobotHTTPRequestHandler(RoutingStaticHTTPRequestHandler):
     def api_reset(self):
         self.controller.on_reset()
 
+    def api_stop(self):
+        self.controller.on_stop()
+
+    def api_debug_queue(self):
+        return self.controller.robot.commands.stats()
+
+    def api_debug_queue_reset(self):
+        self.controller.robot.commands.reset_stats()
+        return {}
+
+    def api_debug_shadow(self):
+        # Settings the robot believes the controller has, and round trips skipped because of it
+        return self.controller.robot.shadow_stats()
+
+    def api_debug_trace(self):
+        return self.controller.tracer.chrome_trace()
+
+    def api_debug_trace_clear(self):
+        self.controller.tracer.clear()
+        return {}
+
+
 class ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
     """Threaded HTTP Server."""
 
-def run(server_class: HTTPServer, handler_class: RobotHTTPRequestHandler, config: Config=Config()):
+    # Keep-alive connections park a thread each, don't let them block shutdown
+    daemon_threads = True
+
+
+def create_server(
+    server_class: HTTPServer,
+    handler_class: RobotHTTPRequestHandler,
+    config: Config = Config(),
+) -> HTTPServer:
     port = int(config.http_port)
-    server_address = ('', port)
+    server_address = ("", port)
 
     robot_main = Main(config)
     robot_main.initialize()
     controller = robot_main.controller()
 
+    threading.Thread(
+        target=start_websocket_server, args=(robot_main.state,), daemon=True
+    ).start()
+
+    return server_class(server_address, handler_factory(handler_class, controller))
+
+
+def handler_factory(
+    handler_class: RobotHTTPRequestHandler, controller: ControllerDelegate
+):
     base_path = os.path.realpath(os.path.join(os.path.dirname(__file__), "..", "html"))
-    parameterized_handler = partial(handler_class, controller, directory=base_path)
+    return partial(handler_class, controller, directory=base_path)
+
 
-    httpd = server_class(server_address, parameterized_handler)
-    print(f'Starting server on port {port}')
+def run(
+    server_class: HTTPServer,
+    handler_class: RobotHTTPRequestHandler,
+    config: Config = Config(),
+):
+    httpd = create_server(server_class, handler_class, config)
+    log.info("Starting server on port %d", httpd.server_address[1])
     httpd.serve_forever()
 
+
 def main():
     env_file = ".env"
     config = Config.from_env(env_file) if env_exists(env_file) else Config()
+    setup_logging(config.log_level)
+
+    if int(config.http_workers) > 1:
+        from .workers import run_workers
+
+        run_workers(RobotHTTPRequestHandler, config)
+        return
+    run(
+        server_class=ThreadingHTTPServer,
+        handler_class=RobotHTTPRequestHandler,
+        config=config,
+    )
 
-    threading.Thread(target=start_websocket_server, daemon=True).start()
-    run(server_class=ThreadingHTTPServer, handler_class=RobotHTTPRequestHandler, config=config)
 
-if __name__ == '__main__':
+if __name__ == "__main__":
     main()
@@ -1,61 +1,206 @@
+import inspect
 import json
+import logging
+import struct
+from concurrent.futures import CancelledError
 from http.server import SimpleHTTPRequestHandler
 from urllib.parse import urlparse, parse_qs
 
+from staubli.trace import tracer
+
+log = logging.getLogger(__name__)
+access_log = logging.getLogger("staubli.http.access")
+
+# Little endian float64 array, values in response key order
+PACKED_FLOATS = "application/x-packed-floats"
+
+# Request bodies handed to the api as a stream instead of parsed as JSON
+STREAMED_TYPES = ("text/csv", "text/x-gcode", "application/octet-stream")
+
+
+class RequestBody:
+    """Lines of a request body, read from the socket as they are iterated."""
+
+    def __init__(self, rfile, length: int):
+        self.rfile = rfile
+        self.remaining = length
+
+    def __iter__(self):
+        while self.remaining > 0:
+            line = self.rfile.readline(min(self.remaining, 65536))
+            if not line:
+                break
+            self.remaining -= len(line)
+            yield line
+
+    def drain(self):
+        while self.remaining > 0:
+            data = self.rfile.read(min(self.remaining, 65536))
+            if not data:
+                break
+            self.remaining -= len(data)
+
+
+def _flatten_floats(response, values: list[float]) -> bool:
+    if isinstance(response, dict):
+        response = response.values()
+    elif isinstance(response, (int, float)):
+        values.append(response)
+        return True
+    elif not isinstance(response, (list, tuple)):
+        return False
+
+    for item in response:
+        if not _flatten_floats(item, values):
+            return False
+    return True
+
+
 class RoutingStaticHTTPRequestHandler(SimpleHTTPRequestHandler):
     base_path: str
 
+    # Keep connections open between api calls, every response sends a Content-Length
+    protocol_version = "HTTP/1.1"
+    # Seconds an idle keep-alive connection holds its thread
+    timeout = 60
+    # Exceptions that mean the request was at fault, by status code
+    error_statuses: dict[type, int] = {}
+
     extensions_map = {
-        '.manifest': 'text/cache-manifest',
-	    '.html': 'text/html',
-        '.png': 'image/png',
-        '.jpg': 'image/jpg',
-        '.svg':	'image/svg+xml',
-        '.css':	'text/css',
-        '.js':	'application/x-javascript',
-        '': 'application/octet-stream', # Default
+        ".manifest": "text/cache-manifest",
+        ".html": "text/html",
+        ".png": "image/png",
+        ".jpg": "image/jpg",
+        ".svg": "image/svg+xml",
+        ".css": "text/css",
+        ".js": "application/x-javascript",
+        "": "application/octet-stream",  # Default
     }
 
     def do_GET(self):
+        with tracer.span("GET " + urlparse(self.path).path, "http"):
+            self._do_GET()
+
+    def do_PUT(self):
+        with tracer.span("PUT " + urlparse(self.path).path, "http"):
+            self._do_PUT()
+
+    def _do_GET(self):
         parsed_path = urlparse(self.path)
 
         attr = parsed_path.path[1:].replace("/", "_")
         if hasattr(self, attr):
-            response = getattr(self, attr)(**parse_qs(parsed_path.params))
-            self._send_response(200, response)
+            self._call_api(getattr(self, attr), **parse_qs(parsed_path.params))
             return
-        
+
         super().do_GET()
 
-    def do_PUT(self):
+    def _do_PUT(self):
         parsed_path = urlparse(self.path)
         attr = parsed_path.path[1:].replace("/", "_")
+
+        content_length = int(self.headers.get("Content-Length", 0))
+        content_type = self.headers.get("Content-Type", "").split(";")[0].strip()
+        if (
+            content_length > 0
+            and content_type in STREAMED_TYPES
+            and hasattr(self, attr)
+        ):
+            body = RequestBody(self.rfile, content_length)
+            try:
+                self._call_api(
+                    getattr(self, attr), body=body, **parse_qs(parsed_path.params)
+                )
+            finally:
+                # Whatever the api didn't read, so the connection can be reused
+                body.drain()
+            return
+
+        # The body has to be consumed even on a 404 so the connection can be reused
+        post_data = self.rfile.read(content_length) if content_length > 0 else b""
+
         if not hasattr(self, attr):
             self._send_404()
             return
-        
+
         api_func = getattr(self, attr)
         attrs = parse_qs(parsed_path.params)
 
-        content_length = int(self.headers['Content-Length'])
-
         if content_length > 0:
-            post_data = self.rfile.read(content_length)
             data = json.loads(post_data)
-            response = api_func(data=data, **attrs)
+            self._call_api(api_func, data=data, **attrs)
         else:
-            response = api_func(**attrs)
+            self._call_api(api_func, **attrs)
+        return
 
+    def _call_api(self, api_func, **kwargs):
+        try:
+            response = api_func(**kwargs)
+        except CancelledError:
+            # Queued robot command dropped by a stop, flail or reset
+            self._send_response(409, {"error": "cancelled"})
+            return
+        except Exception as e:
+            status = next(
+                (s for t, s in self.error_statuses.items() if isinstance(e, t)), 500
+            )
+            if status == 500:
+                self.log_error("%s failed: %r", self.path, e)
+            self._send_response(status, {"error": str(e) or type(e).__name__})
+            return
+
+        if inspect.isgenerator(response):
+            self._send_stream(response)
+            return
         self._send_response(200, response)
-        return
 
+    def log_message(self, format, *args):
+        # BaseHTTPRequestHandler writes straight to stderr, go through the log queue instead
+        access_log.info("%s - %s", self.address_string(), format % args)
+
+    def log_error(self, format, *args):
+        log.error("%s - %s", self.address_string(), format % args)
 
     def _send_404(self):
         self._send_response(404, {})
 
+    def _encode_response(self, response) -> tuple[str, bytes]:
+        if PACKED_FLOATS in self.headers.get("Accept", ""):
+            values = []
+            if _flatten_floats(response, values):
+                return PACKED_FLOATS, struct.pack(f"<{len(values)}d", *values)
+
+        return "application/json", json.dumps(response, separators=(",", ":")).encode(
+            "utf-8"
+        )
+
     def _send_response(self, status_code, response):
+        content_type, body = self._encode_response(response)
+
         self.send_response(status_code)
-        self.send_header('Content-type', 'application/json')
+        self.send_header("Content-type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Vary", "Accept")
         self.end_headers()
 
-        self.wfile.write(json.dumps(response).encode('utf-8'))
+        self.wfile.write(body)
+
+    def _send_stream(self, chunks):
+        """Send each text chunk as it is produced using chunked transfer encoding."""
+        self.send_response(200)
+        self.send_header("Content-type", "text/plain; charset=utf-8")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        try:
+            for chunk in chunks:
+                data = chunk.encode("utf-8")
+                if data:
+                    self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+                    self.wfile.flush()
+        except Exception as e:
+            # Too late for a status code, drop the connection so the client sees it
+            self.log_error("%s failed while streaming: %r", self.path, e)
+            self.close_connection = True
+            return
+        self.wfile.write(b"0\r\n\r\n")
@@ -1,43 +1,95 @@
 import json
+import logging
+import queue
+import threading
+from functools import partial
 import websockets.sync.server
 
+log = logging.getLogger(__name__)
+
 # Store connected WebSocket clients
 clients = set()
+# Clients that sent {"subscribe": "state"}, they receive versioned state deltas
+state_clients = set()
+# State deltas are sent from here so a slow client never holds up the robot thread
+state_messages = queue.Queue()
+
 
 def broadcast_to_websockets(payload):
     """Sends a message to all connected WebSocket clients."""
     disconnected_clients = set()
-    for client in clients:
+    # Handler threads add and remove clients while we send
+    for client in list(clients):
         try:
             msg = json.dumps(payload)
             client.send(msg)
         except Exception as e:
-            print(e)
-            print("disconnected!")
+            log.info("disconnected: %s", e)
             disconnected_clients.add(client)  # Remove disconnected clients
 
     for client in disconnected_clients:
-        clients.remove(client)
+        clients.discard(client)
+
+
+def send_state_messages():
+    """Sends queued state deltas to subscribed WebSocket clients."""
+    while True:
+        msg = json.dumps({"channel": "state", **state_messages.get()})
+        for client in list(state_clients):
+            try:
+                client.send(msg)
+            except Exception as e:
+                log.info("state subscriber disconnected: %s", e)
+                state_clients.discard(client)
+
+
+def subscribe_state(state, ws):
+    # Deltas at or below the snapshot version are already included in it,
+    # clients ignore those and resubscribe if they ever see a gap. There is
+    # no resuming from a version, each worker process numbers its own
+    # deltas, so every subscribe starts from a snapshot
+    state_clients.add(ws)
+    ws.send(json.dumps({"channel": "state", **state.snapshot()}))
 
 
-def websocket_handler(ws):
+def websocket_handler(state, ws):
     """Handles incoming WebSocket connections."""
-    print("New WebSocket connection")
+    log.info("New WebSocket connection")
     clients.add(ws)
     try:
         for message in ws:
-            print(f"WebSocket received: {message}")
+            log.debug("WebSocket received: %s", message)
+            try:
+                request = json.loads(message)
+            except json.JSONDecodeError:
+                continue
+            if state is not None and request.get("subscribe") == "state":
+                subscribe_state(state, ws)
     finally:
-        clients.remove(ws)
-        print("WebSocket client disconnected")
+        clients.discard(ws)
+        state_clients.discard(ws)
+        log.info("WebSocket client disconnected")
+
+
+def start_websocket_server(state=None, sock=None):
+    """Serve on port 8765, or on an already listening sock shared between processes."""
+    if state is not None:
+        state.subscribe(state_messages.put)
+        threading.Thread(target=send_state_messages, daemon=True).start()
+
+    handler = partial(websocket_handler, state)
+    if sock is not None:
+        server = websockets.sync.server.serve(handler, sock=sock)
+    else:
+        server = websockets.sync.server.serve(handler, "", 8765)
+    server.serve_forever()
 
-def start_websocket_server():
-    server = websockets.sync.server.serve(websocket_handler, "", 8765)
-    server.serve_forever() 
 
 class WebsocketWrapper:
-    def __init__(self, wrapped):
+    def __init__(self, wrapped, sink=broadcast_to_websockets):
         self.wrapped = wrapped
+        # Where serial traffic goes, other processes in multi-process mode
+        self.sink = sink
 
     @property
     def in_waiting(self):
@@ -47,16 +99,15 @@ class WebsocketWrapper:
         response = self.wrapped.readline()
         self.broadcast("readline", response)
         return response
+
     def read(self, count):
         response = self.wrapped.read(count)
         self.broadcast("read", response)
         return response
+
     def write(self, cmd_b: bytes):
         self.broadcast("write", cmd_b)
         return self.wrapped.write(cmd_b)
 
     def broadcast(self, mode, bytes: bytes):
-        broadcast_to_websockets({
-            "mode": mode,
-            "msg": bytes.decode("ascii")
-        })
\ No newline at end of file
+        self.sink({"mode": mode, "msg": bytes.decode("ascii")})
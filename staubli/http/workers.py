@@ -0,0 +1,392 @@
+"""
+Multi-process mode: one process owns the robot, a pool serves HTTP and websockets.
+
+The owner runs Robot, the serial port and the CommandQueue and nothing
+else, so JSON encoding, static files and websocket fan-out in the workers
+never hold the GIL the serial thread needs. State reaches the workers
+through a SharedState segment, commands reach the owner through one IPC
+queue and results come back on a queue per worker. Taught positions and
+trace spans also live in the owner, so every worker sees the same ones.
+
+Enabled with HTTP_WORKERS above 1.
+"""
+
+import itertools
+import logging
+import multiprocessing
+import socket
+import threading
+import time
+from concurrent.futures import Future, InvalidStateError
+from dataclasses import dataclass
+from functools import partial
+
+from staubli.config import Config
+from staubli.log import setup_logging
+from staubli.robot.commands import QueuedRobot
+from staubli.robot.data import Positions
+from staubli.robot.main import ControllerDelegate, Main
+from staubli.robot.shared import SharedState
+from staubli.robot.state import StatePublisher
+from staubli.trace import tracer
+from .main import ThreadingHTTPServer, handler_factory
+from .websockets import broadcast_to_websockets, start_websocket_server
+
+log = logging.getLogger(__name__)
+
+WEBSOCKET_PORT = 8765
+# Seconds between checks of the shared state version in a worker
+POLL_INTERVAL = 0.02
+
+
+@dataclass(frozen=True)
+class Callback:
+    """Stands in for a callable argument, the owner sends its calls back to the worker."""
+
+    index: int
+
+
+class RemoteCommands:
+    """The CommandQueue methods the api uses, run in the owner."""
+
+    def __init__(self, robot: "RemoteRobot"):
+        self.robot = robot
+
+    def stop(self) -> int:
+        return self.robot.submit("commands.stop").result()
+
+    def stats(self) -> dict:
+        return self.robot.submit("commands.stats").result()
+
+    def reset_stats(self):
+        return self.robot.submit("commands.reset_stats").result()
+
+
+class RemotePositions:
+    """The owner's Positions, the only process that writes points.json."""
+
+    def __init__(self, robot: "RemoteRobot"):
+        self.robot = robot
+
+    def __len__(self) -> int:
+        return self.robot.submit("positions.__len__").result()
+
+    def __getitem__(self, index: int):
+        return self.robot.submit("positions.__getitem__", index).result()
+
+    def teach(self, location):
+        return self.robot.submit("positions.teach", location).result()
+
+    def nearest(self, location):
+        return self.robot.submit("positions.nearest", location).result()
+
+    def within(self, location, radius: float):
+        return self.robot.submit("positions.within", location, radius).result()
+
+
+class RemoteTracer:
+    """The owner's serial and robot spans together with this worker's http ones."""
+
+    def __init__(self, robot: "RemoteRobot"):
+        self.robot = robot
+
+    def chrome_trace(self) -> dict:
+        trace = self.robot.submit("tracer.chrome_trace").result()
+        # perf_counter is the system monotonic clock, both processes share it
+        trace["traceEvents"].extend(tracer.chrome_trace()["traceEvents"])
+        return trace
+
+    def clear(self):
+        self.robot.submit("tracer.clear").result()
+        tracer.clear()
+
+
+class RemoteRobot:
+    """QueuedRobot lookalike for a worker process, calls run in the owner process."""
+
+    def __init__(self, worker: int, requests, responses):
+        self.worker = worker
+        self.requests = requests
+        self.responses = responses
+        self.commands = RemoteCommands(self)
+        self._ids = itertools.count()
+        self._pending: dict[int, tuple[Future, list]] = {}
+        self._lock = threading.Lock()
+        threading.Thread(target=self._receive, name="ipc", daemon=True).start()
+
+    def submit(self, name: str, *args) -> Future:
+        future = Future()
+        callbacks = [arg for arg in args if callable(arg)]
+        sent = []
+        for arg in args:
+            sent.append(Callback(callbacks.index(arg)) if callable(arg) else arg)
+
+        request = next(self._ids)
+        with self._lock:
+            self._pending[request] = (future, callbacks)
+        self.requests.put((self.worker, request, name, tuple(sent)))
+        future.add_done_callback(partial(self._forward_cancel, request))
+        return future
+
+    def _forward_cancel(self, request: int, future: Future):
+        if not future.cancelled():
+            return
+        with self._lock:
+            # Still pending means it was cancelled here, e.g. by feed, not by the owner's reply
+            if self._pending.pop(request, None) is None:
+                return
+        self.requests.put((self.worker, request, "cancel", ()))
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+
+        def call(*args):
+            return self.submit(name, *args).result()
+
+        return call
+
+    def _receive(self):
+        while True:
+            message = self.responses.get()
+            if message[0] == "serial":
+                broadcast_to_websockets(message[1])
+                continue
+
+            kind, request, *rest = message
+            with self._lock:
+                if request not in self._pending:
+                    # Cancelled here, the owner's reply is too late to matter
+                    continue
+                future, callbacks = self._pending[request]
+                if kind != "callback":
+                    del self._pending[request]
+
+            if kind == "callback":
+                index, args = rest
+                callbacks[index](*args)
+                continue
+            try:
+                if kind == "cancelled":
+                    future.cancel()
+                elif kind == "error":
+                    future.set_exception(RuntimeError(rest[0]))
+                else:
+                    future.set_result(rest[0])
+            except InvalidStateError:
+                # Cancelled here while the reply was on its way
+                pass
+
+
+class WorkerController(ControllerDelegate):
+    """ControllerDelegate whose speed and elbow are the owner's, read from shared memory."""
+
+    def __init__(
+        self,
+        robot: RemoteRobot,
+        state: StatePublisher,
+        shared: SharedState,
+        reach_map: str = None,
+        toolpath_dir: str = None,
+    ):
+        self.shared = shared
+        super().__init__(
+            robot, None, state, reach_map, RemotePositions(robot), toolpath_dir
+        )
+        self.tracer = RemoteTracer(robot)
+
+    @property
+    def speed(self):
+        return self.shared.read()[1]["speed"]
+
+    @speed.setter
+    def speed(self, value):
+        # The owner publishes the speed once the robot has it
+        pass
+
+    @property
+    def elbow(self):
+        return self.shared.read()[1]["elbow"]
+
+    @elbow.setter
+    def elbow(self, value):
+        pass
+
+
+def _follow(shared: SharedState, publisher: StatePublisher):
+    """Feed a worker's own StatePublisher from shared memory, for its websocket clients."""
+    version = shared.version()
+    while True:
+        time.sleep(POLL_INTERVAL)
+        if shared.version() == version:
+            continue
+        version, state = shared.read()
+        publisher.update(**state)
+
+
+def _worker(
+    handler_class,
+    config: Config,
+    worker: int,
+    http: socket.socket,
+    websocket: socket.socket,
+    shared: SharedState,
+    requests,
+    responses,
+):
+    setup_logging(config.log_level)
+    while shared.sequence() == 0:
+        # The owner is still connecting to the robot
+        time.sleep(0.05)
+
+    state = StatePublisher(**shared.read()[1])
+    threading.Thread(target=_follow, args=(shared, state), daemon=True).start()
+    threading.Thread(
+        target=start_websocket_server, args=(state, websocket), daemon=True
+    ).start()
+
+    # Each worker maps the reachability map itself, the pages are shared
+    controller = WorkerController(
+        RemoteRobot(worker, requests, responses),
+        state,
+        shared,
+        config.reach_map,
+        config.toolpath_dir,
+    )
+    server = ThreadingHTTPServer(
+        http.getsockname(),
+        handler_factory(handler_class, controller),
+        bind_and_activate=False,
+    )
+    server.socket.close()
+    server.socket = http
+    log.info("worker %d serving", worker)
+    server.serve_forever()
+
+
+def _reply(reply, request: int, future: Future):
+    if future.cancelled():
+        reply(("cancelled", request))
+    elif future.exception() is not None:
+        # Exceptions don't all pickle, the message is what the api reports anyway
+        e = future.exception()
+        reply(("error", request, str(e) or type(e).__name__))
+    else:
+        reply(("result", request, future.result()))
+
+
+def _callback(reply, request: int, index: int, *args):
+    reply(("callback", request, index, args))
+
+
+def _call(owner, reply, request: int, name: str, args):
+    try:
+        reply(("result", request, getattr(owner, name)(*args)))
+    except Exception as e:
+        reply(("error", request, str(e) or type(e).__name__))
+
+
+def serve_robot(robot: QueuedRobot, requests, responses: list, positions: Positions):
+    """Run commands from the workers until the process ends."""
+    # Called here rather than queued, they don't touch the robot
+    owners = {"positions": positions, "tracer": tracer}
+    # Robot commands not done yet, by worker and request, so a worker can cancel them
+    running: dict[tuple[int, int], Future] = {}
+    while True:
+        worker, request, name, args = requests.get()
+        reply = responses[worker].put
+        if name == "cancel":
+            future = running.get((worker, request))
+            if future is not None:
+                future.cancel()
+            continue
+
+        args = [
+            (
+                partial(_callback, reply, request, arg.index)
+                if isinstance(arg, Callback)
+                else arg
+            )
+            for arg in args
+        ]
+        if name.startswith("commands."):
+            # stop waits for the command in flight, don't hold up the others
+            threading.Thread(
+                target=_call,
+                args=(robot.commands, reply, request, name[len("commands.") :], args),
+                daemon=True,
+            ).start()
+            continue
+        owner, _, method = name.partition(".")
+        if owner in owners:
+            _call(owners[owner], reply, request, method, args)
+            continue
+
+        try:
+            future = robot.submit(name, *args)
+        except Exception as e:
+            reply(("error", request, str(e) or type(e).__name__))
+            continue
+        running[(worker, request)] = future
+        future.add_done_callback(
+            lambda _, key=(worker, request): running.pop(key, None)
+        )
+        future.add_done_callback(partial(_reply, reply, request))
+
+
+def _listen(port: int) -> socket.socket:
+    sock = socket.create_server(("", port), reuse_port=False)
+    sock.set_inheritable(True)
+    return sock
+
+
+def run_workers(handler_class, config: Config):
+    count = int(config.http_workers)
+    # Workers inherit the listening sockets, they fork before the robot's threads start
+    context = multiprocessing.get_context("fork")
+    http = _listen(int(config.http_port))
+    websocket = _listen(WEBSOCKET_PORT)
+    shared = SharedState(create=True)
+    requests = context.Queue()
+    responses = [context.Queue() for _ in range(count)]
+
+    workers = [
+        context.Process(
+            target=_worker,
+            args=(
+                handler_class,
+                config,
+                i,
+                http,
+                websocket,
+                shared,
+                requests,
+                responses[i],
+            ),
+            name=f"http-{i}",
+            daemon=True,
+        )
+        for i in range(count)
+    ]
+    for worker in workers:
+        worker.start()
+    http.close()
+    websocket.close()
+
+    def serial_sink(payload):
+        for queue in responses:
+            queue.put(("serial", payload))
+
+    robot_main = Main(config, serial_sink)
+    robot_main.initialize()
+    shared.publish_from(robot_main.state)
+    log.info("robot owner serving %d workers on port %s", count, config.http_port)
+    try:
+        serve_robot(
+            QueuedRobot(robot_main.commands), requests, responses, Positions.load()
+        )
+    finally:
+        for worker in workers:
+            worker.terminate()
+        shared.close()
+        shared.unlink()
@@ -0,0 +1,79 @@
+import atexit
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+import time
+
+# Below DEBUG, for every byte on the serial line
+TRACE = 5
+logging.addLevelName(TRACE, "TRACE")
+
+# Most TRACE records let through per second, the rest are counted and dropped
+TRACE_RATE = 200
+
+log = logging.getLogger(__name__)
+
+
+class RateLimitFilter(logging.Filter):
+    """Drops TRACE records beyond a per second budget so wire logging can't swamp the Pi."""
+
+    def __init__(self, rate: int = TRACE_RATE):
+        super().__init__()
+        self.rate = rate
+        self.window = time.monotonic()
+        self.passed = 0
+        self.dropped = 0
+        # Every thread that logs runs the filter
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > TRACE:
+            return True
+
+        dropped = 0
+        with self._lock:
+            now = time.monotonic()
+            if now - self.window >= 1:
+                dropped = self.dropped
+                self.window = now
+                self.passed = 0
+                self.dropped = 0
+
+            if self.passed >= self.rate:
+                self.dropped += 1
+                allowed = False
+            else:
+                self.passed += 1
+                allowed = True
+
+        if dropped:
+            log.warning("dropped %d trace records", dropped)
+        return allowed
+
+
+def setup_logging(level: str = "INFO") -> logging.handlers.QueueListener:
+    """
+    Route all records through a queue to a stderr writer thread.
+
+    Callers only pay for formatting the record and a queue put, the console
+    write happens off the serial and http threads.
+    """
+    records = queue.SimpleQueue()
+    writer = logging.StreamHandler(sys.stderr)
+    writer.setFormatter(
+        logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s")
+    )
+    listener = logging.handlers.QueueListener(records, writer)
+
+    handler = logging.handlers.QueueHandler(records)
+    handler.addFilter(RateLimitFilter())
+
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(level.upper() if isinstance(level, str) else level)
+
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
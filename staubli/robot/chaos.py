@@ -0,0 +1,159 @@
+"""
+Throughput and recovery time of Robot against a misbehaving emulator.
+
+Each profile runs the same mix of where, small moves and speed changes
+through a Robot on a SerialEmulator injecting that profile's Faults. A
+command is faulted when a fault was injected while it ran or it raised,
+jitter only slows the line and shows in the throughput. Recovery time is
+how long a run of faulted commands held the line, from the first one
+starting to the next clean one starting. Undetected counts where results
+that came back wrong without an error.
+
+    python -m staubli.robot.chaos [--profile errors] [--commands 200]
+"""
+
+import argparse
+import json
+import time
+
+from .machine import EffectorLocation, Robot
+from .serial_emulator import Faults, SerialEmulator
+
+PROFILES = {
+    "clean": {},
+    "errors": {"error": 0.05},
+    "truncated": {"truncate": 0.05},
+    "corrupted": {"corrupt": 0.05},
+    "stalls": {"stall": 0.05, "stall_seconds": 0.5},
+    "disconnects": {"disconnect": 0.02, "disconnect_seconds": 1.0},
+    "jitter": {"jitter": 0.5},
+    "everything": {
+        "error": 0.02,
+        "truncate": 0.02,
+        "corrupt": 0.02,
+        "stall": 0.02,
+        "disconnect": 0.01,
+        "jitter": 0.2,
+        "stall_seconds": 0.5,
+        "disconnect_seconds": 1.0,
+    },
+}
+
+# Seconds Robot waits for a lost prompt, the default waits forever
+READ_TIMEOUT = 1.0
+
+# Small moves either side of where the emulator starts
+_TARGETS = (
+    EffectorLocation(0.0, 0.0, 900.0, 180.0, 0.0, 180.0),
+    EffectorLocation(50.0, 0.0, 900.0, 180.0, 0.0, 180.0),
+)
+
+
+def _workload(count: int):
+    for i in range(count):
+        kind = i % 4
+        if kind == 3:
+            yield "speed", (20 if i % 8 == 3 else 30,)
+        elif kind == 1:
+            yield "jog_absolute", (_TARGETS[(i // 4) % 2],)
+        else:
+            yield "where", ()
+
+
+def _distribution(samples: list[float]) -> dict:
+    ordered = sorted(samples)
+    return {
+        "count": len(ordered),
+        "p50_ms": ordered[len(ordered) // 2] if ordered else None,
+        "p95_ms": ordered[int(len(ordered) * 0.95)] if ordered else None,
+        "max_ms": ordered[-1] if ordered else None,
+    }
+
+
+def _where_matches(result, emulator: SerialEmulator) -> bool:
+    effector, joints = result
+    expected = emulator.effector_location.to_list() + emulator.joint_location.to_list()
+    return all(
+        abs(a - b) < 0.001
+        for a, b in zip(effector.to_list() + joints.to_list(), expected)
+    )
+
+
+def _injected(faults: Faults) -> int:
+    return sum(count for name, count in faults.injected.items() if name != "jitter")
+
+
+def run(
+    faults: Faults,
+    commands: int = 200,
+    baud: float = 9600,
+    read_timeout: float = READ_TIMEOUT,
+) -> dict:
+    emulator = SerialEmulator(faults)
+    emulator.baud = baud
+    robot = Robot(emulator)
+    robot.read_timeout = read_timeout
+
+    failed = 0
+    undetected = 0
+    recoveries = []
+    faulted_since = None
+    began = time.perf_counter()
+    for name, args in _workload(commands):
+        injected = _injected(faults)
+        started = time.perf_counter()
+        try:
+            result = getattr(robot, name)(*args)
+            raised = False
+        except Exception:
+            failed += 1
+            raised = True
+
+        faulted = raised or _injected(faults) != injected
+        if faulted:
+            if faulted_since is None:
+                faulted_since = started
+            if not raised and name == "where" and not _where_matches(result, emulator):
+                undetected += 1
+        elif faulted_since is not None:
+            recoveries.append((started - faulted_since) * 1000)
+            faulted_since = None
+    seconds = time.perf_counter() - began
+
+    return {
+        "commands": commands,
+        "seconds": seconds,
+        "throughput_per_s": (commands - failed) / seconds,
+        "failed": failed,
+        "undetected": undetected,
+        "injected": dict(faults.injected),
+        "recovery": _distribution(recoveries),
+    }
+
+
+def report(
+    profiles=PROFILES, commands: int = 200, baud: float = 9600, seed: int = 0
+) -> dict:
+    return {
+        name: run(Faults(seed=seed, **settings), commands, baud)
+        for name, settings in profiles.items()
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--profile",
+        action="append",
+        choices=PROFILES,
+        help="repeat for several, all by default",
+    )
+    parser.add_argument("--commands", type=int, default=200)
+    parser.add_argument("--baud", type=float, default=9600)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    profiles = (
+        {name: PROFILES[name] for name in args.profile} if args.profile else PROFILES
+    )
+    print(json.dumps(report(profiles, args.commands, args.baud, args.seed), indent=2))
@@ -0,0 +1,193 @@
+import itertools
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from enum import IntEnum
+from typing import Optional
+
+from staubli.trace import tracer
+
+log = logging.getLogger(__name__)
+
+
+class Priority(IntEnum):
+    EMERGENCY = 0
+    RECOVERY = 1
+    NORMAL = 2
+
+
+# Robot methods that skip ahead of pending motion, everything else waits its turn
+PRIORITIES = {
+    "flail": Priority.EMERGENCY,
+    "enable_power": Priority.RECOVERY,
+}
+# Robot methods that are dropped when an emergency or recovery command arrives
+MOTION = {"jog_absolute", "jog_transform", "jog_joint", "run_program"}
+
+# Dispatch latencies kept per priority for stats
+LATENCY_SAMPLES = 100
+
+
+class Command:
+    __slots__ = ("priority", "fn", "args", "motion", "future", "submitted")
+
+    def __init__(self, priority: Priority, fn, args, motion: bool):
+        self.priority = priority
+        self.fn = fn
+        self.args = args
+        self.motion = motion
+        self.future = Future()
+        self.submitted = time.perf_counter_ns()
+
+
+class CommandQueue:
+    """
+    Serializes access to the robot on a single worker thread.
+
+    Commands run one at a time in priority order, so the serial byte stream is
+    never interleaved. Emergency and recovery commands cancel queued motion and
+    are dispatched as soon as the command in flight returns. An emergency also
+    interrupts motion in flight where the robot supports it, so a long program
+    doesn't hold it back until the program ends.
+    """
+
+    def __init__(self, robot, tracker=None):
+        self.robot = robot
+        # Optional RobotStateTracker told about every command that runs
+        self.tracker = tracker
+        self._queue = queue.PriorityQueue()
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        self._pending_motion: set[Command] = set()
+        self._running: Optional[Command] = None
+        self.latency = {
+            priority: deque(maxlen=LATENCY_SAMPLES) for priority in Priority
+        }
+        self.cancelled = 0
+        self._thread = threading.Thread(target=self._run, name="robot", daemon=True)
+        self._thread.start()
+
+    def submit(self, priority: Priority, fn, *args, motion: bool = False) -> Future:
+        command = Command(priority, fn, args, motion)
+        with self._lock:
+            if priority < Priority.NORMAL:
+                self._cancel_motion()
+            if priority == Priority.EMERGENCY:
+                self._interrupt_motion()
+            if motion:
+                self._pending_motion.add(command)
+        self._queue.put((priority, next(self._counter), command))
+        return command.future
+
+    def stop(self) -> int:
+        """Cancel queued motion and wait for the command in flight, returns the number cancelled."""
+        with self._lock:
+            cancelled = self._cancel_motion()
+        self.submit(Priority.EMERGENCY, lambda: None).result()
+        return cancelled
+
+    def _cancel_motion(self) -> int:
+        cancelled = sum(
+            1 for command in self._pending_motion if command.future.cancel()
+        )
+        self._pending_motion.clear()
+        self.cancelled += cancelled
+        return cancelled
+
+    def _interrupt_motion(self):
+        running = self._running
+        interrupt = getattr(self.robot, "interrupt", None)
+        if running is not None and running.motion and interrupt is not None:
+            interrupt()
+
+    def _run(self):
+        while True:
+            _, _, command = self._queue.get()
+            with self._lock:
+                self._pending_motion.discard(command)
+                if not command.future.set_running_or_notify_cancel():
+                    continue
+                self._running = command
+
+            # Time from submit to dispatch, the first byte follows immediately
+            dispatched = time.perf_counter_ns()
+            self.latency[command.priority].append(
+                (dispatched - command.submitted) / 1e6
+            )
+            tracer.record(
+                "queue.wait",
+                "queue",
+                command.submitted,
+                dispatched,
+                {"priority": command.priority.name},
+            )
+
+            if self.tracker is None:
+                self._execute(command)
+                continue
+
+            self.tracker.dispatched()
+            self._execute(command)
+            if self._queue.empty():
+                try:
+                    self.tracker.idle(self.robot)
+                except Exception:
+                    log.exception("refreshing robot state failed")
+
+    def _execute(self, command: Command):
+        try:
+            result = command.fn(*command.args)
+        except BaseException as e:
+            command.future.set_exception(e)
+            return
+        finally:
+            self._running = None
+
+        if self.tracker is not None:
+            self.tracker.completed(command.fn.__name__, command.args, result)
+        command.future.set_result(result)
+
+    def reset_stats(self):
+        for samples in self.latency.values():
+            samples.clear()
+        self.cancelled = 0
+
+    def stats(self) -> dict:
+        stats = {"pending": self._queue.qsize(), "cancelled": self.cancelled}
+        for priority, samples in self.latency.items():
+            ordered = sorted(samples)
+            stats[priority.name.lower()] = {
+                "count": len(ordered),
+                "last_ms": samples[-1] if samples else None,
+                "p95_ms": ordered[int(len(ordered) * 0.95)] if ordered else None,
+                "max_ms": ordered[-1] if ordered else None,
+            }
+        return stats
+
+
+class QueuedRobot:
+    """Robot lookalike whose method calls go through a CommandQueue."""
+
+    def __init__(self, commands: CommandQueue):
+        self.commands = commands
+
+    def submit(self, name: str, *args) -> Future:
+        return self.commands.submit(
+            PRIORITIES.get(name, Priority.NORMAL),
+            getattr(self.commands.robot, name),
+            *args,
+            motion=name in MOTION,
+        )
+
+    def __getattr__(self, name):
+        attr = getattr(self.commands.robot, name)
+        if name.startswith("_") or not callable(attr):
+            return attr
+
+        def call(*args):
+            return self.submit(name, *args).result()
+
+        return call
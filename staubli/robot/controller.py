@@ -50,6 +50,8 @@ def handle_char(b, delegate):
         delegate.on_next_position()
     elif b == ",":
         delegate.on_previous_position()
+    elif b == "n":
+        delegate.on_nearest_position()
 
 
 def handle_chunk(chunk, delegate):
@@ -1,7 +1,12 @@
 import json
+import logging
 import os
+import threading
 
 from .machine import EffectorLocation
+from .spatial import PointIndex
+
+log = logging.getLogger(__name__)
 
 
 def write(items: list[(str, EffectorLocation)]):
@@ -22,5 +27,50 @@ def read() -> list[(str, EffectorLocation)]:
                 for x in json.load(f)
             ]
     except json.JSONDecodeError as e:
-        print("error loading points, returning empty array")
+        log.error("error loading points, returning empty array")
         return []
+
+
+# Taught points closer than this (mm, orientation weighted) are the same point
+DUPLICATE_DISTANCE = 1.0
+
+
+class Positions:
+    """Taught points, indexed for nearest lookups and saved on every change."""
+
+    def __init__(self, items: list[(str, EffectorLocation)]):
+        self.items = items
+        self.index = PointIndex()
+        self.index.build((p[1], i) for i, p in enumerate(items))
+        # HTTP threads teach concurrently
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def load() -> "Positions":
+        positions = Positions(read())
+        log.info("loaded %d positions", len(positions))
+        return positions
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def __getitem__(self, index: int) -> tuple[str, EffectorLocation]:
+        return self.items[index]
+
+    def teach(self, location: EffectorLocation) -> tuple[int, bool]:
+        """Index of the point at location, and whether it is new rather than already taught."""
+        with self._lock:
+            nearest = self.index.nearest(location)
+            if nearest is not None and nearest[0] <= DUPLICATE_DISTANCE:
+                return nearest[1], False
+
+            self.items.append(("position " + str(len(self.items) + 1), location))
+            self.index.insert(location, len(self.items) - 1)
+            write(self.items)
+            return len(self.items) - 1, True
+
+    def nearest(self, location: EffectorLocation):
+        return self.index.nearest(location)
+
+    def within(self, location: EffectorLocation, radius: float):
+        return self.index.within(location, radius)
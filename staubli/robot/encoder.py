@@ -0,0 +1,136 @@
+"""
+Shortest equivalent V+ text for the commands Robot sends.
+
+At 9600 baud every character costs ~1 ms out and ~1 ms again as the echo
+comes back, so numbers are trimmed, arguments aren't padded and a set
+followed by a move is sent as one move of the location expression.
+
+    python -m staubli.robot.encoder   # bytes and ms saved per command type
+"""
+
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    # machine imports this module
+    from .machine import EffectorLocation, JointLocation
+
+# 8 data bits plus start and stop bit
+SECONDS_PER_BYTE = 10 / 9600
+
+# Monitor commands the controller accepts abbreviated
+ABBREVIATIONS = {
+    "enable power": "en po",
+}
+
+
+def number(value: float, places: int = 3) -> str:
+    """985.000 -> 985, -0.0001 -> 0, 12.500 -> 12.5"""
+    text = f"{value:.{places}f}"
+    if "." in text:
+        text = text.rstrip("0").rstrip(".")
+    if text == "-0":
+        return "0"
+    return text
+
+
+def arguments(values: list[float]) -> str:
+    return ",".join(number(v) for v in values)
+
+
+def trans(location: "EffectorLocation") -> str:
+    return f"trans({arguments(location.to_list())})"
+
+
+def ppoint(location: "JointLocation") -> str:
+    return f"#PPOINT({arguments(location.to_list())})"
+
+
+def monitor(command: str) -> str:
+    return ABBREVIATIONS.get(command, command)
+
+
+def speed(value: float) -> str:
+    return f"speed {number(value, 2)}"
+
+
+def move_absolute(location: "EffectorLocation") -> str:
+    return f"do moves {trans(location)}"
+
+
+def move_relative(location: "EffectorLocation") -> str:
+    return f"do move HERE:{trans(location)}"
+
+
+def move_joints(location: "JointLocation") -> str:
+    return f"do move {ppoint(location)}"
+
+
+def set_tool(location: "EffectorLocation") -> list[str]:
+    # hand.tool is kept as a variable so tool_offset can LISTL it back
+    return [f"do set hand.tool = {trans(location)}", "TOOL hand.tool"]
+
+
+def _legacy(kind: str, value) -> list[str]:
+    """What Robot sent before this encoder, kept for the measurement below."""
+    if kind == "speed":
+        return [f"speed {value:.2f}"]
+    if kind == "move_absolute":
+        return [f"do set jog0 = trans({value.format()})", "do moves jog0"]
+    if kind == "move_relative":
+        return [f"do set jog0 = HERE:trans({value.format()})", "do move jog0"]
+    if kind == "move_joints":
+        return [f"do set #jog1 = #PPOINT({value.format()})", "do move #jog1"]
+    if kind == "set_tool":
+        return [f"do set hand.tool = trans({value.format()})", "TOOL hand.tool"]
+    if kind == "enable_power":
+        return ["en po"]
+
+
+def _compact(kind: str, value) -> list[str]:
+    if kind == "set_tool":
+        return set_tool(value)
+    if kind == "enable_power":
+        return [monitor("enable power")]
+    return [globals()[kind](value)]
+
+
+def samples() -> dict:
+    from .machine import EffectorLocation, JointLocation
+
+    return {
+        "speed": 20,
+        "move_absolute": EffectorLocation(450.0, -120.5, 600.0, 0.0, 90.0, 0.0),
+        "move_relative": EffectorLocation(0.0, 0.0, 10.0, 0.0, 0.0, 0.0),
+        "move_joints": JointLocation(10.0, -80.0, 95.5, 0.0, 30.0, -15.25),
+        "set_tool": EffectorLocation(0.0, 0.0, 125.0, 0.0, 0.0, 0.0),
+        "enable_power": None,
+    }
+
+
+def measure() -> dict:
+    """Bytes, wire ms (sent + echoed) and command exchanges per command type."""
+    report = {}
+    for kind, value in samples().items():
+        legacy = _legacy(kind, value)
+        compact = _compact(kind, value)
+        # Each command is terminated with \r
+        legacy_bytes = sum(len(c) + 1 for c in legacy)
+        compact_bytes = sum(len(c) + 1 for c in compact)
+        report[kind] = {
+            "legacy_bytes": legacy_bytes,
+            "compact_bytes": compact_bytes,
+            "saved_ms": 2 * (legacy_bytes - compact_bytes) * SECONDS_PER_BYTE * 1000,
+            "exchanges_saved": len(legacy) - len(compact),
+        }
+    return report
+
+
+if __name__ == "__main__":
+    print(
+        f"{'command':<14} {'legacy B':>9} {'compact B':>10} {'saved ms':>9} {'round trips':>12}"
+    )
+    for kind, r in measure().items():
+        print(
+            f"{kind:<14} {r['legacy_bytes']:>9} {r['compact_bytes']:>10}"
+            f" {r['saved_ms']:>9.1f} {r['exchanges_saved']:>12}"
+        )
@@ -0,0 +1,303 @@
+"""
+Kinematic model of the RX90/TX90 arm, from urdf/staubli_rx90.
+
+Joint angles in and out are V+ degrees and locations are V+ world
+millimetres, measured from the shoulder like `where` reports them. The
+URDF zero is the arm pointing straight up, which V+ calls (0, -90, 90, 0, 0, 0).
+"""
+
+import math
+from typing import Optional
+
+from .machine import EffectorLocation, JointLocation
+
+UPPER_ARM = 450.0
+FOREARM = 450.0
+# Wrist center to flange
+FLANGE = 85.0
+
+# V+ angle minus URDF angle, degrees
+OFFSETS = (0.0, -90.0, 90.0, 0.0, 0.0, 0.0)
+
+_URDF_LIMITS = [
+    (-3.141592653589793, 3.141592653589793),
+    (-2.2689280275926285, 2.5743606466916362),
+    (-2.530727415391778, 2.530727415391778),
+    (-4.71238898038469, 4.71238898038469),
+    (-2.007128639793479, 2.443460952792061),
+    (-4.71238898038469, 4.71238898038469),
+]
+_URDF_VELOCITIES = [
+    6.981317007977318,
+    6.981317007977318,
+    7.504915783575617,
+    9.42477796076938,
+    8.290313946973065,
+    13.264502315156905,
+]
+
+# V+ degrees
+LIMITS = [
+    (math.degrees(low) + offset, math.degrees(high) + offset)
+    for (low, high), offset in zip(_URDF_LIMITS, OFFSETS)
+]
+# Degrees per second at 100% speed
+VELOCITIES = [math.degrees(v) for v in _URDF_VELOCITIES]
+
+ELBOWS = ("above", "below")
+# Degrees either side of a straight arm that count as either elbow
+STRAIGHT = 1.0
+
+
+def _rz(a: float):
+    c, s = math.cos(a), math.sin(a)
+    return ((c, -s, 0.0), (s, c, 0.0), (0.0, 0.0, 1.0))
+
+
+def _ry(a: float):
+    c, s = math.cos(a), math.sin(a)
+    return ((c, 0.0, s), (0.0, 1.0, 0.0), (-s, 0.0, c))
+
+
+def _mul(a, b):
+    return tuple(
+        tuple(sum(a[i][k] * b[k][j] for k in range(3)) for j in range(3))
+        for i in range(3)
+    )
+
+
+def _transpose(a):
+    return tuple(zip(*a))
+
+
+def _apply(m, v):
+    return tuple(sum(m[i][k] * v[k] for k in range(3)) for i in range(3))
+
+
+def zyz_to_matrix(yaw: float, pitch: float, roll: float):
+    return _mul(
+        _mul(_rz(math.radians(yaw)), _ry(math.radians(pitch))), _rz(math.radians(roll))
+    )
+
+
+def _zyz(m, first_hint: float = 0.0) -> tuple[float, float, float]:
+    """Radians (first, second, third) of a ZYZ rotation, first_hint picks the first angle at a singularity."""
+    second = math.atan2(math.hypot(m[0][2], m[1][2]), m[2][2])
+    if abs(math.sin(second)) < 1e-9:
+        # Only first + third (or first - third when flipped) is defined
+        first = first_hint
+        combined = math.atan2(m[1][0], m[0][0])
+        third = combined - first if m[2][2] > 0 else first - combined
+        return first, second, third
+    return math.atan2(m[1][2], m[0][2]), second, math.atan2(m[2][1], -m[2][0])
+
+
+def matrix_to_zyz(m, yaw_hint: float = 0.0) -> tuple[float, float, float]:
+    return tuple(math.degrees(a) for a in _zyz(m, math.radians(yaw_hint)))
+
+
+def _pose(location: EffectorLocation):
+    return (
+        zyz_to_matrix(location.yaw, location.pitch, location.roll),
+        (location.x, location.y, location.z),
+    )
+
+
+def flange(location: EffectorLocation, tool: Optional[EffectorLocation]):
+    """Flange pose that puts the tool at location."""
+    rotation, position = _pose(location)
+    if tool is None:
+        return rotation, position
+    tool_rotation, tool_position = _pose(tool)
+    rotation = _mul(rotation, _transpose(tool_rotation))
+    offset = _apply(rotation, tool_position)
+    return rotation, tuple(p - o for p, o in zip(position, offset))
+
+
+def to_urdf(joints: JointLocation) -> list[float]:
+    return [math.radians(a - offset) for a, offset in zip(joints.to_list(), OFFSETS)]
+
+
+def from_urdf(angles: list[float]) -> JointLocation:
+    return JointLocation(
+        *(math.degrees(a) + offset for a, offset in zip(angles, OFFSETS))
+    )
+
+
+def within_limits(joints: JointLocation) -> bool:
+    return all(low <= a <= high for a, (low, high) in zip(joints.to_list(), LIMITS))
+
+
+def margin(joints: JointLocation) -> float:
+    """Degrees to the nearest joint limit, negative when past one."""
+    return min(
+        min(a - low, high - a) for a, (low, high) in zip(joints.to_list(), LIMITS)
+    )
+
+
+def elbow(joints: JointLocation) -> str:
+    # Forearm bent up from the upper arm, the elbow sits above the shoulder to wrist line.
+    # A straight arm can go either way, call it above like V+ does after a do ready
+    return "above" if joints.j3 >= OFFSETS[2] - STRAIGHT else "below"
+
+
+def forward(
+    joints: JointLocation, tool: Optional[EffectorLocation] = None
+) -> EffectorLocation:
+    t1, t2, t3, t4, t5, t6 = to_urdf(joints)
+    arm = _mul(_rz(t1), _ry(t2))
+    forearm = _mul(arm, _ry(t3))
+    wrist = _mul(forearm, _rz(t4))
+    rotation = _mul(_mul(wrist, _ry(t5)), _rz(t6))
+
+    position = [0.0, 0.0, 0.0]
+    for m, length in ((arm, UPPER_ARM), (forearm, FOREARM), (rotation, FLANGE)):
+        position = [p + length * m[i][2] for i, p in enumerate(position)]
+
+    if tool is not None:
+        tool_rotation, tool_position = _pose(tool)
+        position = [p + o for p, o in zip(position, _apply(rotation, tool_position))]
+        rotation = _mul(rotation, tool_rotation)
+
+    yaw, pitch, roll = matrix_to_zyz(rotation, math.degrees(t1))
+    return EffectorLocation(position[0], position[1], position[2], yaw, pitch, roll)
+
+
+def _wrap(angle: float, near: float) -> float:
+    """angle plus or minus whole turns, as close to near as possible."""
+    return angle + 2 * math.pi * round((near - angle) / (2 * math.pi))
+
+
+def inverse(
+    location: EffectorLocation,
+    elbow: str = "above",
+    near: Optional[JointLocation] = None,
+    tool: Optional[EffectorLocation] = None,
+) -> Optional[JointLocation]:
+    """
+    Joint angles that reach location with the given elbow, None when out of reach.
+
+    The shoulder can face the wrist or reach back over itself, the wrist
+    has two solutions and j4 and j6 can each turn past a full circle. The
+    one inside the limits with the least travel from near wins, without
+    near the shoulder faces the wrist whenever it can.
+    """
+    rotation, position = flange(location, tool)
+    hint = to_urdf(near) if near is not None else [0.0, 0.0, 0.0, 0.0, 0.0, 0.0]
+
+    wrist = [p - FLANGE * rotation[i][2] for i, p in enumerate(position)]
+    radial = math.hypot(wrist[0], wrist[1])
+    cos_t3 = (radial**2 + wrist[2] ** 2 - UPPER_ARM**2 - FOREARM**2) / (
+        2 * UPPER_ARM * FOREARM
+    )
+    if abs(cos_t3) > 1:
+        return None
+    t3 = math.acos(cos_t3) if elbow == "above" else -math.acos(cos_t3)
+    bend = math.atan2(FOREARM * math.sin(t3), UPPER_ARM + FOREARM * math.cos(t3))
+
+    facing = math.atan2(wrist[1], wrist[0]) if radial > 1e-6 else hint[0]
+    shoulders = [(facing, radial), (facing - math.copysign(math.pi, facing), -radial)]
+    # Without near, reach back only if facing can't make it
+    groups = [shoulders] if near is not None else [shoulders[:1], shoulders[1:]]
+
+    for group in groups:
+        best, best_travel = None, math.inf
+        for t1, reach in group:
+            t2 = math.atan2(reach, wrist[2]) - bend
+            forearm = _mul(_rz(t1), _ry(t2 + t3))
+            t4, t5, t6 = _zyz(_mul(_transpose(forearm), rotation), hint[3])
+            for w4, w5, w6 in ((t4, t5, t6), (t4 + math.pi, -t5, t6 + math.pi)):
+                angles = [t1, t2, t3, _wrap(w4, hint[3]), w5, _wrap(w6, hint[5])]
+                candidate = from_urdf(angles)
+                if not within_limits(candidate):
+                    continue
+                travel = sum(abs(a - h) for a, h in zip(angles, hint))
+                if travel < best_travel:
+                    best, best_travel = candidate, travel
+        if best is not None:
+            return best
+    return None
+
+
+def solutions(
+    location: EffectorLocation,
+    near: Optional[JointLocation] = None,
+    tool: Optional[EffectorLocation] = None,
+) -> dict[str, Optional[JointLocation]]:
+    """Both elbow configurations for location, None for one that can't reach it."""
+    return {e: inverse(location, e, near, tool) for e in ELBOWS}
+
+
+# Degrees of joint travel a change of elbow is worth, ties keep the elbow
+SWITCH_COST = 1.0
+# Solutions closer than this many degrees to a limit pay LIMIT_COST per degree short
+LIMIT_MARGIN = 10.0
+LIMIT_COST = 10.0
+
+
+def travel(a: JointLocation, b: JointLocation) -> float:
+    """Total degrees the joints turn between a and b."""
+    return sum(abs(d) for d in (b - a).to_list())
+
+
+def _cost(joints: JointLocation, near: JointLocation) -> float:
+    return travel(near, joints) + max(0.0, LIMIT_MARGIN - margin(joints)) * LIMIT_COST
+
+
+class ElbowPlanner:
+    """
+    Picks the elbow for each of a stream of effector targets.
+
+    Both configurations are solved for every target and the sequence with
+    the least joint travel wins, with solutions near a limit costed up.
+    A straight line move keeps the configuration it starts in, so a switch
+    is planned as a joint move to the target's solution in the other one
+    and never happens along a straight segment. The planner remembers
+    where its last plan leaves the arm, so a long path can be planned a
+    chunk at a time.
+    """
+
+    def __init__(
+        self, joints: JointLocation, elbow: str, tool: Optional[EffectorLocation] = None
+    ):
+        self.joints = joints
+        self.elbow = elbow
+        self.tool = tool
+
+    def plan(
+        self, locations: list[EffectorLocation]
+    ) -> list[Optional[tuple[str, JointLocation]]]:
+        """
+        For each target None to move there in a straight line, or the elbow
+        to switch to and the joints to move to instead.
+        """
+        # Cheapest way found to arrive at the current target, by elbow
+        paths = {self.elbow: (0.0, self.joints, [])}
+        for location in locations:
+            arrivals = {}
+            for previous, (cost, joints, steps) in paths.items():
+                for elbow, solved in solutions(location, joints, self.tool).items():
+                    if solved is None:
+                        continue
+                    total = (
+                        cost
+                        + _cost(solved, joints)
+                        + (SWITCH_COST if elbow != previous else 0.0)
+                    )
+                    if elbow not in arrivals or total < arrivals[elbow][0]:
+                        arrivals[elbow] = (total, solved, steps + [(elbow, solved)])
+            if not arrivals:
+                # Out of reach either way, a straight move lets the controller report it
+                arrivals = {
+                    e: (cost, joints, steps + [(e, None)])
+                    for e, (cost, joints, steps) in paths.items()
+                }
+            paths = arrivals
+
+        _, joints, steps = min(paths.values(), key=lambda p: p[0])
+        switches = []
+        for elbow, solved in steps:
+            switches.append((elbow, solved) if elbow != self.elbow else None)
+            self.elbow = elbow
+        self.joints = joints
+        return switches
@@ -1,7 +1,18 @@
+from collections import Counter
 from dataclasses import dataclass
-import sys
+import logging
+import math
+import re
+import threading
 import time
 
+from staubli.log import TRACE
+from . import encoder, program as vplus
+from staubli.trace import traced
+
+log = logging.getLogger(__name__)
+wire_log = logging.getLogger("staubli.serial")
+
 
 @dataclass
 class EffectorLocation:
@@ -21,7 +32,7 @@ class EffectorLocation:
 
     def format(self) -> str:
         return f"{self.x:.3f}, {self.y:.3f}, {self.z:.3f}, {self.yaw:.3f}, {self.pitch:.3f}, {self.roll:.3f}"
-    
+
     def __sub__(self, other):
         return EffectorLocation(
             self.x - other.x,
@@ -29,11 +40,13 @@ class EffectorLocation:
             self.z - other.z,
             self.yaw - other.yaw,
             self.pitch - other.pitch,
-            self.roll - other.roll
+            self.roll - other.roll,
         )
 
 
-joint_attrs = ['j1', 'j2', 'j3', 'j4', 'j5', 'j6']
+joint_attrs = ["j1", "j2", "j3", "j4", "j5", "j6"]
+
+
 @dataclass
 class JointLocation:
     j1: float
@@ -43,6 +56,9 @@ class JointLocation:
     j5: float
     j6: float
 
+    def to_list(self) -> list[float]:
+        return [self.j1, self.j2, self.j3, self.j4, self.j5, self.j6]
+
     def format(self) -> str:
         return f"{self.j1:.3f}, {self.j2:.3f}, {self.j3:.3f}, {self.j4:.3f}, {self.j5:.3f}, {self.j6:.3f}"
 
@@ -56,34 +72,106 @@ class JointLocation:
             self.j6 - other.j6,
         )
 
+
+# The V+ monitor prompt, a dot at the start of the last line
+PROMPT = re.compile(r"(^|\n)\.\s*$")
+# Console commands that can delete, rename or edit programs, DEL covers the DELETE family
+PROGRAM_COMMANDS = re.compile(r"\s*(DEL|ZERO|LOAD|EDIT|SEE|RENAME)", re.IGNORECASE)
+# Seconds without a byte before a command is given up on. None waits
+# forever, the prompt only comes back once a move is done and a slow one
+# can take minutes
+READ_TIMEOUT = None
+
+
+class SerialTimeout(TimeoutError):
+    """The controller stopped answering before the prompt."""
+
+
 class Robot:
     def __init__(self, serial):
         self.serial = serial
+        # Names of compiled programs already on the controller
+        self.uploaded: set[str] = set()
+        # False once something may have deleted programs, checked with a DIRECTORY before trusting uploaded
+        self.uploaded_checked = True
+        self.read_timeout = READ_TIMEOUT
+        # Controller settings a prompt has confirmed, as the command text that set them.
+        # "speed", "tool" and "elbow", a missing one is unknown and always sent
+        self.shadow: dict[str, str] = {}
+        # Round trips the shadow saved, by command
+        self.skipped = Counter()
+        # Set from another thread to ABORT the program running
+        self.interrupted = threading.Event()
+
+    def _unchanged(self, name: str, command: str) -> bool:
+        if self.shadow.get(name) != command:
+            return False
+        self.skipped[name] += 1
+        return True
+
+    def invalidate(self, *names):
+        """Forget controller settings, all of them without names."""
+        if not names:
+            self.shadow.clear()
+        for name in names:
+            self.shadow.pop(name, None)
+
+    def shadow_stats(self) -> dict:
+        return {"shadow": dict(self.shadow), "skipped": dict(self.skipped)}
+
+    def _reset(self):
+        """The controller may have restarted, nothing on it can be trusted."""
+        self.invalidate()
+        self.uploaded_checked = False
+
+    def interrupt(self):
+        """Stop a running program at its next line, safe to call from any thread."""
+        self.interrupted.set()
 
     def _readline(self) -> str:
         l = self.serial.readline()
-        print((b"> " + l.strip()).decode("ascii"), file=sys.stderr)
+        if wire_log.isEnabledFor(TRACE):
+            wire_log.log(TRACE, "> %s", l.strip().decode("ascii", "replace"))
         return l
 
-    def _read_unknown(self, timeout):
-        end_time = time.monotonic() + timeout
+    def _read_until_prompt(self, idle_timeout, on_output=None) -> str:
+        """Read until the monitor prompt, or until idle_timeout passes with no bytes."""
+        output = ""
+        end_time = time.monotonic() + idle_timeout
         while time.monotonic() < end_time:
-            while self.serial.in_waiting > 0:
-                self.serial.read(self.serial.in_waiting)
-                end_time = time.monotonic() + timeout
+            waiting = self.serial.in_waiting
+            if waiting == 0:
+                time.sleep(0.01)
+                continue
+
+            chunk = self.serial.read(waiting).decode("ascii", "replace")
+            output += chunk
+            if on_output is not None:
+                on_output(chunk)
+            if PROMPT.search(output):
+                break
+            end_time = time.monotonic() + idle_timeout
 
-            time.sleep(0.05)
+        return output
 
     def _read_dot(self):
+        timeout = self.read_timeout if self.read_timeout is not None else math.inf
+        end_time = time.monotonic() + timeout
         while True:
             l = self.serial.read(1)
             if l == b".":
-                print("> .")
+                wire_log.log(TRACE, "> .")
                 return True
             elif l == b"*":
-                print("got error, flailing.")
+                log.warning("got error, flailing.")
                 self.flail()
                 return False
+            elif l:
+                end_time = time.monotonic() + timeout
+            elif time.monotonic() > end_time:
+                # The prompt was lost or the line is down, the next command starts afresh
+                self.invalidate()
+                raise SerialTimeout(f"no prompt for {self.read_timeout}s")
             else:
                 time.sleep(0.01)
 
@@ -93,11 +181,17 @@ class Robot:
     def _write_command(self, command):
         self.serial.write(command.encode("ascii") + b"\r")
 
+    @traced("robot")
     def speed(self, speed):
-        self._write_command(f"speed {speed:.2f}")
+        command = encoder.speed(speed)
+        if self._unchanged("speed", command):
+            return
+        self._write_command(command)
         self._readline()
-        self._read_dot()
+        if self._read_dot():
+            self.shadow["speed"] = command
 
+    @traced("robot")
     def where(self) -> tuple[EffectorLocation, JointLocation]:
         self._write_command("where")
         self._readline()
@@ -118,24 +212,28 @@ class Robot:
             effector_split[5],
         )
 
-        return (
-            effector_location,
-            JointLocation(
-                joint_split[0],
-                joint_split[1],
-                joint_split[2],
-                joint_split[3],
-                joint_split[4],
-                joint_split[5],
-            ),
+        joint_location = JointLocation(
+            joint_split[0],
+            joint_split[1],
+            joint_split[2],
+            joint_split[3],
+            joint_split[4],
+            joint_split[5],
         )
-    
+        if "elbow" not in self.shadow:
+            # The configuration the arm is in. An above or below sent just
+            # before an error and still waiting for a joint move is missed
+            self.shadow["elbow"] = f"do {kinematics.elbow(joint_location)}"
+
+        return effector_location, joint_location
+
+    @traced("robot")
     def tool_offset(self) -> EffectorLocation:
         self._write_command("LISTL hand.tool")
         self._readline()
         self._readline()
         potential_dot = self.serial.read(1)
-        if potential_dot == b'.':
+        if potential_dot == b".":
             # No point defined
             return EffectorLocation(0, 0, 0, 0, 0, 0)
         name_and_values = self._readline()
@@ -145,7 +243,7 @@ class Robot:
         tool_line = b" ".join(name_and_values.strip().split(b" ")[1:])
         tool_split = self._parse_floats(tool_line)
 
-        return EffectorLocation(
+        tool = EffectorLocation(
             tool_split[0],
             tool_split[1],
             tool_split[2],
@@ -153,71 +251,206 @@ class Robot:
             tool_split[4],
             tool_split[5],
         )
+        return tool
 
-
+    @traced("robot")
     def jog_absolute(self, effector_location: EffectorLocation):
-        effector_location_string = effector_location.format()
-        self._write_command("do set jog0 = trans(" + effector_location_string + ")")
-        self._readline()
-        self._read_dot()
-        self._write_command("do moves jog0")
+        self._write_command(encoder.move_absolute(effector_location))
         self._readline()
         self._read_dot()
 
+    @traced("robot")
     def jog_transform(self, effector_location: EffectorLocation):
-        effector_location_string = effector_location.format()
-        self._write_command(
-            "do set jog0 = HERE:trans(" + effector_location_string + ")"
-        )
+        self._write_command(encoder.move_relative(effector_location))
         self._readline()
         self._read_dot()
-        self._write_command("do move jog0")
-        self._readline()
-        self._read_dot()
-    
+
+    @traced("robot")
     def jog_joint(self, joing_location: JointLocation):
-        joint_location_string = joing_location.format()
-        self._write_command("do set #jog1 = #PPOINT(" + joint_location_string + ")")
-        self._readline()
-        self._read_dot()
-        self._write_command("do move #jog1")
+        self._write_command(encoder.move_joints(joing_location))
         self._readline()
         self._read_dot()
-    
+        # The joints decide the configuration, where reads it back
+        self.invalidate("elbow")
+
+    @traced("robot")
     def tool_transform(self, tool_transform: EffectorLocation):
-        tool_transform_string = tool_transform.format()
-        self._write_command(
-            "do set hand.tool = trans(" + tool_transform_string + ")"
-        )
+        commands = encoder.set_tool(tool_transform)
+        if self._unchanged("tool", commands[0]):
+            return
+        confirmed = True
+        for command in commands:
+            self._write_command(command)
+            self._readline()
+            confirmed = self._read_dot() and confirmed
+        if confirmed:
+            self.shadow["tool"] = commands[0]
+
+    @traced("robot")
+    def exec(self, command, on_output=None) -> str:
+        # Any setting could change at the console, programs only with a few commands
+        self.invalidate()
+        if PROGRAM_COMMANDS.match(command):
+            self.uploaded_checked = False
+        self._write_command(command)
+        return self._read_until_prompt(2, on_output)
+
+    @traced("robot")
+    def programs(self) -> set[str]:
+        """Names of the compiled programs on the controller, from its DIRECTORY."""
+        self._write_command("DIRECTORY")
+        found = set(vplus.NAME_PATTERN.findall(self._read_until_prompt(2)))
+        self.uploaded &= found
+        self.uploaded_checked = True
+        return found
+
+    @traced("robot")
+    def prune_programs(self, keep=()) -> list[str]:
+        """DELETEP compiled programs on the controller except those in keep, returns their names."""
+        deleted = sorted(self.programs() - set(keep))
+        for name in deleted:
+            self._write_command(f"DELETEP {name}")
+            self._read_until_prompt(0.5)
+            self.uploaded.discard(name)
+        return deleted
+
+    @traced("robot")
+    def upload_program(self, program: "vplus.CompiledProgram") -> bool:
+        """Define the program's locations and type it into the editor, False if already there."""
+        if program.name in self.uploaded and not self.uploaded_checked:
+            # One DIRECTORY is cheaper than typing the program in again
+            self.programs()
+        if program.name in self.uploaded:
+            return False
+
+        for command in program.locations:
+            self._write_command(command)
+            self._readline()
+            self._read_dot()
+
+        # A program of this name left from an earlier session is the same code,
+        # delete it anyway so the editor starts from an empty one
+        self._write_command(f"DELETEP {program.name}")
+        self._read_until_prompt(0.5)
+
+        self._write_command(f"EDIT {program.name}")
         self._readline()
-        self._read_dot()
-        self._write_command("TOOL hand.tool")
+        for line in program.lines:
+            self._write_command(line)
+            self._readline()
+        self._write_command(vplus.EDITOR_EXIT)
         self._readline()
         self._read_dot()
-    
-    def exec(self, command):
-        self._write_command(command)
-        self._read_unknown(2)
 
+        self.uploaded.add(program.name)
+        return True
+
+    @traced("robot")
+    def execute_program(
+        self, program: "vplus.CompiledProgram", on_progress=None
+    ) -> int:
+        """EXECUTE an uploaded program, calling on_progress with each step index as it starts."""
+        timeout = self.read_timeout if self.read_timeout is not None else math.inf
+        end_time = time.monotonic() + timeout
+        if self.interrupted.is_set():
+            # Interrupted while uploading, don't start it at all
+            self.interrupted.clear()
+            raise vplus.ProgramAborted(-1)
+        self._write_command(f"EXECUTE {program.name}")
+        step = -1
+        while True:
+            if self.interrupted.is_set():
+                self._abort(step)
+            line = self._readline().strip().decode("ascii", "replace")
+            if not line:
+                if time.monotonic() > end_time:
+                    # The end marker was lost, leave the program to ABORT
+                    self.invalidate()
+                    raise SerialTimeout(
+                        f"no output from {program.name} for {self.read_timeout}s"
+                    )
+                time.sleep(0.01)
+                continue
+            end_time = time.monotonic() + timeout
+            if line.startswith("*"):
+                # Program stopped on an error, the monitor prompt follows
+                self._read_until_prompt(0.5)
+                self.invalidate()
+                if step == -1:
+                    # Likely lost with the controller's memory, upload it again next time
+                    self.uploaded.discard(program.name)
+                raise vplus.ProgramError(step, line.strip("*"))
+
+            marker = vplus.parse_marker(line)
+            if marker == vplus.END_MARKER:
+                break
+            if marker is not None:
+                step = marker
+                if on_progress is not None:
+                    on_progress(step)
+
+        # Whatever the monitor prints once the program completes
+        self._read_until_prompt(0.5)
+        if program.final_speed is not None:
+            self.shadow["speed"] = encoder.speed(program.final_speed)
+        if program.sets_tool:
+            self.invalidate("tool")
+        # Joint steps decide the configuration
+        self.invalidate("elbow")
+        return program.steps
+
+    def _abort(self, step: int):
+        self.interrupted.clear()
+        self._write_command("ABORT")
+        self._read_until_prompt(0.5)
+        self.invalidate()
+        raise vplus.ProgramAborted(step)
+
+    @traced("robot")
+    def run_program(self, program: "vplus.CompiledProgram", on_progress=None) -> dict:
+        # Only an interrupt that arrives while this program runs stops it
+        self.interrupted.clear()
+        uploaded = self.upload_program(program)
+        return {
+            "name": program.name,
+            "uploaded": uploaded,
+            "steps": self.execute_program(program, on_progress),
+        }
+
+    @traced("robot")
     def above(self):
-        self._write_command("do above")
-        self._readline()
-        self._read_dot()
+        self._set_elbow("do above")
 
+    @traced("robot")
     def below(self):
-        self._write_command("do below")
+        self._set_elbow("do below")
+
+    def _set_elbow(self, command: str):
+        if self._unchanged("elbow", command):
+            return
+        self._write_command(command)
         self._readline()
-        self._read_dot()
+        if self._read_dot():
+            self.shadow["elbow"] = command
 
+    @traced("robot")
     def enable_power(self):
-        self._write_command("en po")
+        # Power comes back after an error or a stop, trust nothing from before
+        self._reset()
+        self._write_command(encoder.monitor("enable power"))
         self._readline()
         self._readline()
         self._read_dot()
 
+    @traced("robot")
     def flail(self):
+        self._reset()
         self._readline()
         self._readline()
         self._readline()
         self._write_command("")
         self._readline()
+
+
+# kinematics is built on the location classes above
+from . import kinematics  # noqa: E402
@@ -1,67 +1,127 @@
+import logging
 import serial
 import sys
 
-from staubli.http.websockets import WebsocketWrapper
-from .machine import EffectorLocation, Robot
+from staubli.http.websockets import WebsocketWrapper, broadcast_to_websockets
+from .machine import EffectorLocation, JointLocation, Robot
 from .controller import handle_input
 from staubli.config import Config, env_exists
-from .data import write, read
-from .serial_emulator import SerialEmulator
+from staubli.trace import TracingSerial, tracer
+from staubli.log import setup_logging
+from .data import Positions
+from .serial_emulator import Faults, SerialEmulator
+from .commands import CommandQueue, QueuedRobot
+from .state import RobotStateTracker, StatePublisher
+from .program import EFFECTOR_KEYS, compile_program
+from .kinematics import ElbowPlanner
+from . import chaos, path, reach, toolpath
+
+log = logging.getLogger(__name__)
+
+# serial_device value that skips the serial port and talks to the emulator
+EMULATOR_DEVICE = "emulator"
+
 
 class Main:
     config: Config
     ser: serial.Serial = None
     robot: Robot = None
+    commands: CommandQueue = None
+    state: StatePublisher = None
 
-    def __init__(self, config=Config()):
+    def __init__(self, config=Config(), serial_sink=broadcast_to_websockets):
         self.config = config
+        # Receives every read and write on the serial line
+        self.serial_sink = serial_sink
 
     def initialize(self):
-        try:
-            self.ser = WebsocketWrapper(serial.Serial(
-                self.config.serial_device,
-                9600,
-                timeout=1,
-                bytesize=8,
-                parity=serial.PARITY_NONE,
-                stopbits=1,
-            ))
-        except Exception as e:
-            print(e)
-            print("Exception starting serial, starting emulator")
-            self.ser = WebsocketWrapper(SerialEmulator())
-    
+        emulator = None
+        if self.config.serial_device == EMULATOR_DEVICE:
+            emulator = SerialEmulator()
+            self.ser = WebsocketWrapper(TracingSerial(emulator), self.serial_sink)
+        else:
+            self._open_serial()
+
         self.robot = Robot(self.ser)
         # TODO: unify initial speed
         self.robot.speed(20)
 
+        self.state = StatePublisher(speed=20, elbow="above", busy=False)
+        tracker = RobotStateTracker(self.state)
+        tracker.refresh(self.robot)
+        self.commands = CommandQueue(self.robot, tracker)
+
+        if emulator is not None and self.config.emulator_faults:
+            # Chaos mode starts once the state is read
+            emulator.faults = Faults.parse(self.config.emulator_faults)
+            # A lost prompt would otherwise hang the command queue
+            self.robot.read_timeout = chaos.READ_TIMEOUT
+
+    def _open_serial(self):
+        try:
+            self.ser = WebsocketWrapper(
+                TracingSerial(
+                    serial.Serial(
+                        self.config.serial_device,
+                        9600,
+                        timeout=1,
+                        bytesize=8,
+                        parity=serial.PARITY_NONE,
+                        stopbits=1,
+                    )
+                ),
+                self.serial_sink,
+            )
+        except Exception as e:
+            log.warning("Exception starting serial, starting emulator: %s", e)
+            self.ser = WebsocketWrapper(
+                TracingSerial(SerialEmulator()), self.serial_sink
+            )
+
     def loop(self):
         handle_input(self.controller())
-    
+
     def controller(self):
-        return ControllerDelegate(self.robot, self.ser)
+        return ControllerDelegate(
+            QueuedRobot(self.commands),
+            self.ser,
+            self.state,
+            self.config.reach_map,
+            toolpath_dir=self.config.toolpath_dir,
+        )
 
 
 angles = [5, 10, 15, 30, 45]
 
 
 class ControllerDelegate:
-    robot: Robot
+    robot: QueuedRobot
     speed: float
-    positions: list[EffectorLocation] = None
+    positions: Positions = None
+    state: StatePublisher = None
 
-    def __init__(self, robot, ser):
+    def __init__(
+        self, robot, ser, state=None, reach_map=None, positions=None, toolpath_dir=None
+    ):
         self.robot = robot
         self.ser = ser
+        self.state = state
+        # Path of the reachability map, opened on the first effector move
+        self.reach_map = reach_map
+        # Toolpath files are only read from here, None reads none
+        self.toolpath_dir = toolpath_dir
         # TODO: unify initial speed
         self.speed = 20
         self.distance = 100
         self.angle_index = 4
         self.elbow = "above"
-        self.positions = read()
-        print(self.positions)
+        # Pick the elbow for each effector move, off once it is toggled by hand
+        self.auto_elbow = True
+        self.positions = positions if positions is not None else Positions.load()
         self.positions_index = 0
-    
+        # Spans for /api/debug/trace
+        self.tracer = tracer
+
     def set_speed(self, new_speed: float):
         self.speed = new_speed
         self.robot.speed(new_speed)
@@ -107,13 +167,13 @@ class ControllerDelegate:
 
     def on_minus(self):
         self.distance -= 10
-        print("distance = " + str(self.distance))
+        log.info("distance = %s", self.distance)
         if self.distance <= 10:
             self.distance = 10
 
     def on_plus(self):
         self.distance += 10
-        print("distance = " + str(self.distance))
+        log.info("distance = %s", self.distance)
         if self.distance >= 1000:
             self.distance = 1000
 
@@ -121,15 +181,16 @@ class ControllerDelegate:
         self.angle_index -= 1
         if self.angle_index <= 0:
             self.angle_index = 0
-        print("angle_step = " + str(angles[self.angle_index]))
+        log.info("angle_step = %s", angles[self.angle_index])
 
     def on_angle_plus(self):
         self.angle_index += 1
         if self.angle_index >= len(angles) - 1:
             self.angle_index = len(angles) - 1
-        print("angle_step = " + str(angles[self.angle_index]))
+        log.info("angle_step = %s", angles[self.angle_index])
 
     def on_elbow(self):
+        self.auto_elbow = False
         if self.elbow == "above":
             self.robot.below()
             self.elbow = "below"
@@ -137,20 +198,121 @@ class ControllerDelegate:
             self.robot.above()
             self.elbow = "above"
 
+    def _last_known(self) -> tuple[JointLocation, EffectorLocation]:
+        """Joints and tool offset as last published, asked of the robot without a state."""
+        state = self.state.snapshot()["state"] if self.state is not None else {}
+        if state.get("position") and state.get("tool_offset"):
+            return JointLocation(**state["position"]["joints"]), EffectorLocation(
+                **state["tool_offset"]
+            )
+        return self.robot.where()[1], self.robot.tool_offset()
+
+    def elbow_planner(self):
+        """ElbowPlanner starting from the last known position, None with automatic elbow off."""
+        if not self.auto_elbow:
+            return None
+        joints, tool = self._last_known()
+        return ElbowPlanner(joints, self.elbow, tool)
+
+    def switch_elbow(self, elbow):
+        """Send above or below, only if the robot isn't in that configuration already."""
+        if elbow is None or elbow == self.elbow:
+            return
+        getattr(self.robot, elbow)()
+        self.elbow = elbow
+
+    def check_reach(self, location: EffectorLocation):
+        """Raise reach.Unreachable for a target the map rules out, before anything is sent."""
+        reach_map = reach.load(self.reach_map) if self.reach_map else None
+        if reach_map is not None:
+            reach_map.check(location, self._last_known()[1])
+
+    def checked(self, locations):
+        """locations, each checked with check_reach as it is taken and before it can be queued."""
+        reach_map = reach.load(self.reach_map) if self.reach_map else None
+        if reach_map is None:
+            yield from locations
+            return
+        tool = self._last_known()[1]
+        for location in locations:
+            reach_map.check(location, tool)
+            yield location
+
+    def check_program(self, commands: list[dict]):
+        """check_reach every effector step of a program, with the tool it would have then."""
+        reach_map = reach.load(self.reach_map) if self.reach_map else None
+        if reach_map is None:
+            return
+        tool = self._last_known()[1]
+        for step, command in enumerate(commands):
+            values = [command["data"].get(k) for k in EFFECTOR_KEYS]
+            if command["type"] == "tool":
+                tool = EffectorLocation(*values)
+            elif command["type"] == "effector":
+                try:
+                    reach_map.check(EffectorLocation(*values), tool)
+                except reach.Unreachable as e:
+                    raise reach.Unreachable(f"step {step}: {e}") from None
+
+    def jog_absolute(self, location: EffectorLocation):
+        self.check_reach(location)
+        planner = self.elbow_planner()
+        switch = planner.plan([location])[0] if planner is not None else None
+        if switch is None:
+            self.robot.jog_absolute(location)
+            return
+        # A straight line keeps the configuration, only a joint move changes it
+        elbow, joints = switch
+        self.switch_elbow(elbow)
+        self.robot.jog_joint(joints)
+
+    def follow(self, locations) -> int:
+        """Move through a densified path's samples, as path.follow."""
+        return path.follow(self.robot, self.checked(locations))
+
+    def feed(self, locations) -> int:
+        """Queue a toolpath's moves, with elbows chosen a chunk at a time."""
+        try:
+            return toolpath.feed(
+                self.robot, self.checked(locations), planner=self.elbow_planner()
+            )
+        finally:
+            if self.state is not None:
+                # Only the switches that ran before a stop count
+                self.elbow = self.state.snapshot()["state"]["elbow"]
+
     def on_flail(self):
-        print("flailing!")
+        log.warning("flailing!")
         self.robot.flail()
 
     def on_print_position(self):
         position = self.robot.where()[0]
-        self.positions.append(("position " + str(len(self.positions) + 1), position))
-        write(self.positions)
-        print("positions: " + str(self.positions))
+        self.positions_index, taught = self.positions.teach(position)
+        if taught:
+            log.info("taught %s", self.positions[self.positions_index])
+        else:
+            log.info("already taught as '%s'", self.positions[self.positions_index][0])
+
+    def nearest_position(self, location: EffectorLocation = None):
+        """Index and distance of the taught point closest to location, or to the robot."""
+        if location is None:
+            location = self.robot.where()[0]
+        return self.positions.nearest(location)
+
+    def positions_within(self, location: EffectorLocation, radius: float):
+        return self.positions.within(location, radius)
+
+    def on_nearest_position(self):
+        nearest = self.nearest_position()
+        if nearest is None:
+            return
+        self.positions_index = nearest[1]
+        self._jog_to_position()
 
     def _jog_to_position(self):
         p: tuple[str, EffectorLocation] = self.positions[self.positions_index]
-        print("jogging to position " + str(self.positions_index) + ": '" + p[0] + "'")
-        self.robot.jog_absolute(p[1])
+        log.info("jogging to position %s: '%s'", self.positions_index, p[0])
+        self.jog_absolute(p[1])
 
     def on_next_position(self):
         self.positions_index = self.positions_index + 1
@@ -166,8 +328,24 @@ class ControllerDelegate:
 
         self._jog_to_position()
 
+    def run_program(self, commands: list[dict], speed: float = None) -> dict:
+        """Compile and run a program natively, publishing the step it is on."""
+        program = compile_program(commands, speed)
+        self.check_program(commands)
+        on_progress = None
+        if self.state is not None:
+            on_progress = lambda step: self.state.update(program_step=step)
+        result = self.robot.run_program(program, on_progress)
+        if program.final_speed is not None:
+            self.speed = program.final_speed
+        return result
+
+    def on_stop(self):
+        cancelled = self.robot.commands.stop()
+        log.warning("stopped, cancelled %d queued moves", cancelled)
+
     def on_reset(self):
-        print("resetting robot, expect 'press HIGH POWER button' message")
+        log.warning("resetting robot, expect 'press HIGH POWER button' message")
         self.robot.enable_power()
 
     def on_quit(self):
@@ -184,4 +362,5 @@ def main(config: Config):
 if __name__ == "__main__":
     env_file = ".env"
     config = Config.from_env(env_file) if env_exists(env_file) else Config()
+    setup_logging(config.log_level)
     main(config)
@@ -0,0 +1,365 @@
+"""
+Offline cycle time optimizer for programs from the web programmer.
+
+Every segment is timed with a trapezoidal velocity profile per joint,
+synchronised so the joints arrive together. Straight line moves are also
+bound by the Cartesian speed and are sampled through the inverse
+kinematics, so a line that passes near a singularity costs what the wrist
+has to do to follow it.
+
+Per effector step the optimizer picks a straight line (V+ MOVES, keeps the
+elbow) or a joint interpolated move to a precision point with either elbow,
+at the speed the step was written at unless the constraints set one. The
+cheapest sequence comes from a dynamic program over the arrival elbow of
+each step.
+
+    python -m staubli.robot.optimizer program.json [--measure]
+"""
+
+import argparse
+import json
+import math
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+from . import kinematics, path
+from .machine import EffectorLocation, JointLocation
+from .program import EFFECTOR_KEYS, JOINT_KEYS, compile_program
+
+# Not in the URDF, seconds each joint takes to reach full speed at 100%
+ACCELERATION_TIME = 0.25
+# Straight line limits at 100% speed, mm/s and degrees/s
+LINEAR_SPEED = 1000.0
+ANGULAR_SPEED = 360.0
+# Sampling of straight lines through the inverse kinematics
+LINE_STEP = 10.0
+LINE_ANGLE_STEP = 5.0
+
+# Where the emulator and a `do ready` leave the arm
+READY = JointLocation(0.0, -90.0, 90.0, 0.0, 0.0, 0.0)
+
+
+@dataclass
+class Segment:
+    step: int
+    # "linear" or "joints"
+    move: str
+    elbow: str
+    speed: float
+    seconds: float
+    # Where the move ends
+    joints: JointLocation
+
+
+def trapezoid(distance: float, velocity: float, acceleration: float) -> float:
+    """Seconds to cover distance from rest to rest."""
+    distance = abs(distance)
+    if distance * acceleration >= velocity * velocity:
+        return distance / velocity + velocity / acceleration
+    # Never reaches full speed
+    return 2 * math.sqrt(distance / acceleration)
+
+
+def joint_time(start: JointLocation, end: JointLocation, speed: float) -> float:
+    fraction = speed / 100
+    return max(
+        trapezoid(delta, velocity * fraction, velocity / ACCELERATION_TIME)
+        for delta, velocity in zip((end - start).to_list(), kinematics.VELOCITIES)
+    )
+
+
+def linear_time(
+    start: JointLocation,
+    target: EffectorLocation,
+    speed: float,
+    tool: Optional[EffectorLocation] = None,
+) -> Optional[tuple[float, JointLocation]]:
+    """Seconds and end joints of a straight line to target, None if the line leaves the workspace."""
+    fraction = speed / 100
+    origin = kinematics.forward(start, tool)
+    distance = math.dist(origin.to_list()[:3], target.to_list()[:3])
+    angle = math.degrees(
+        path.angle_between(
+            path.zyz_to_quaternion(origin.yaw, origin.pitch, origin.roll),
+            path.zyz_to_quaternion(target.yaw, target.pitch, target.roll),
+        )
+    )
+    seconds = max(
+        trapezoid(distance, LINEAR_SPEED * fraction, LINEAR_SPEED / ACCELERATION_TIME),
+        trapezoid(angle, ANGULAR_SPEED * fraction, ANGULAR_SPEED / ACCELERATION_TIME),
+    )
+
+    # The joints can't move faster than their own limits between samples
+    elbow = kinematics.elbow(start)
+    joints = start
+    bound = 0.0
+    for sample in path.densify([origin, target], LINE_STEP, LINE_ANGLE_STEP):
+        following = kinematics.inverse(sample, elbow, joints, tool)
+        if following is None:
+            return None
+        bound += max(
+            abs(delta) / (velocity * fraction)
+            for delta, velocity in zip(
+                (following - joints).to_list(), kinematics.VELOCITIES
+            )
+        )
+        joints = following
+    return max(seconds, bound), joints
+
+
+def _effector(data) -> EffectorLocation:
+    return EffectorLocation(*(data[k] for k in EFFECTOR_KEYS))
+
+
+def _joints(data) -> JointLocation:
+    return JointLocation(*(data[k] for k in JOINT_KEYS))
+
+
+def predict(
+    program: dict, start: JointLocation = READY, speed: float = 20
+) -> tuple[float, list[Segment]]:
+    """Seconds the program takes as written, math.inf if a straight line can't be followed."""
+    speed = program.get("speed") or speed
+    tool = None
+    joints = start
+    segments = []
+    for step, command in enumerate(program["commands"]):
+        kind, data = command["type"], command["data"]
+        if kind == "speed":
+            speed = data["speed"]
+        elif kind == "tool":
+            tool = _effector(data)
+        elif kind == "joints":
+            target = _joints(data)
+            segments.append(
+                Segment(
+                    step,
+                    "joints",
+                    kinematics.elbow(target),
+                    speed,
+                    joint_time(joints, target, speed),
+                    target,
+                )
+            )
+            joints = target
+        elif kind == "effector":
+            line = linear_time(joints, _effector(data), speed, tool)
+            if line is None:
+                return math.inf, segments
+            segments.append(
+                Segment(
+                    step, "linear", kinematics.elbow(joints), speed, line[0], line[1]
+                )
+            )
+            joints = line[1]
+        else:
+            raise ValueError(f"step {step}: can't time {kind!r} commands")
+    return sum(s.seconds for s in segments), segments
+
+
+def _options(step, kind, data, joints, tool, constraints, speed) -> list[Segment]:
+    max_speed = constraints.get("max_speed", speed)
+    if kind == "joints":
+        target = _joints(data)
+        return [
+            Segment(
+                step,
+                "joints",
+                kinematics.elbow(target),
+                max_speed,
+                joint_time(joints, target, max_speed),
+                target,
+            )
+        ]
+
+    target = _effector(data)
+    options = []
+    linear_speed = constraints.get("linear_speed", max_speed)
+    line = linear_time(joints, target, linear_speed, tool)
+    if line is not None:
+        options.append(
+            Segment(
+                step, "linear", kinematics.elbow(joints), linear_speed, line[0], line[1]
+            )
+        )
+    if step in constraints.get("linear", ()):
+        return options
+
+    elbows = [constraints["elbow"]] if constraints.get("elbow") else kinematics.ELBOWS
+    for elbow in elbows:
+        end = kinematics.inverse(target, elbow, joints, tool)
+        if end is not None:
+            options.append(
+                Segment(
+                    step,
+                    "joints",
+                    elbow,
+                    max_speed,
+                    joint_time(joints, end, max_speed),
+                    end,
+                )
+            )
+    return options
+
+
+def optimize(
+    program: dict,
+    start: JointLocation = READY,
+    constraints: Optional[dict] = None,
+    speed: float = 20,
+) -> tuple[dict, list[Segment]]:
+    """
+    Fastest rewrite of program within constraints, as a program/state.js Program.
+
+    constraints:
+        max_speed: speed for every segment, default the speed each step was written at
+        linear: step indices that have to stay straight lines
+        linear_speed: speed for straight lines, default max_speed
+        elbow: "above" or "below" to rule out the other configuration
+    """
+    constraints = constraints or {}
+    commands = program["commands"]
+    speed = program.get("speed") or speed
+
+    # Cheapest way found to arrive at the current step, by elbow
+    paths = {kinematics.elbow(start): (0.0, start, [])}
+    tool = None
+    for step, command in enumerate(commands):
+        kind, data = command["type"], command["data"]
+        if kind == "tool":
+            tool = _effector(data)
+            continue
+        if kind == "speed":
+            # Segments are rewritten with their own speed, this is only what was written
+            speed = data["speed"]
+            continue
+        if kind not in ("effector", "joints"):
+            raise ValueError(f"step {step}: can't optimize {kind!r} commands")
+
+        arrivals = {}
+        for seconds, joints, segments in paths.values():
+            for segment in _options(step, kind, data, joints, tool, constraints, speed):
+                total = seconds + segment.seconds
+                if segment.elbow not in arrivals or total < arrivals[segment.elbow][0]:
+                    arrivals[segment.elbow] = (
+                        total,
+                        segment.joints,
+                        segments + [segment],
+                    )
+        if not arrivals:
+            raise ValueError(
+                f"step {step}: no move within constraints reaches the target"
+            )
+        paths = arrivals
+
+    _, _, segments = min(paths.values(), key=lambda p: p[0])
+    return _rewrite(program, segments), segments
+
+
+def _rewrite(program: dict, segments: list[Segment]) -> dict:
+    by_step = {s.step: s for s in segments}
+    speed = segments[0].speed if segments else program.get("speed")
+    rewritten = []
+    for step, command in enumerate(program["commands"]):
+        segment = by_step.get(step)
+        if command["type"] == "speed":
+            continue
+        if segment is None:
+            rewritten.append(command)
+            continue
+        if segment.speed != speed:
+            speed = segment.speed
+            rewritten.append(
+                {
+                    "name": command.get("name", ""),
+                    "type": "speed",
+                    "data": {"speed": speed},
+                }
+            )
+        if segment.move == "joints":
+            data = {k: round(v, 3) for k, v in vars(segment.joints).items()}
+            rewritten.append({**command, "type": "joints", "data": data})
+        else:
+            rewritten.append(command)
+
+    return {
+        **program,
+        "speed": segments[0].speed if segments else program.get("speed"),
+        "commands": rewritten,
+    }
+
+
+def _seconds(seconds: float) -> Optional[float]:
+    # JSON has no infinity
+    return None if math.isinf(seconds) else seconds
+
+
+def report(
+    program: dict,
+    start: JointLocation = READY,
+    constraints: Optional[dict] = None,
+    speed: float = 20,
+) -> dict:
+    original, _ = predict(program, start, speed)
+    rewritten, segments = optimize(program, start, constraints, speed)
+    optimized = sum(s.seconds for s in segments)
+    return {
+        "program": rewritten,
+        "predicted": {
+            "original_s": _seconds(original),
+            "optimized_s": optimized,
+            "saved_s": _seconds(original - optimized),
+            "segments": [
+                {
+                    "step": s.step,
+                    "move": s.move,
+                    "elbow": s.elbow,
+                    "speed": s.speed,
+                    "seconds": s.seconds,
+                }
+                for s in segments
+            ],
+        },
+    }
+
+
+def measure(
+    robot, original: dict, rewritten: dict, start: JointLocation = READY
+) -> dict:
+    """Run both programs natively from the same start, wall clock seconds each."""
+    seconds = {}
+    for key, program in (("original_s", original), ("optimized_s", rewritten)):
+        compiled = compile_program(program["commands"], program.get("speed"))
+        # Upload and position outside the timed run
+        robot.upload_program(compiled)
+        robot.jog_joint(start)
+        began = time.perf_counter()
+        robot.execute_program(compiled)
+        seconds[key] = time.perf_counter() - began
+    seconds["saved_s"] = seconds["original_s"] - seconds["optimized_s"]
+    return seconds
+
+
+if __name__ == "__main__":
+    from .machine import Robot
+    from .serial_emulator import SerialEmulator
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("program", help="Program JSON as saved by the programmer")
+    parser.add_argument(
+        "--constraints", type=json.loads, default={}, help="JSON, see optimize()"
+    )
+    parser.add_argument(
+        "--measure", action="store_true", help="time both on the emulator too"
+    )
+    args = parser.parse_args()
+
+    with open(args.program) as f:
+        program = json.load(f)
+    result = report(program, constraints=args.constraints)
+    if args.measure:
+        result["measured"] = measure(
+            Robot(SerialEmulator()), program, result["program"]
+        )
+    print(json.dumps(result, indent=2))
@@ -0,0 +1,169 @@
+import math
+from typing import Iterable, Iterator, Optional
+
+from .machine import EffectorLocation
+
+# Quaternions are (w, x, y, z) tuples, V+ orientations are ZYZ yaw/pitch/roll in degrees
+
+# Below this sin(pitch) yaw and roll rotate about the same axis
+GIMBAL_EPSILON = 1e-9
+
+
+def multiply(a, b):
+    aw, ax, ay, az = a
+    bw, bx, by, bz = b
+    return (
+        aw * bw - ax * bx - ay * by - az * bz,
+        aw * bx + ax * bw + ay * bz - az * by,
+        aw * by - ax * bz + ay * bw + az * bx,
+        aw * bz + ax * by - ay * bx + az * bw,
+    )
+
+
+def zyz_to_quaternion(yaw: float, pitch: float, roll: float):
+    y = math.radians(yaw) / 2
+    p = math.radians(pitch) / 2
+    r = math.radians(roll) / 2
+    q = multiply((math.cos(y), 0, 0, math.sin(y)), (math.cos(p), 0, math.sin(p), 0))
+    return multiply(q, (math.cos(r), 0, 0, math.sin(r)))
+
+
+def quaternion_to_zyz(q, yaw_hint: float = 0.0) -> tuple[float, float, float]:
+    """Convert to yaw/pitch/roll, yaw_hint is kept when pitch is ~0 or ~180."""
+    w, x, y, z = q
+    r02 = 2 * (x * z + w * y)
+    r12 = 2 * (y * z - w * x)
+    r20 = 2 * (x * z - w * y)
+    r21 = 2 * (y * z + w * x)
+    r22 = 1 - 2 * (x * x + y * y)
+
+    sin_pitch = math.sqrt(r02 * r02 + r12 * r12)
+    pitch = math.atan2(sin_pitch, r22)
+    if sin_pitch > GIMBAL_EPSILON:
+        yaw = math.atan2(r12, r02)
+        roll = math.atan2(r21, -r20)
+    else:
+        # Only yaw + roll (or yaw - roll when flipped) is defined
+        r00 = 1 - 2 * (y * y + z * z)
+        r10 = 2 * (x * y + w * z)
+        yaw = math.radians(yaw_hint)
+        combined = math.atan2(r10, r00)
+        roll = combined - yaw if r22 > 0 else yaw - combined + math.pi
+
+    return math.degrees(yaw), math.degrees(pitch), math.degrees(roll)
+
+
+def rotate(q, v) -> tuple[float, float, float]:
+    w, x, y, z = q
+    vx, vy, vz = v
+    # v + 2w(u x v) + 2u x (u x v)
+    tx = 2 * (y * vz - z * vy)
+    ty = 2 * (z * vx - x * vz)
+    tz = 2 * (x * vy - y * vx)
+    return (
+        vx + w * tx + (y * tz - z * ty),
+        vy + w * ty + (z * tx - x * tz),
+        vz + w * tz + (x * ty - y * tx),
+    )
+
+
+def angle_between(a, b) -> float:
+    """Rotation angle in radians taking orientation a to b."""
+    dot = abs(sum(i * j for i, j in zip(a, b)))
+    return 2 * math.acos(min(1.0, dot))
+
+
+def slerp(a, b, t: float):
+    dot = sum(i * j for i, j in zip(a, b))
+    if dot < 0:
+        # Take the short way around
+        b = tuple(-i for i in b)
+        dot = -dot
+
+    if dot > 0.9995:
+        # Nearly parallel, lerp and normalize to avoid dividing by sin(~0)
+        q = tuple(i + t * (j - i) for i, j in zip(a, b))
+    else:
+        theta = math.acos(dot)
+        sin_theta = math.sin(theta)
+        wa = math.sin((1 - t) * theta) / sin_theta
+        wb = math.sin(t * theta) / sin_theta
+        q = tuple(wa * i + wb * j for i, j in zip(a, b))
+
+    norm = math.sqrt(sum(i * i for i in q))
+    return tuple(i / norm for i in q)
+
+
+def _segment_steps(distance, angle, step, angle_step, chord, radius) -> int:
+    steps = max(
+        1, math.ceil(distance / step), math.ceil(math.degrees(angle) / angle_step)
+    )
+    if chord is not None and radius > chord / 2 and angle > 0:
+        # A point radius away from the frame sweeps an arc, the robot cuts it
+        # with straight lines whose sagitta is radius * (1 - cos(theta / 2))
+        max_angle = 2 * math.acos(1 - chord / radius)
+        steps = max(steps, math.ceil(angle / max_angle))
+    return steps
+
+
+def densify(
+    waypoints: Iterable[EffectorLocation],
+    step: float = 10.0,
+    angle_step: float = 5.0,
+    chord: Optional[float] = None,
+    tool: Optional[EffectorLocation] = None,
+) -> Iterator[EffectorLocation]:
+    """
+    Yield locations between waypoints no further apart than step mm and angle_step degrees.
+
+    Position is interpolated linearly and orientation with slerp. When a tool
+    offset is given its point (relative to the located frame) is the one that
+    travels in a straight line, eg. the pivot of an orbit, and chord bounds how
+    far the frame strays from its arc between two samples.
+    """
+    offset = (tool.x, tool.y, tool.z) if tool is not None else (0.0, 0.0, 0.0)
+    radius = math.sqrt(sum(i * i for i in offset))
+
+    previous = None
+    for waypoint in waypoints:
+        q = zyz_to_quaternion(waypoint.yaw, waypoint.pitch, waypoint.roll)
+        d = rotate(q, offset)
+        point = (waypoint.x + d[0], waypoint.y + d[1], waypoint.z + d[2])
+
+        if previous is None:
+            yield waypoint
+            previous = (point, q, waypoint)
+            continue
+
+        start_point, start_q, start = previous
+        delta = [b - a for a, b in zip(start_point, point)]
+        distance = math.sqrt(sum(i * i for i in delta))
+        angle = angle_between(start_q, q)
+        steps = _segment_steps(distance, angle, step, angle_step, chord, radius)
+
+        yaw_hint = start.yaw
+        for i in range(1, steps):
+            t = i / steps
+            qi = slerp(start_q, q, t)
+            di = rotate(qi, offset)
+            yaw, pitch, roll = quaternion_to_zyz(qi, yaw_hint)
+            yaw_hint = yaw
+            yield EffectorLocation(
+                start_point[0] + t * delta[0] - di[0],
+                start_point[1] + t * delta[1] - di[1],
+                start_point[2] + t * delta[2] - di[2],
+                yaw,
+                pitch,
+                roll,
+            )
+        yield waypoint
+        previous = (point, q, waypoint)
+
+
+def follow(robot, locations: Iterable[EffectorLocation]) -> int:
+    """Move through each location as it is produced, returns the number of moves."""
+    count = 0
+    for location in locations:
+        robot.jog_absolute(location)
+        count += 1
+    return count
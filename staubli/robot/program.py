@@ -0,0 +1,143 @@
+"""
+Compile programs from the web programmer into native V+ programs.
+
+Played step by step every command is its own exchange with the monitor.
+Compiled, the locations are defined once as variables, the program is
+typed into the controller's editor once and a run is a single EXECUTE.
+Each step TYPEs a short marker so progress can still be followed.
+"""
+
+import re
+import zlib
+from dataclasses import dataclass
+
+from . import encoder
+
+# Typed before each step with its index, and once at the end
+MARKER = "@"
+END_MARKER = MARKER + "end"
+
+# Leaves the editor's insert mode (escape) and exits it
+EDITOR_EXIT = "\x1bE"
+
+# Stands in for the program name until the checksum is known
+_NAME = "$"
+
+# A compiled program's name anywhere in monitor output
+NAME_PATTERN = re.compile(r"\bp[0-9a-f]{8}\b")
+
+
+class ProgramError(Exception):
+    def __init__(self, step: int, message: str):
+        super().__init__(f"step {step}: {message}")
+        self.step = step
+        self.message = message
+
+
+class ProgramAborted(ProgramError):
+    """Stopped with ABORT, an emergency command is waiting for the line."""
+
+    def __init__(self, step: int):
+        super().__init__(step, "aborted")
+
+
+@dataclass
+class CompiledProgram:
+    # p followed by the checksum, so a name always refers to the same code
+    name: str
+    checksum: int
+    # Monitor commands that define the location variables
+    locations: list[str]
+    # Program body, without the .PROGRAM and .END the editor adds
+    lines: list[str]
+    steps: int
+    # Monitor speed once the program has run, None if it never sets one
+    final_speed: float = None
+    sets_tool: bool = False
+
+    def text(self) -> str:
+        return "\n".join([f".PROGRAM {self.name}()", *self.lines, ".END"])
+
+
+# Not the machine dataclasses, Robot imports this module
+EFFECTOR_KEYS = ["x", "y", "z", "yaw", "pitch", "roll"]
+JOINT_KEYS = ["j1", "j2", "j3", "j4", "j5", "j6"]
+
+
+def _trans(data) -> str:
+    return f"trans({encoder.arguments([data[k] for k in EFFECTOR_KEYS])})"
+
+
+def _ppoint(data) -> str:
+    return f"#PPOINT({encoder.arguments([data[k] for k in JOINT_KEYS])})"
+
+
+def compile_program(commands: list[dict], speed: float = None) -> CompiledProgram:
+    """
+    Compile program/state.js commands, {"type": ..., "data": ...}, to V+.
+
+    Effector and joint targets become location and precision point variables
+    named after the program, tool and speed steps are compiled inline.
+    """
+    locations = []
+    lines = []
+    final_speed = speed
+    sets_tool = False
+
+    if speed is not None:
+        lines.append(f"SPEED {encoder.number(speed, 2)} MONITOR")
+
+    for step, command in enumerate(commands):
+        kind = command["type"]
+        data = command["data"]
+        lines.append(f'TYPE "{MARKER}{step}"')
+
+        if kind == "effector":
+            variable = f"{_NAME}.{step}"
+            locations.append(f"do set {variable} = {_trans(data)}")
+            lines.append(f"MOVES {variable}")
+        elif kind == "joints":
+            variable = f"#{_NAME}.{step}"
+            locations.append(f"do set {variable} = {_ppoint(data)}")
+            lines.append(f"MOVE {variable}")
+        elif kind == "tool":
+            # Same variable as Robot.tool_transform so tool_offset reads it back
+            lines.append(f"SET hand.tool = {_trans(data)}")
+            lines.append("TOOL hand.tool")
+            sets_tool = True
+        elif kind == "speed":
+            # MONITOR sets the same speed the interactive speed command does
+            lines.append(f"SPEED {encoder.number(data['speed'], 2)} MONITOR")
+            final_speed = data["speed"]
+        elif kind == "serial":
+            raise ValueError(
+                f"step {step}: serial commands can't be compiled, play the program instead"
+            )
+        else:
+            raise ValueError(f"step {step}: unknown command type {kind!r}")
+
+    lines.append(f'TYPE "{END_MARKER}"')
+
+    checksum = zlib.crc32("\n".join(locations + lines).encode("ascii"))
+    name = f"p{checksum:08x}"
+    return CompiledProgram(
+        name=name,
+        checksum=checksum,
+        locations=[l.replace(_NAME, name) for l in locations],
+        lines=[l.replace(_NAME, name) for l in lines],
+        steps=len(commands),
+        final_speed=final_speed,
+        sets_tool=sets_tool,
+    )
+
+
+def parse_marker(line: str):
+    """Step index for a progress marker, END_MARKER for the last one, None otherwise."""
+    if not line.startswith(MARKER):
+        return None
+    if line == END_MARKER:
+        return END_MARKER
+    try:
+        return int(line[len(MARKER) :])
+    except ValueError:
+        return None
@@ -0,0 +1,235 @@
+"""
+Precomputed reachability of the workspace, for rejecting targets without asking the robot.
+
+The map is a voxel grid over the flange position and the direction its
+axis points, built offline from the kinematic model. Each cell holds one
+signed byte: the joint limit margin in degrees at the cell centre, or
+BOUNDARY when the centre is out of reach but a neighbouring cell isn't,
+or UNREACHABLE. Only UNREACHABLE rejects a target, a cell is coarse and
+the boundary is left for the controller to judge.
+
+Roll doesn't change whether the flange can get there, j4 and j6 turn
+further than a full circle.
+
+The file is memory mapped, a lookup is a few multiplications and one byte.
+
+    python -m staubli.robot.reach reach.bin
+"""
+
+import argparse
+import logging
+import math
+import mmap
+import multiprocessing
+import os
+import struct
+import time
+from typing import Optional
+
+from . import kinematics
+from .machine import EffectorLocation
+
+log = logging.getLogger(__name__)
+
+# Millimetres between cell centres
+CELL = 100.0
+# Cell centres from -EXTENT to EXTENT on every axis, past the 985 mm reach
+EXTENT = 1000.0
+# Degrees between orientation bin centres, pitch 0..180 and yaw all the way round
+ANGLE = 45.0
+
+UNREACHABLE = -128
+BOUNDARY = -1
+
+MAGIC = b"STREACH1"
+# magic, cell, origin x y z, cells along x y z, pitch bins, yaw bins
+HEADER = struct.Struct("<8s4f5I")
+
+
+class Unreachable(ValueError):
+    """The target is out of reach in any configuration."""
+
+
+class ReachMap:
+    def __init__(self, buffer, cell: float, origin: tuple, shape: tuple):
+        self.buffer = buffer
+        self.cell = cell
+        self.origin = origin
+        # x, y, z, pitch, yaw
+        self.shape = shape
+        self.angle = 180.0 / (shape[3] - 1)
+        nx, ny, nz, npitch, nyaw = shape
+        self._strides = (
+            ny * nz * npitch * nyaw,
+            nz * npitch * nyaw,
+            npitch * nyaw,
+            nyaw,
+            1,
+        )
+
+    @staticmethod
+    def open(path: str) -> "ReachMap":
+        with open(path, "rb") as f:
+            # The mapping stays valid once the file is closed
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, cell, *rest = HEADER.unpack_from(mapped)
+        if magic != MAGIC:
+            raise ValueError(f"{path} isn't a reachability map")
+        origin, shape = tuple(rest[:3]), tuple(rest[3:])
+        cells = math.prod(shape)
+        if len(mapped) != HEADER.size + cells:
+            raise ValueError(
+                f"{path} is {len(mapped)} bytes, expected {HEADER.size + cells}"
+            )
+        return ReachMap(
+            memoryview(mapped)[HEADER.size :].cast("b"), cell, origin, shape
+        )
+
+    def lookup(
+        self, location: EffectorLocation, tool: Optional[EffectorLocation] = None
+    ) -> int:
+        """The cell's byte for a target, UNREACHABLE outside the grid."""
+        rotation, position = kinematics.flange(location, tool)
+        index = 0
+        for axis, (p, o) in enumerate(zip(position, self.origin)):
+            i = round((p - o) / self.cell)
+            if not 0 <= i < self.shape[axis]:
+                return UNREACHABLE
+            index += i * self._strides[axis]
+
+        # Direction of the flange axis, the last column of the rotation
+        ax, ay, az = rotation[0][2], rotation[1][2], rotation[2][2]
+        pitch = math.degrees(math.acos(max(-1.0, min(1.0, az))))
+        yaw = math.degrees(math.atan2(ay, ax))
+        index += round(pitch / self.angle) * self._strides[3]
+        index += round(yaw / self.angle) % self.shape[4]
+        return self.buffer[index]
+
+    def check(
+        self, location: EffectorLocation, tool: Optional[EffectorLocation] = None
+    ):
+        if self.lookup(location, tool) == UNREACHABLE:
+            raise Unreachable(f"{location.format()} is out of reach")
+
+
+# Maps opened so far by path, a missing or broken one is tried again next time
+_opened: dict[str, ReachMap] = {}
+_warned: set[str] = set()
+
+
+def load(path: str) -> Optional[ReachMap]:
+    """The map at path, opened on first use. None without one, targets then go to the robot unchecked."""
+    reach = _opened.get(path)
+    if reach is not None:
+        return reach
+    if not os.path.exists(path):
+        if path not in _warned:
+            _warned.add(path)
+            log.warning(
+                "no reachability map at %s, build one with python -m staubli.robot.reach",
+                path,
+            )
+        return None
+    reach = _opened[path] = ReachMap.open(path)
+    log.info("reachability map %s, %d cells", path, math.prod(reach.shape))
+    return reach
+
+
+def _centres(count: int, first: float, step: float) -> list[float]:
+    return [first + i * step for i in range(count)]
+
+
+def _slab(args) -> bytes:
+    """Margin bytes of every cell with one x, centres only."""
+    x, ys, zs, pitches, yaws = args
+    out = bytearray()
+    for y in ys:
+        for z in zs:
+            for pitch in pitches:
+                for yaw in yaws:
+                    location = EffectorLocation(x, y, z, yaw, pitch, 0.0)
+                    margins = [
+                        kinematics.margin(joints)
+                        for joints in kinematics.solutions(location).values()
+                        if joints is not None
+                    ]
+                    value = min(127, int(max(margins))) if margins else UNREACHABLE
+                    out += struct.pack("<b", value)
+    return bytes(out)
+
+
+def _dilate(reachable: bytearray, shape: tuple, axis: int, wrap: bool):
+    """Mark cells next to a reachable one along axis, in place."""
+    stride = math.prod(shape[axis + 1 :])
+    count = shape[axis]
+    source = bytes(reachable)
+    for index in range(len(source)):
+        if source[index]:
+            continue
+        i = (index // stride) % count
+        for step in (-1, 1):
+            j = i + step
+            if wrap:
+                j %= count
+            elif not 0 <= j < count:
+                continue
+            if source[index + (j - i) * stride]:
+                reachable[index] = 1
+                break
+
+
+def build(
+    cell: float = CELL,
+    extent: float = EXTENT,
+    angle: float = ANGLE,
+    processes: int = None,
+) -> bytes:
+    """The whole file, header and cells."""
+    centres = _centres(int(round(2 * extent / cell)) + 1, -extent, cell)
+    pitches = _centres(int(round(180 / angle)) + 1, 0.0, angle)
+    yaws = _centres(int(round(360 / angle)), 0.0, angle)
+    shape = (len(centres), len(centres), len(centres), len(pitches), len(yaws))
+
+    work = [(x, centres, centres, pitches, yaws) for x in centres]
+    if processes == 1:
+        cells = bytearray(b"".join(map(_slab, work)))
+    else:
+        with multiprocessing.Pool(processes) as pool:
+            cells = bytearray(b"".join(pool.map(_slab, work)))
+
+    margins = memoryview(cells).cast("b")
+    reachable = bytearray(margin != UNREACHABLE for margin in margins)
+    near = bytearray(reachable)
+    for axis in range(len(shape)):
+        _dilate(near, shape, axis, wrap=axis == 4)
+    for index in range(len(cells)):
+        if near[index] and not reachable[index]:
+            margins[index] = BOUNDARY
+    margins.release()
+
+    header = HEADER.pack(MAGIC, cell, -extent, -extent, -extent, *shape)
+    return header + bytes(cells)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("path", nargs="?", default="reach.bin")
+    parser.add_argument(
+        "--cell", type=float, default=CELL, help="mm between cell centres"
+    )
+    parser.add_argument(
+        "--angle", type=float, default=ANGLE, help="degrees between orientation bins"
+    )
+    parser.add_argument("--processes", type=int, default=None)
+    args = parser.parse_args()
+
+    began = time.perf_counter()
+    data = build(args.cell, EXTENT, args.angle, args.processes)
+    with open(args.path, "wb") as f:
+        f.write(data)
+    reach = ReachMap.open(args.path)
+    reachable = sum(1 for b in reach.buffer if b != UNREACHABLE)
+    print(
+        f"{args.path}: {len(reach.buffer)} cells, {reachable} reachable or boundary, "
+        f"{time.perf_counter() - began:.1f}s"
+    )
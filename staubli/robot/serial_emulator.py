@@ -1,11 +1,108 @@
 from textwrap import dedent
 from .machine import JointLocation, EffectorLocation, joint_attrs
+from .path import multiply, quaternion_to_zyz, rotate, zyz_to_quaternion
+from .program import EDITOR_EXIT
 import time
 import re
 import math
+import logging
+import random
+import string
+from collections import Counter
+from dataclasses import dataclass, field, fields
+
+from staubli.log import TRACE
+
+log = logging.getLogger(__name__)
+wire_log = logging.getLogger("staubli.serial.emulator")
 
 INITIAL_JOINT_LOCATION = JointLocation(-0.000, -90.001, 89.993, 0.000, -0.000, -0.005)
-INITIAL_EFFECTOR_LOCATION = EffectorLocation(-0.077, 0.000, 985.000, 179.999, 0.008, 179.995)
+INITIAL_EFFECTOR_LOCATION = EffectorLocation(
+    -0.077, 0.000, 985.000, 179.999, 0.008, 179.995
+)
+
+# Errors an injected fault answers with, as the monitor prints them
+FAULT_ERRORS = ("Position out of range", "Time-out nulling errors", "Undefined value")
+# Characters a corrupted reply picks from, the prompt and error markers included
+_GARBLE = string.ascii_letters + string.digits + " .-*"
+
+
+@dataclass
+class Faults:
+    """
+    Probabilities of each fault per command, drawn from one seeded generator.
+
+    error:      answer "*...*" instead of running the command
+    truncate:   cut the reply short, the prompt is lost
+    corrupt:    replace a few characters of the reply
+    stall:      run the command, then go quiet for stall_seconds
+    disconnect: drop everything written or read for disconnect_seconds
+    jitter:     run the transfer at a baud rate up to jitter_range off
+    """
+
+    error: float = 0.0
+    truncate: float = 0.0
+    corrupt: float = 0.0
+    stall: float = 0.0
+    disconnect: float = 0.0
+    jitter: float = 0.0
+    stall_seconds: float = 1.0
+    disconnect_seconds: float = 2.0
+    jitter_range: float = 0.5
+    seed: int = 0
+    # Faults injected so far, by name
+    injected: Counter = field(default_factory=Counter, compare=False)
+
+    def __post_init__(self):
+        self.random = random.Random(self.seed)
+        self.disconnected_until = 0.0
+
+    @staticmethod
+    def parse(text: str) -> "Faults":
+        """From "error=0.05,stall=0.01,seed=3", the form EMULATOR_FAULTS takes."""
+        types = {f.name: f.type for f in fields(Faults) if f.type in (int, float)}
+        values = {}
+        for item in filter(None, (i.strip() for i in text.split(","))):
+            name, _, value = item.partition("=")
+            name = name.strip()
+            if name not in types:
+                raise ValueError(
+                    f"unknown fault {name!r}, expected one of {', '.join(types)}"
+                )
+            values[name] = types[name](value)
+        return Faults(**values)
+
+    def roll(self, name: str) -> bool:
+        if self.random.random() >= getattr(self, name):
+            return False
+        self.injected[name] += 1
+        log.debug("injecting %s", name)
+        return True
+
+    def disconnected(self) -> bool:
+        return time.monotonic() < self.disconnected_until
+
+    def disconnect_now(self):
+        self.disconnected_until = time.monotonic() + self.disconnect_seconds
+
+    def garble(self, reply: str) -> str:
+        if reply and self.roll("truncate"):
+            # Anywhere before the prompt
+            reply = reply[: self.random.randrange(len(reply))]
+        if reply and self.roll("corrupt"):
+            characters = list(reply)
+            for _ in range(self.random.randint(1, 3)):
+                i = self.random.randrange(len(characters))
+                if characters[i] != "\n":
+                    characters[i] = self.random.choice(_GARBLE)
+            reply = "".join(characters)
+        return reply
+
+    def baud(self, baud: float) -> float:
+        if not self.roll("jitter"):
+            return baud
+        return baud * self.random.uniform(1 - self.jitter_range, 1 + self.jitter_range)
+
 
 class SerialEmulator:
     # Derived from a "where" after a "do ready"
@@ -17,19 +114,38 @@ class SerialEmulator:
     buffer = ""
     baud = 9600
 
+    def __init__(self, faults: Faults = None):
+        # Chaos mode, None for a well behaved controller
+        self.faults = faults
+        # Location and precision point variables by name, # included
+        self.variables = {}
+        # Program bodies by name
+        self.programs = {}
+        # Name of the program open in the editor
+        self.editing = None
+
     @property
     def in_waiting(self):
+        if self.faults is not None and self.faults.disconnected():
+            return 0
         return len(self.buffer)
 
     def readline(self):
-        print(">>> serial.readline()")
+        if wire_log.isEnabledFor(TRACE):
+            wire_log.log(TRACE, "serial.readline()")
+        if self.faults is not None and self.faults.disconnected():
+            return b""
         buffer_lines = self.buffer.split("\n")
         response = buffer_lines[0]
         self.buffer = "\n".join(buffer_lines[1:])
         self.delay(response)
         return bytes(response, "ascii")
+
     def read(self, count):
-        print(f">>> serial.read({count})")
+        if wire_log.isEnabledFor(TRACE):
+            wire_log.log(TRACE, "serial.read(%d)", count)
+        if self.faults is not None and self.faults.disconnected():
+            return b""
         response = self.buffer[:count]
         self.buffer = self.buffer[count:]
         self.delay(response)
@@ -38,120 +154,274 @@ class SerialEmulator:
     def write(self, cmd_b: bytes):
         cmd = cmd_b.decode("ascii")
         self.delay(cmd)
-        print(f"< {cmd}")
+        if wire_log.isEnabledFor(TRACE):
+            wire_log.log(TRACE, "< %s", cmd)
+
+        faults = self.faults
+        if faults is None:
+            self.respond(cmd)
+            return
 
+        if faults.disconnected() or faults.roll("disconnect"):
+            if not faults.disconnected():
+                faults.disconnect_now()
+            # Lost on the way, along with anything unread
+            self.buffer = ""
+            return
+        if faults.roll("error"):
+            error = faults.random.choice(FAULT_ERRORS)
+            self.buffer = f"<emulator error response>\n*{error}*\n."
+            return
+        self.respond(cmd)
+        if faults.roll("stall"):
+            time.sleep(faults.stall_seconds)
+        self.buffer = faults.garble(self.buffer)
+
+    def respond(self, cmd: str):
+        """Run a command and leave its reply in the buffer."""
+        if self.editing is not None:
+            self.handle_edit(cmd.rstrip("\r"))
+            return
         if cmd.startswith("speed"):
             self.monitor_speed = float(cmd.split(" ")[1].strip())
-            print(f">>> setting speed {self.monitor_speed}")
+            log.debug("setting speed %s", self.monitor_speed)
             self.buffer = "<emulator speed response>\n."
             return
+        if cmd.startswith("do moves trans("):
+            log.debug("moving to trans")
+            self.handle_set_jog0(cmd)
+            self.handle_do_moves()
+            self.buffer = "<emulator moves trans response>\n."
+            return
+        if cmd.startswith("do move HERE:trans("):
+            log.debug("moving relative to HERE")
+            self.handle_move_relative(cmd)
+            self.buffer = "<emulator move HERE response>\n."
+            return
+        if cmd.startswith("do move #PPOINT("):
+            log.debug("moving to #PPOINT")
+            self.handle_set_jog1(cmd)
+            self.handle_do_move_precise()
+            self.buffer = "<emulator move #PPOINT response>\n."
+            return
         if cmd.startswith("do set jog0"):
-            print(">>> setting jog0")
+            log.debug("setting jog0")
             self.handle_set_jog0(cmd)
             self.buffer = "<emulator set jog0 response>\n."
             return
         if cmd.startswith("do moves jog0"):
-            print(">>> moving to jog0")
+            log.debug("moving to jog0")
             self.handle_do_moves()
             self.buffer = "<emulator moves jog0 response>\n."
             return
         if cmd.startswith("do set #jog1"):
-            print(">>> setting #jog1")
+            log.debug("setting #jog1")
             self.handle_set_jog1(cmd)
             self.buffer = "<emulator set #jog1 response>\n."
             return
         if cmd.startswith("do move #jog1"):
-            print(">>> moving to #jog1")
+            log.debug("moving to #jog1")
             self.handle_do_move_precise()
             self.buffer = "<emulator move #jog1 response>\n."
             return
         if cmd.startswith("do set hand.tool"):
-            print(">>> setting hand.tool point")
+            log.debug("setting hand.tool point")
             self.handle_set_tool(cmd)
             self.buffer = "<emulator set hand tool response>\n."
             return
         if cmd.startswith("TOOL hand.tool"):
-            print(">>> setting tool hand.tool")
+            log.debug("setting tool hand.tool")
             self.buffer = "<emulator tool response>\n."
             return
+        if cmd.startswith("do set "):
+            log.debug("setting variable")
+            self.handle_set_variable(cmd)
+            self.buffer = "<emulator set response>\n."
+            return
+        if cmd.startswith("DELETEP "):
+            name = cmd.split()[1]
+            if self.programs.pop(name, None) is None:
+                self.buffer = "*Undefined program or variable*\n."
+                return
+            self.buffer = "<emulator deletep response>\n."
+            return
+        if cmd.startswith("DIRECTORY"):
+            names = "".join(f"   {name}\n" for name in sorted(self.programs))
+            self.buffer = f"<emulator directory response>\n{names}."
+            return
+        if cmd.startswith("EDIT "):
+            self.editing = cmd.split()[1]
+            self.programs[self.editing] = []
+            log.debug("editing %s", self.editing)
+            self.buffer = f".PROGRAM {self.editing}()\n"
+            return
+        if cmd.startswith("EXECUTE "):
+            name = cmd.split()[1]
+            log.debug("executing %s", name)
+            self.buffer = f"<emulator execute response>\n{self.handle_execute(name)}\n."
+            return
+        if cmd.startswith("ABORT"):
+            # Programs run to completion as they start, there's never one to stop
+            self.buffer = "<emulator abort response>\n."
+            return
         if cmd.startswith("do drive "):
             self.handle_do_drive(cmd)
             self.buffer = "<emulator do drive response>\n."
             return
         if cmd.startswith("where"):
-            print(">>> concocting where")
-            self.buffer = dedent(f"""\
+            log.debug("concocting where")
+            self.buffer = dedent(
+                f"""\
                 
                 X         Y         Z         y         p         r       Hand
                 {self.effector_location.x:.3f}   {self.effector_location.y:.3f}   {self.effector_location.z:.3f}   {self.effector_location.yaw:.3f}   {self.effector_location.pitch:.3f}   {self.effector_location.roll:.3f}   0.000
                 J1        J2        J3        J4        J5        J6
                 {self.joint_location.j1:.3f}   {self.joint_location.j2:.3f}   {self.joint_location.j3:.3f}   {self.joint_location.j4:.3f}   {self.joint_location.j5:.3f}   {self.joint_location.j6:.3f}
-                .""")
+                ."""
+            )
             return
         if cmd.startswith("LISTL hand.tool"):
             if self.tool_location is None:
-                print(">>> concocting empty LISTL")
-                self.buffer = dedent(f"""\
+                log.debug("concocting empty LISTL")
+                self.buffer = dedent(
+                    f"""\
                  
                  X/J1      Y/J2      Z/J3      y/J4      p/J5      r/J6
-                .""")
+                ."""
+                )
                 return
-            print(">>> concocting LISTL")
-            self.buffer = dedent(f"""\
+            log.debug("concocting LISTL")
+            self.buffer = dedent(
+                f"""\
                  
                  X/J1      Y/J2      Z/J3      y/J4      p/J5      r/J6
                  hand.tool {self.tool_location.x:.3f}   {self.tool_location.y:.3f}   {self.tool_location.z:.3f}   {self.tool_location.yaw:.3f}   {self.tool_location.pitch:.3f}   {self.tool_location.roll:.3f}
-                .""")
+                ."""
+            )
             return
         if cmd.startswith("do above"):
-            print(">>> elbow above")
+            log.debug("elbow above")
             self.buffer = "<above>\n."
             return
         if cmd.startswith("do below"):
-            print(">>> elbow below")
+            log.debug("elbow below")
             self.buffer = "<below>\n."
             return
         if cmd.startswith("en po"):
-            print(">>> enabling high power")
-            self.buffer = dedent("""\
+            log.debug("enabling high power")
+            self.buffer = dedent(
+                """\
                 <high power line 1>
                 <high power line 2>
-                .""")
+                ."""
+            )
             return
         if cmd.startswith("do ready"):
-            print(">>> resetting")
+            log.debug("resetting")
             self.buffer = "<ready>\n."
             self.joint_location = INITIAL_JOINT_LOCATION
             self.effector_location = INITIAL_EFFECTOR_LOCATION
             return
-        
-        print(">>> unknown command")
-        self.buffer = dedent("""\
+
+        log.debug("unknown command")
+        self.buffer = dedent(
+            """\
             <unknown command line 1>
             <unknown command line 2>
-        .""")
-    
+        ."""
+        )
+
     def handle_set_jog0(self, cmd):
         pattern = r"trans\(([^)]+)\)"
         match = re.search(pattern, cmd)
         if match:
-            values = list(map(float, match.group(1).split(',')))
+            values = list(map(float, match.group(1).split(",")))
             self.jog0_location = EffectorLocation(*values)
-    
+
+    def handle_set_variable(self, cmd):
+        match = re.match(r"do set (#?[\w.]+) = (trans|#PPOINT)\(([^)]+)\)", cmd)
+        if match:
+            values = list(map(float, match.group(3).split(",")))
+            location_class = (
+                EffectorLocation if match.group(2) == "trans" else JointLocation
+            )
+            self.variables[match.group(1)] = location_class(*values)
+
+    def handle_edit(self, line):
+        if line.startswith(EDITOR_EXIT):
+            log.debug("leaving editor with %d lines", len(self.programs[self.editing]))
+            self.editing = None
+            self.buffer = "<emulator edit exit response>\n."
+            return
+        lines = self.programs[self.editing]
+        lines.append(line)
+        self.buffer = f"{len(lines)}. {line}\n"
+
+    def handle_execute(self, name) -> str:
+        """Run a program to completion, returns what it TYPEd."""
+        if name not in self.programs:
+            return "*Undefined program or variable*"
+
+        output = []
+        for line in self.programs[name]:
+            keyword, _, argument = line.partition(" ")
+            if keyword == "TYPE":
+                output.append(argument.strip('"'))
+            elif keyword == "SPEED":
+                self.monitor_speed = float(argument.split()[0])
+            elif keyword == "MOVES" and isinstance(
+                self.variables.get(argument), EffectorLocation
+            ):
+                self.jog0_location = self.variables[argument]
+                self.handle_do_moves()
+            elif keyword == "MOVE" and isinstance(
+                self.variables.get(argument), JointLocation
+            ):
+                self.jog1_location = self.variables[argument]
+                self.handle_do_move_precise()
+            elif keyword == "SET" and argument.startswith("hand.tool"):
+                self.handle_set_tool(argument)
+            elif keyword == "TOOL":
+                pass
+            else:
+                output.append("*Undefined value*")
+                break
+        return "\n".join(output)
+
+    def handle_move_relative(self, cmd):
+        pattern = r"trans\(([^)]+)\)"
+        match = re.search(pattern, cmd)
+        if not match:
+            return
+        delta = EffectorLocation(*map(float, match.group(1).split(",")))
+
+        # HERE:trans(...) applies the transform in the current tool frame
+        here = self.effector_location
+        q = zyz_to_quaternion(here.yaw, here.pitch, here.roll)
+        offset = rotate(q, (delta.x, delta.y, delta.z))
+        yaw, pitch, roll = quaternion_to_zyz(
+            multiply(q, zyz_to_quaternion(delta.yaw, delta.pitch, delta.roll)),
+            here.yaw,
+        )
+        self.jog0_location = EffectorLocation(
+            here.x + offset[0], here.y + offset[1], here.z + offset[2], yaw, pitch, roll
+        )
+        self.handle_do_moves()
+
     def handle_set_jog1(self, cmd):
         pattern = r"PPOINT\(([^)]+)\)"
         match = re.search(pattern, cmd)
         if match:
-            values = list(map(float, match.group(1).split(',')))
+            values = list(map(float, match.group(1).split(",")))
             self.jog1_location = JointLocation(*values)
-    
+
     def handle_set_tool(self, cmd):
         pattern = r"trans\(([^)]+)\)"
         match = re.search(pattern, cmd)
         if match:
-            values = list(map(float, match.group(1).split(',')))
+            values = list(map(float, match.group(1).split(",")))
             self.tool_location = EffectorLocation(*values)
-    
+
     def handle_do_moves(self):
         delta = self.effector_location - self.jog0_location
 
@@ -160,7 +430,9 @@ class SerialEmulator:
 
         max_distance = max(angle_distance, linear_distance)
         ms_delay = max_distance / self.monitor_speed
-        print(f">>> moving {linear_distance}mm and {angle_distance}deg ({ms_delay}ms)")
+        log.debug(
+            "moving %smm and %sdeg (%sms)", linear_distance, angle_distance, ms_delay
+        )
         time.sleep(ms_delay / 1000)
         self.effector_location = self.jog0_location
 
@@ -173,34 +445,41 @@ class SerialEmulator:
             abs(delta.j3),
             abs(delta.j4),
             abs(delta.j5),
-            abs(delta.j6)
+            abs(delta.j6),
         )
 
         ms_delay = angle_distance / self.monitor_speed
-        print(f">>> moving {angle_distance}deg ({ms_delay}ms)")
+        log.debug("moving %sdeg (%sms)", angle_distance, ms_delay)
         time.sleep(ms_delay / 1000)
         self.joint_location = self.jog1_location
 
     def handle_do_drive(self, cmd):
         drive, delta, command_speed = "".join(cmd.split(" ")[2:]).split(",")
 
-        speed = (float(command_speed)/100) * (self.monitor_speed/100) * 100
+        speed = (float(command_speed) / 100) * (self.monitor_speed / 100) * 100
 
         ms_delay = abs(float(delta)) / float(speed)
-        print(f">>> starting drive {drive} move {delta} at {speed} ({ms_delay}ms)")
+        log.debug(
+            "starting drive %s move %s at %s (%sms)", drive, delta, speed, ms_delay
+        )
         time.sleep(ms_delay / 1000)
 
         joint_attr = joint_attrs[int(drive) - 1]
         current_joint_angle = getattr(self.joint_location, joint_attr)
         next_joint_angle = current_joint_angle + float(delta)
         setattr(self.joint_location, joint_attr, next_joint_angle)
-        print(f">>> set joint {joint_attr} from {current_joint_angle} to {next_joint_angle}")
-
+        log.debug(
+            "set joint %s from %s to %s",
+            joint_attr,
+            current_joint_angle,
+            next_joint_angle,
+        )
 
     def close(self):
         pass
 
     def delay(self, string: str):
         bits = len(string) * 8
-        delay = bits / self.baud
+        baud = self.faults.baud(self.baud) if self.faults is not None else self.baud
+        delay = bits / baud
         time.sleep(delay)
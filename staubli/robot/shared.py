@@ -0,0 +1,118 @@
+"""
+Robot state in shared memory, for processes that don't own the robot.
+
+There is one writer, the process that owns the serial port, and any number
+of readers. A seqlock guards the struct: the writer makes the sequence odd,
+writes and makes it even again, readers retry while it is odd or when it
+changed under them. Readers unpack straight from the mapped buffer.
+"""
+
+import struct
+import threading
+import time
+from multiprocessing import shared_memory
+
+# sequence, version, effector x..roll, joints j1..j6, tool x..roll, speed, below, busy
+LAYOUT = struct.Struct("<QQ6d6d6dd??")
+_SEQUENCE = struct.Struct("<Q")
+_VERSION_OFFSET = _SEQUENCE.size
+# Everything after the sequence. pack_into zeroes the whole struct before
+# packing, written with LAYOUT a reader could catch the sequence at 0
+_STATE = struct.Struct("<Q6d6d6dd??")
+
+EFFECTOR = ("x", "y", "z", "yaw", "pitch", "roll")
+JOINTS = ("j1", "j2", "j3", "j4", "j5", "j6")
+
+
+class SharedState:
+    def __init__(self, name: str = None, create: bool = False):
+        self.memory = shared_memory.SharedMemory(
+            name=name, create=create, size=LAYOUT.size
+        )
+        self.buffer = self.memory.buf
+        # Listener threads in the owner take turns being the one writer
+        self._write_lock = threading.Lock()
+        if create:
+            self.buffer[: LAYOUT.size] = bytes(LAYOUT.size)
+
+    @property
+    def name(self) -> str:
+        return self.memory.name
+
+    def sequence(self) -> int:
+        """Even and above zero once the first state is written."""
+        return _SEQUENCE.unpack_from(self.buffer)[0]
+
+    def version(self) -> int:
+        """StatePublisher version last written, cheap enough to poll."""
+        return _SEQUENCE.unpack_from(self.buffer, _VERSION_OFFSET)[0]
+
+    def write(self, version: int, state: dict):
+        """Write a StatePublisher snapshot, only ever from the owning process."""
+        position = state.get("position") or {}
+        effector = position.get("effector") or {}
+        joints = position.get("joints") or {}
+        tool = state.get("tool_offset") or {}
+
+        with self._write_lock:
+            self._write(version, effector, joints, tool, state)
+
+    def _write(self, version, effector, joints, tool, state):
+        sequence = self.sequence()
+        _SEQUENCE.pack_into(self.buffer, 0, sequence + 1)
+        _STATE.pack_into(
+            self.buffer,
+            _VERSION_OFFSET,
+            version,
+            *(effector.get(k, 0.0) for k in EFFECTOR),
+            *(joints.get(k, 0.0) for k in JOINTS),
+            *(tool.get(k, 0.0) for k in EFFECTOR),
+            state.get("speed", 0.0),
+            state.get("elbow") == "below",
+            bool(state.get("busy")),
+        )
+        _SEQUENCE.pack_into(self.buffer, 0, sequence + 2)
+
+    def read(self) -> tuple[int, dict]:
+        """Version and state in the shape StatePublisher keeps it."""
+        while True:
+            before = self.sequence()
+            if before & 1:
+                # Mid write, the writer holds it for microseconds
+                time.sleep(0)
+                continue
+            values = LAYOUT.unpack_from(self.buffer)
+            if values[0] == before and self.sequence() == before:
+                break
+
+        return values[1], {
+            "position": {
+                "effector": dict(zip(EFFECTOR, values[2:8])),
+                "joints": dict(zip(JOINTS, values[8:14])),
+            },
+            "tool_offset": dict(zip(EFFECTOR, values[14:20])),
+            "speed": values[20],
+            "elbow": "below" if values[21] else "above",
+            "busy": values[22],
+        }
+
+    def snapshot(self) -> dict:
+        version, state = self.read()
+        return {"version": version, "state": state}
+
+    def publish_from(self, publisher):
+        """Keep this segment in step with a StatePublisher."""
+
+        def write(message):
+            snapshot = publisher.snapshot()
+            self.write(snapshot["version"], snapshot["state"])
+
+        write(None)
+        publisher.subscribe(write)
+
+    def close(self):
+        self.buffer.release()
+        self.memory.close()
+
+    def unlink(self):
+        self.memory.unlink()
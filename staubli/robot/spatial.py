@@ -0,0 +1,168 @@
+import math
+from typing import Iterable, Optional
+
+from .machine import EffectorLocation
+from .path import zyz_to_quaternion
+
+# Millimeters of distance one radian of orientation difference counts as
+ORIENTATION_WEIGHT = 200.0
+
+DIMENSIONS = 7
+
+# Rebuild once the tree is this many times deeper than a balanced one
+REBUILD_FACTOR = 3
+
+
+class Node:
+    __slots__ = ("key", "value", "left", "right")
+
+    def __init__(self, key, value):
+        self.key = key
+        self.value = value
+        self.left = None
+        self.right = None
+
+
+class PointIndex:
+    """
+    KD-tree over locations keyed on position plus weighted orientation.
+
+    Orientation enters as a unit quaternion scaled so that a small rotation
+    of one radian is ORIENTATION_WEIGHT mm away. Points are inserted
+    incrementally and the tree is rebuilt balanced if it grows lopsided.
+
+    q and -q are the same orientation. Keys are stored with w >= 0, which
+    splits rotations near 180 degrees across the tree, so queries search
+    with both signs and keep the closer.
+    """
+
+    def __init__(self, orientation_weight: float = ORIENTATION_WEIGHT):
+        self.orientation_weight = orientation_weight
+        self.root: Optional[Node] = None
+        self.size = 0
+        self.depth = 0
+
+    def key(self, location: EffectorLocation) -> tuple:
+        q = zyz_to_quaternion(location.yaw, location.pitch, location.roll)
+        if q[0] < 0:
+            # q and -q are the same orientation
+            q = tuple(-i for i in q)
+        # The chord between unit quaternions is ~half the rotation angle
+        scale = 2 * self.orientation_weight
+        return (location.x, location.y, location.z) + tuple(scale * i for i in q)
+
+    def _targets(self, location: EffectorLocation) -> tuple[tuple, tuple]:
+        key = self.key(location)
+        return key, key[:3] + tuple(-i for i in key[3:])
+
+    def distance(self, a: EffectorLocation, b: EffectorLocation) -> float:
+        """The distance the index measures between two locations."""
+        key = self.key(b)
+        return min(math.dist(target, key) for target in self._targets(a))
+
+    def build(self, items: Iterable[tuple[EffectorLocation, object]]):
+        nodes = [Node(self.key(location), value) for location, value in items]
+        self.size = len(nodes)
+        self.depth = 0
+        self.root = self._build(nodes, 0)
+
+    def _build(self, nodes: list[Node], depth: int) -> Optional[Node]:
+        if not nodes:
+            return None
+        self.depth = max(self.depth, depth + 1)
+        axis = depth % DIMENSIONS
+        nodes.sort(key=lambda n: n.key[axis])
+        middle = len(nodes) // 2
+        node = nodes[middle]
+        node.left = self._build(nodes[:middle], depth + 1)
+        node.right = self._build(nodes[middle + 1 :], depth + 1)
+        return node
+
+    def _nodes(self):
+        stack = [self.root] if self.root else []
+        while stack:
+            node = stack.pop()
+            yield node
+            stack.extend(child for child in (node.left, node.right) if child)
+
+    def insert(self, location: EffectorLocation, value):
+        node = Node(self.key(location), value)
+        self.size += 1
+        if self.root is None:
+            self.root = node
+            self.depth = 1
+            return
+
+        parent, depth = self.root, 0
+        while True:
+            axis = depth % DIMENSIONS
+            side = "left" if node.key[axis] < parent.key[axis] else "right"
+            child = getattr(parent, side)
+            depth += 1
+            if child is None:
+                setattr(parent, side, node)
+                break
+            parent = child
+
+        self.depth = max(self.depth, depth + 1)
+        if self.depth > REBUILD_FACTOR * (math.log2(self.size) + 1):
+            nodes = list(self._nodes())
+            for n in nodes:
+                n.left = n.right = None
+            self.depth = 0
+            self.root = self._build(nodes, 0)
+
+    def nearest(self, location: EffectorLocation) -> Optional[tuple[float, object]]:
+        """The closest point as (distance, value), or None when empty."""
+        if self.root is None:
+            return None
+        best = [math.inf, None]
+        for target in self._targets(location):
+            self._nearest(self.root, target, 0, best)
+        return math.sqrt(best[0]), best[1]
+
+    def _nearest(self, node, target, depth, best):
+        distance = sum((a - b) ** 2 for a, b in zip(node.key, target))
+        if distance < best[0]:
+            best[0], best[1] = distance, node.value
+
+        axis = depth % DIMENSIONS
+        delta = target[axis] - node.key[axis]
+        near, far = (node.left, node.right) if delta < 0 else (node.right, node.left)
+        if near is not None:
+            self._nearest(near, target, depth + 1, best)
+        if far is not None and delta * delta < best[0]:
+            self._nearest(far, target, depth + 1, best)
+
+    def within(
+        self, location: EffectorLocation, radius: float
+    ) -> list[tuple[float, object]]:
+        """All points no further than radius as (distance, value), closest first."""
+        radius_squared = radius * radius
+        # Closest distance to each node found so far, by node
+        found = {}
+        for target in self._targets(location):
+            stack = [(self.root, 0)] if self.root else []
+            while stack:
+                node, depth = stack.pop()
+                distance = sum((a - b) ** 2 for a, b in zip(node.key, target))
+                if (
+                    distance <= radius_squared
+                    and distance < found.get(node, (math.inf,))[0]
+                ):
+                    found[node] = (distance, node.value)
+
+                axis = depth % DIMENSIONS
+                delta = target[axis] - node.key[axis]
+                if node.left is not None and (
+                    delta < 0 or delta * delta <= radius_squared
+                ):
+                    stack.append((node.left, depth + 1))
+                if node.right is not None and (
+                    delta >= 0 or delta * delta <= radius_squared
+                ):
+                    stack.append((node.right, depth + 1))
+
+        return sorted(
+            ((math.sqrt(d), value) for d, value in found.values()), key=lambda f: f[0]
+        )
@@ -0,0 +1,101 @@
+import dataclasses
+import threading
+
+from .commands import MOTION
+
+
+class StatePublisher:
+    """Versioned robot state, listeners receive only the fields that changed."""
+
+    def __init__(self, **initial):
+        self.version = 0
+        self.state = dict(initial)
+        self._listeners = []
+        self._lock = threading.Lock()
+
+    def update(self, **fields):
+        with self._lock:
+            delta = {k: v for k, v in fields.items() if self.state.get(k) != v}
+            if not delta:
+                return
+            self.state.update(delta)
+            self.version += 1
+            message = {"version": self.version, "delta": delta}
+            listeners = list(self._listeners)
+
+        for listener in listeners:
+            listener(message)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {"version": self.version, "state": dict(self.state)}
+
+    def subscribe(self, listener):
+        with self._lock:
+            self._listeners.append(listener)
+
+    def unsubscribe(self, listener):
+        with self._lock:
+            self._listeners.remove(listener)
+
+
+def _format_position(where) -> dict:
+    return {
+        "effector": dataclasses.asdict(where[0]),
+        "joints": dataclasses.asdict(where[1]),
+    }
+
+
+class RobotStateTracker:
+    """
+    Keeps a StatePublisher current from the commands a CommandQueue runs.
+
+    Query results are published as they pass through, and commands that move
+    the robot mark the position stale. Stale fields are re-read once the
+    queue drains, so a burst of moves costs one where no matter how many
+    clients are watching.
+    """
+
+    def __init__(self, publisher: StatePublisher):
+        self.publisher = publisher
+        self.stale = {"position", "tool_offset"}
+
+    def dispatched(self):
+        self.publisher.update(busy=True)
+
+    def completed(self, name, args, result):
+        if name == "where":
+            self.stale.discard("position")
+            self.publisher.update(position=_format_position(result))
+        elif name == "tool_offset":
+            self.stale.discard("tool_offset")
+            self.publisher.update(tool_offset=dataclasses.asdict(result))
+        elif name == "speed":
+            self.publisher.update(speed=args[0])
+        elif name in ("above", "below"):
+            self.publisher.update(elbow=name)
+        elif name == "tool_transform":
+            self.publisher.update(tool_offset=dataclasses.asdict(args[0]))
+            self.stale.add("position")
+        elif name == "run_program":
+            program = args[0]
+            if program.final_speed is not None:
+                self.publisher.update(speed=program.final_speed)
+            self.stale.add("position")
+            if program.sets_tool:
+                self.stale.add("tool_offset")
+        elif name in MOTION:
+            self.stale.add("position")
+        elif name in ("exec", "flail", "enable_power"):
+            # Anything could have happened at the console
+            self.stale.update(("position", "tool_offset"))
+
+    def idle(self, robot):
+        self.refresh(robot)
+        self.publisher.update(busy=False)
+
+    def refresh(self, robot):
+        if "position" in self.stale:
+            self.completed("where", (), robot.where())
+        if "tool_offset" in self.stale:
+            self.completed("tool_offset", (), robot.tool_offset())
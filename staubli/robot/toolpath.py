@@ -0,0 +1,282 @@
+"""
+Streaming import of CSV pose lists and simple G-code toolpaths.
+
+Every stage is a generator, lines are read as the robot asks for more
+moves and at most CHUNKS_AHEAD chunks of moves are queued at once, so a
+path of any length runs in constant memory.
+
+    python -m staubli.robot.toolpath path.gcode --fixture 400,0,0,0,0,0
+"""
+
+import argparse
+import csv
+import itertools
+import os
+import re
+import time
+from collections import deque
+from typing import IO, Iterable, Iterator, Optional, Union
+
+from .kinematics import ElbowPlanner
+from .machine import EffectorLocation
+from .path import multiply, quaternion_to_zyz, rotate, zyz_to_quaternion
+
+# Moves submitted together
+CHUNK_SIZE = 50
+# Chunks queued before waiting for the oldest to finish
+CHUNKS_AHEAD = 2
+
+# Tool pointing straight down, for paths without orientation
+DOWN = (0.0, 180.0, 0.0)
+
+FORMATS = {
+    ".csv": "csv",
+    ".gcode": "gcode",
+    ".nc": "gcode",
+    ".ngc": "gcode",
+}
+CONTENT_TYPES = {
+    "text/csv": "csv",
+    "text/x-gcode": "gcode",
+}
+
+_WORD = re.compile(r"([A-Z])\s*([-+]?(?:\d+\.?\d*|\.\d+))")
+_COMMENT = re.compile(r"\([^)]*\)|;.*")
+_INCH = 25.4
+
+
+def resolve(path: str, directory: Optional[str]) -> str:
+    """path within directory, PermissionError if it leads anywhere else."""
+    if not directory:
+        raise PermissionError(
+            "toolpath files are turned off, upload the toolpath instead"
+        )
+    root = os.path.realpath(directory)
+    # Symlinks and .. are resolved before comparing, an absolute path replaces root
+    resolved = os.path.realpath(os.path.join(root, path))
+    if os.path.commonpath([root, resolved]) != root:
+        raise PermissionError(f"{path} is outside the toolpath directory")
+    return resolved
+
+
+def read_lines(source: Union[str, IO, Iterable]) -> Iterator[str]:
+    """Lines of a file path, or of an open file or any iterable of bytes or str lines."""
+    if isinstance(source, str):
+        with open(source, newline="") as f:
+            yield from f
+        return
+    for line in source:
+        yield line.decode("utf-8") if isinstance(line, bytes) else line
+
+
+def parse_csv(lines: Iterable[str], orientation=DOWN) -> Iterator[EffectorLocation]:
+    """
+    Rows of x,y,z or x,y,z,yaw,pitch,roll.
+
+    A header row names the columns in any order, without yaw, pitch and
+    roll columns every point gets orientation.
+    """
+    rows = csv.reader(lines)
+    columns = None
+    for number, row in enumerate(rows, 1):
+        row = [cell.strip() for cell in row]
+        if not row or not any(row) or row[0].startswith("#"):
+            continue
+        if columns is None:
+            try:
+                [float(cell) for cell in row]
+                columns = ["x", "y", "z", "yaw", "pitch", "roll"]
+            except ValueError:
+                columns = [cell.lower() for cell in row]
+                if not {"x", "y", "z"} <= set(columns):
+                    raise ValueError(f"line {number}: header needs x, y and z columns")
+                continue
+
+        try:
+            values = dict(zip(columns, map(float, row)))
+        except ValueError:
+            # Not the row itself, the message ends up in api responses
+            raise ValueError(f"line {number}: not a number")
+        if len(values) < 3:
+            raise ValueError(f"line {number}: expected at least x, y and z")
+        yield EffectorLocation(
+            values["x"],
+            values["y"],
+            values["z"],
+            values.get("yaw", orientation[0]),
+            values.get("pitch", orientation[1]),
+            values.get("roll", orientation[2]),
+        )
+
+
+def parse_gcode(lines: Iterable[str], orientation=DOWN) -> Iterator[EffectorLocation]:
+    """
+    G0/G1 moves with G90/G91 and G20/G21, starting from the fixture origin.
+
+    Feeds, spindle and tool words are ignored, the robot's speed applies.
+    """
+    position = [0.0, 0.0, 0.0]
+    relative = False
+    scale = 1.0
+    for number, line in enumerate(lines, 1):
+        words = _WORD.findall(_COMMENT.sub("", line).upper())
+        moved = False
+        target = list(position)
+        for letter, value in words:
+            if letter == "G":
+                code = float(value)
+                if code in (0, 1):
+                    continue
+                elif code == 90:
+                    relative = False
+                elif code == 91:
+                    relative = True
+                elif code == 20:
+                    scale = _INCH
+                elif code == 21:
+                    scale = 1.0
+                elif code in (2, 3):
+                    raise ValueError(f"line {number}: arcs (G2/G3) aren't supported")
+            elif letter in "XYZ":
+                axis = "XYZ".index(letter)
+                distance = float(value) * scale
+                target[axis] = position[axis] + distance if relative else distance
+                moved = True
+        if moved:
+            position = target
+            yield EffectorLocation(*position, *orientation)
+
+
+def apply_fixture(
+    locations: Iterable[EffectorLocation], fixture: Optional[EffectorLocation]
+) -> Iterator[EffectorLocation]:
+    """Locations given in the fixture's frame, in world coordinates."""
+    if fixture is None:
+        yield from locations
+        return
+
+    frame = zyz_to_quaternion(fixture.yaw, fixture.pitch, fixture.roll)
+    yaw_hint = fixture.yaw
+    for location in locations:
+        offset = rotate(frame, (location.x, location.y, location.z))
+        yaw, pitch, roll = quaternion_to_zyz(
+            multiply(
+                frame, zyz_to_quaternion(location.yaw, location.pitch, location.roll)
+            ),
+            yaw_hint,
+        )
+        yaw_hint = yaw
+        yield EffectorLocation(
+            fixture.x + offset[0],
+            fixture.y + offset[1],
+            fixture.z + offset[2],
+            yaw,
+            pitch,
+            roll,
+        )
+
+
+def load(
+    source, format: str, fixture: Optional[EffectorLocation] = None, orientation=DOWN
+) -> Iterator[EffectorLocation]:
+    parse = {"csv": parse_csv, "gcode": parse_gcode}.get(format)
+    if parse is None:
+        raise ValueError(f"unknown toolpath format {format!r}")
+    return apply_fixture(parse(read_lines(source), orientation), fixture)
+
+
+def chunked(items: Iterable, size: int) -> Iterator[list]:
+    iterator = iter(items)
+    while chunk := list(itertools.islice(iterator, size)):
+        yield chunk
+
+
+def feed(
+    robot,
+    locations: Iterable[EffectorLocation],
+    chunk_size=CHUNK_SIZE,
+    chunks_ahead=CHUNKS_AHEAD,
+    planner: Optional[ElbowPlanner] = None,
+) -> int:
+    """
+    Queue moves on a QueuedRobot a chunk at a time, returns the number of moves.
+
+    Parsing only runs ahead of the robot by chunks_ahead chunks, waiting on
+    the oldest chunk is the backpressure. A stop cancels what is queued and
+    the CancelledError ends the import, any other error cancels the moves
+    still queued before it is raised. With a planner each chunk's elbows
+    are chosen together, and where the elbow changes above or below is
+    queued with a joint move to the target in place of the straight one.
+    """
+    in_flight = deque()
+    count = 0
+    try:
+        for chunk in chunked(locations, chunk_size):
+            if len(in_flight) >= chunks_ahead:
+                for future in in_flight[0]:
+                    future.result()
+                in_flight.popleft()
+            switches = (
+                planner.plan(chunk) if planner is not None else [None] * len(chunk)
+            )
+            futures = []
+            in_flight.append(futures)
+            for location, switch in zip(chunk, switches):
+                if switch is None:
+                    futures.append(robot.submit("jog_absolute", location))
+                    continue
+                # The elbow only changes on a joint move, which leaves the straight line
+                elbow, joints = switch
+                futures.append(robot.submit(elbow))
+                futures.append(robot.submit("jog_joint", joints))
+            count += len(chunk)
+
+        while in_flight:
+            for future in in_flight[0]:
+                future.result()
+            in_flight.popleft()
+    except BaseException:
+        # A failed move or a bad line ends the path, the moves after it mustn't run
+        for futures in in_flight:
+            for future in futures:
+                future.cancel()
+        raise
+    return count
+
+
+if __name__ == "__main__":
+    import tracemalloc
+
+    from .commands import CommandQueue, QueuedRobot
+    from .machine import Robot
+    from .serial_emulator import SerialEmulator
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("path")
+    parser.add_argument("--format", help="csv or gcode, by default from the extension")
+    parser.add_argument("--fixture", help="x,y,z,yaw,pitch,roll of the path's origin")
+    parser.add_argument(
+        "--parse-only", action="store_true", help="count points without moving"
+    )
+    args = parser.parse_args()
+
+    format = args.format or FORMATS.get(args.path[args.path.rfind(".") :].lower())
+    fixture = (
+        EffectorLocation.from_list([float(v) for v in args.fixture.split(",")])
+        if args.fixture
+        else None
+    )
+    locations = load(args.path, format, fixture)
+
+    tracemalloc.start()
+    began = time.perf_counter()
+    if args.parse_only:
+        count = sum(1 for _ in locations)
+    else:
+        emulator = SerialEmulator()
+        emulator.baud = 10**9
+        count = feed(QueuedRobot(CommandQueue(Robot(emulator))), locations)
+    seconds = time.perf_counter() - began
+    print(
+        f"{count} points in {seconds:.2f}s, peak {tracemalloc.get_traced_memory()[1] / 1024:.0f} KiB"
+    )
@@ -0,0 +1,148 @@
+import os
+import threading
+import time
+from collections import deque
+from functools import wraps
+
+# Number of spans kept in memory, older spans are dropped as new ones arrive
+RING_SIZE = 20000
+
+
+class Span:
+    __slots__ = ("tracer", "name", "category", "args", "start")
+
+    def __init__(self, tracer, name, category, args):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        if type is not None:
+            self.args["error"] = type.__name__
+        self.tracer.record(
+            self.name, self.category, self.start, time.perf_counter_ns(), self.args
+        )
+
+
+class NullSpan:
+    __slots__ = ("args",)
+
+    def __init__(self):
+        self.args = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.args.clear()
+
+
+class Tracer:
+    """Records completed spans into a fixed size ring buffer."""
+
+    enabled: bool
+
+    def __init__(self, size: int = RING_SIZE):
+        self.enabled = True
+        self.events = deque(maxlen=size)
+        self.thread_names = {}
+        self._null_span = NullSpan()
+
+    def span(self, name: str, category: str = "app", **args):
+        if not self.enabled:
+            return self._null_span
+        return Span(self, name, category, args)
+
+    def record(self, name, category, start_ns, end_ns, args):
+        tid = threading.get_ident()
+        if tid not in self.thread_names:
+            self.thread_names[tid] = threading.current_thread().name
+        # deque.append is atomic, so no lock is needed between threads
+        self.events.append((name, category, tid, start_ns, end_ns, args))
+
+    def clear(self):
+        self.events.clear()
+
+    def chrome_trace(self) -> dict:
+        """Export the ring as Chrome trace event JSON (chrome://tracing, perfetto)."""
+        pid = os.getpid()
+        events = [
+            {
+                "name": "thread_name",
+                "ph": "M",
+                "pid": pid,
+                "tid": tid,
+                "args": {"name": name},
+            }
+            for tid, name in list(self.thread_names.items())
+        ]
+        for name, category, tid, start_ns, end_ns, args in list(self.events):
+            events.append(
+                {
+                    "name": name,
+                    "cat": category,
+                    "ph": "X",
+                    "ts": start_ns / 1000,
+                    "dur": (end_ns - start_ns) / 1000,
+                    "pid": pid,
+                    "tid": tid,
+                    "args": args,
+                }
+            )
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+tracer = Tracer()
+
+
+def traced(category: str):
+    """Decorator recording a span for every call of the wrapped function."""
+
+    def decorator(fn):
+        name = fn.__qualname__
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not tracer.enabled:
+                return fn(*args, **kwargs)
+            with Span(tracer, name, category, {}):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+class TracingSerial:
+    """Serial wrapper recording a span for each read and write."""
+
+    def __init__(self, wrapped):
+        self.wrapped = wrapped
+
+    @property
+    def in_waiting(self):
+        return self.wrapped.in_waiting
+
+    def readline(self):
+        with tracer.span("serial.readline", "serial") as span:
+            response = self.wrapped.readline()
+            span.args["bytes"] = len(response)
+        return response
+
+    def read(self, count):
+        with tracer.span("serial.read", "serial") as span:
+            response = self.wrapped.read(count)
+            span.args["bytes"] = len(response)
+        return response
+
+    def write(self, cmd_b: bytes):
+        with tracer.span("serial.write", "serial", bytes=len(cmd_b)):
+            return self.wrapped.write(cmd_b)
+
+    def close(self):
+        self.wrapped.close()
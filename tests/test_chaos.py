@@ -0,0 +1,60 @@
+import unittest
+from staubli.robot import chaos
+from staubli.robot.machine import Robot, SerialTimeout
+from staubli.robot.serial_emulator import Faults, SerialEmulator
+
+
+def robot(faults: Faults) -> Robot:
+    emulator = SerialEmulator(faults)
+    emulator.baud = 10**9
+    robot = Robot(emulator)
+    robot.read_timeout = 0.05
+    return robot
+
+
+class TestChaos(unittest.TestCase):
+    def test_parse(self):
+        faults = Faults.parse("error=0.5, stall_seconds=2,seed=7")
+        self.assertEqual(
+            (faults.error, faults.stall_seconds, faults.seed), (0.5, 2.0, 7)
+        )
+        with self.assertRaisesRegex(ValueError, "unknown fault"):
+            Faults.parse("gremlins=1")
+
+    def test_seeded(self):
+        a, b = Faults(error=0.5, seed=3), Faults(error=0.5, seed=3)
+        self.assertEqual(
+            [a.roll("error") for _ in range(50)], [b.roll("error") for _ in range(50)]
+        )
+        self.assertEqual(a.injected, b.injected)
+
+    def test_error_reply_flails(self):
+        faulty = robot(Faults(error=1.0))
+        faulty.speed(30)
+        # The flail's empty command is answered with an error too
+        self.assertEqual(faulty.serial.faults.injected["error"], 2)
+        self.assertEqual(faulty.serial.monitor_speed, 100)
+
+    def test_lost_prompt_times_out(self):
+        faulty = robot(Faults(truncate=1.0))
+        with self.assertRaises(SerialTimeout):
+            faulty.speed(30)
+        faulty.serial.faults.truncate = 0.0
+        faulty.speed(30)
+        self.assertEqual(faulty.serial.monitor_speed, 30)
+
+    def test_disconnect_drops_commands(self):
+        faulty = robot(Faults(disconnect=1.0, disconnect_seconds=0.1))
+        with self.assertRaises(SerialTimeout):
+            faulty.speed(30)
+        self.assertEqual(faulty.serial.monitor_speed, 100)
+
+    def test_report(self):
+        result = chaos.run(
+            Faults(error=0.2, seed=1), commands=40, baud=10**9, read_timeout=0.05
+        )
+        self.assertEqual(result["commands"], 40)
+        self.assertGreater(result["injected"]["error"], 0)
+        self.assertGreater(result["recovery"]["count"], 0)
+        clean = chaos.run(Faults(), commands=40, baud=10**9)
+        self.assertEqual((clean["failed"], clean["recovery"]["count"]), (0, 0))
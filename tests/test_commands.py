@@ -0,0 +1,35 @@
+import threading
+import unittest
+from staubli.robot.commands import CommandQueue, QueuedRobot
+
+
+class BlockingRobot:
+    def __init__(self):
+        self.calls = []
+        self.release = threading.Event()
+
+    def jog_joint(self, name):
+        self.release.wait()
+        self.calls.append(name)
+
+    def flail(self):
+        self.calls.append("flail")
+
+
+class TestCommandQueue(unittest.TestCase):
+    def test_emergency_cancels_queued_motion(self):
+        robot = BlockingRobot()
+        queued = QueuedRobot(CommandQueue(robot))
+
+        in_flight = queued.submit("jog_joint", "first")
+        while not in_flight.running():
+            pass
+        pending = [queued.submit("jog_joint", f"move {i}") for i in range(3)]
+        flail = queued.submit("flail")
+        robot.release.set()
+
+        flail.result(timeout=1)
+        in_flight.result(timeout=1)
+        self.assertTrue(all(f.cancelled() for f in pending))
+        self.assertEqual(robot.calls, ["first", "flail"])
+        self.assertEqual(queued.commands.stats()["emergency"]["count"], 1)
@@ -0,0 +1,47 @@
+import unittest
+from staubli.robot import encoder
+from staubli.robot.machine import EffectorLocation, JointLocation
+from staubli.robot.serial_emulator import SerialEmulator
+
+
+def run(commands):
+    emulator = SerialEmulator()
+    emulator.baud = 10**9
+    for command in commands:
+        emulator.write(command.encode("ascii") + b"\r")
+        assert emulator.buffer.endswith("."), emulator.buffer
+    return emulator
+
+
+class TestEncoder(unittest.TestCase):
+    def test_number(self):
+        self.assertEqual(encoder.number(985.0), "985")
+        self.assertEqual(encoder.number(-0.0001), "0")
+        self.assertEqual(encoder.number(12.5), "12.5")
+        self.assertEqual(encoder.number(-120.125), "-120.125")
+
+    def test_compact_matches_legacy_on_emulator(self):
+        samples = encoder.samples()
+        for kind, attr in [
+            ("move_absolute", "effector_location"),
+            ("move_joints", "jog1_location"),
+            ("set_tool", "tool_location"),
+            ("speed", "monitor_speed"),
+        ]:
+            legacy = run(encoder._legacy(kind, samples[kind]))
+            compact = run(encoder._compact(kind, samples[kind]))
+            self.assertEqual(getattr(compact, attr), getattr(legacy, attr), kind)
+
+    def test_relative_move_is_in_tool_frame(self):
+        emulator = run([encoder.move_absolute(EffectorLocation(400, 0, 600, 0, 90, 0))])
+        emulator.write(
+            encoder.move_relative(EffectorLocation(0, 0, 10, 0, 0, 0)).encode("ascii")
+        )
+
+        # Pitched 90 degrees the tool z axis points along world x
+        self.assertAlmostEqual(emulator.effector_location.x, 410)
+        self.assertAlmostEqual(emulator.effector_location.z, 600)
+
+    def test_saves_bytes(self):
+        for kind, report in encoder.measure().items():
+            self.assertLessEqual(report["compact_bytes"], report["legacy_bytes"], kind)
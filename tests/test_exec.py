@@ -0,0 +1,60 @@
+import time
+import unittest
+from types import SimpleNamespace
+from staubli.http.main import RobotHTTPRequestHandler
+from staubli.robot.commands import CommandQueue, QueuedRobot
+from staubli.robot.machine import Robot
+from staubli.robot.serial_emulator import SerialEmulator
+
+REPLY = ["<high power line 1>\n", "<high power line 2>\n", "."]
+
+
+class DribblingEmulator(SerialEmulator):
+    """Hands over one line of the reply at a time, like a slow console."""
+
+    def __init__(self):
+        super().__init__()
+        self.baud = 10**9
+
+    @property
+    def in_waiting(self):
+        newline = self.buffer.find("\n")
+        return len(self.buffer) if newline == -1 else newline + 1
+
+
+class TestExec(unittest.TestCase):
+    def setUp(self):
+        self.emulator = DribblingEmulator()
+        self.robot = Robot(self.emulator)
+
+    def test_returns_at_prompt(self):
+        began = time.monotonic()
+        output = self.robot.exec("en po")
+        # Well inside the two second idle timeout
+        self.assertLess(time.monotonic() - began, 1)
+        self.assertEqual(output, "".join(REPLY))
+
+    def test_on_output_gets_each_line(self):
+        chunks = []
+        output = self.robot.exec("en po", chunks.append)
+        self.assertEqual(chunks, REPLY)
+        self.assertEqual("".join(chunks), output)
+
+    def test_idle_timeout_without_prompt(self):
+        self.emulator.buffer = "no prompt\n"
+        began = time.monotonic()
+        output = self.robot._read_until_prompt(0.1)
+        self.assertGreaterEqual(time.monotonic() - began, 0.1)
+        self.assertEqual(output, "no prompt\n")
+
+    def test_dot_inside_a_line_is_not_a_prompt(self):
+        self.emulator.buffer = "1. here\n"
+        self.assertEqual(self.robot._read_until_prompt(0.1), "1. here\n")
+
+    def test_streamed_endpoint_yields_chunks(self):
+        handler = RobotHTTPRequestHandler.__new__(RobotHTTPRequestHandler)
+        handler.controller = SimpleNamespace(
+            robot=QueuedRobot(CommandQueue(self.robot))
+        )
+        chunks = list(handler._stream_exec("en po"))
+        self.assertEqual(chunks, REPLY)
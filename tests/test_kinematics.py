@@ -0,0 +1,79 @@
+import random
+import unittest
+from staubli.robot import kinematics
+from staubli.robot.machine import EffectorLocation, JointLocation
+
+
+class TestKinematics(unittest.TestCase):
+    def assertSamePose(self, a: EffectorLocation, b: EffectorLocation):
+        for i, j in zip(a.to_list()[:3], b.to_list()[:3]):
+            self.assertAlmostEqual(i, j, places=6)
+        ra = kinematics.zyz_to_matrix(a.yaw, a.pitch, a.roll)
+        rb = kinematics.zyz_to_matrix(b.yaw, b.pitch, b.roll)
+        for row_a, row_b in zip(ra, rb):
+            for i, j in zip(row_a, row_b):
+                self.assertAlmostEqual(i, j, places=6)
+
+    def test_ready_is_straight_up(self):
+        location = kinematics.forward(JointLocation(0, -90, 90, 0, 0, 0))
+        self.assertSamePose(location, EffectorLocation(0, 0, 985, 180, 0, 180))
+
+    def test_inverse_round_trips(self):
+        random.seed(3)
+        for _ in range(200):
+            joints = JointLocation(
+                *(random.uniform(low, high) for low, high in kinematics.LIMITS)
+            )
+            location = kinematics.forward(joints)
+            solved = kinematics.inverse(location, kinematics.elbow(joints), near=joints)
+            if solved is None:
+                # j4 or j6 wrapped the other way round, outside the limits
+                continue
+            self.assertSamePose(kinematics.forward(solved), location)
+
+    def test_both_elbows(self):
+        location = EffectorLocation(600, 100, 200, 0, 90, 0)
+        found = kinematics.solutions(location)
+        self.assertEqual(kinematics.elbow(found["above"]), "above")
+        self.assertEqual(kinematics.elbow(found["below"]), "below")
+        for joints in found.values():
+            self.assertSamePose(kinematics.forward(joints), location)
+
+    def test_tool(self):
+        tool = EffectorLocation(0, 0, 125, 0, 0, 0)
+        joints = JointLocation(10, -80, 95.5, 0, 30, -15.25)
+        location = kinematics.forward(joints, tool)
+        self.assertSamePose(
+            kinematics.forward(kinematics.inverse(location, "above", tool=tool), tool),
+            location,
+        )
+
+    def test_out_of_reach(self):
+        self.assertIsNone(kinematics.inverse(EffectorLocation(2000, 0, 0, 0, 180, 0)))
+
+    def test_planner_keeps_elbow_when_it_can(self):
+        start = JointLocation(0, -60, 120, 0, 30, 0)
+        planner = kinematics.ElbowPlanner(start, "above")
+        targets = [
+            kinematics.forward(JointLocation(j1, -60, 120, 0, 30, 0))
+            for j1 in (10, 20, 30)
+        ]
+        self.assertEqual(planner.plan(targets), [None, None, None])
+        self.assertEqual(planner.elbow, "above")
+        self.assertAlmostEqual(planner.joints.j1, 30)
+
+    def test_planner_switches_only_once(self):
+        start = JointLocation(0, -60, 100, 0, 30, 0)
+        planner = kinematics.ElbowPlanner(start, kinematics.elbow(start))
+        # A few degrees away in the other configuration, a long way round in this one
+        targets = [
+            kinematics.forward(JointLocation(0, -60, j3, 0, 30, 0))
+            for j3 in (80, 70, 60)
+        ]
+        switches = [s for s in planner.plan(targets) if s is not None]
+        self.assertEqual([elbow for elbow, _ in switches], ["below"])
+        # Switched with a joint move to the target's solution in the new configuration
+        elbow, joints = switches[0]
+        self.assertEqual(kinematics.elbow(joints), "below")
+        self.assertAlmostEqual(joints.j3, 80, places=3)
+        self.assertEqual(planner.elbow, "below")
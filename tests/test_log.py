@@ -0,0 +1,50 @@
+import logging
+import threading
+import time
+import unittest
+from staubli.log import TRACE, RateLimitFilter
+
+
+def record(level=TRACE):
+    return logging.LogRecord("staubli.wire", level, __file__, 0, "> .", None, None)
+
+
+class TestRateLimitFilter(unittest.TestCase):
+    def setUp(self):
+        self.filter = RateLimitFilter(rate=10)
+
+    def test_drops_past_rate_within_window(self):
+        passed = [self.filter.filter(record()) for _ in range(25)]
+        self.assertEqual(passed, [True] * 10 + [False] * 15)
+        self.assertEqual(self.filter.dropped, 15)
+
+    def test_higher_levels_always_pass(self):
+        for _ in range(20):
+            self.filter.filter(record())
+        self.assertTrue(self.filter.filter(record(logging.DEBUG)))
+
+    def test_next_window_reports_dropped(self):
+        for _ in range(15):
+            self.filter.filter(record())
+        self.filter.window -= 1
+        with self.assertLogs("staubli.log", logging.WARNING) as logs:
+            self.assertTrue(self.filter.filter(record()))
+        self.assertEqual(logs.output, ["WARNING:staubli.log:dropped 5 trace records"])
+        self.assertEqual((self.filter.passed, self.filter.dropped), (1, 0))
+
+    def test_counts_are_exact_across_threads(self):
+        self.filter.rate = 1000
+        # Hold the window open however slowly the threads run
+        self.filter.window = time.monotonic() + 60
+        results = []
+
+        def spam():
+            results.extend(self.filter.filter(record()) for _ in range(500))
+
+        threads = [threading.Thread(target=spam) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results.count(True), 1000)
+        self.assertEqual(self.filter.passed + self.filter.dropped, 2000)
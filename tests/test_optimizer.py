@@ -0,0 +1,65 @@
+import unittest
+from staubli.robot import optimizer
+
+PROGRAM = {
+    "speed": 30,
+    "commands": [
+        {
+            "name": "a",
+            "type": "effector",
+            "data": {"x": 500, "y": -300, "z": 200, "yaw": 0, "pitch": 180, "roll": 0},
+        },
+        {
+            "name": "b",
+            "type": "effector",
+            "data": {"x": 500, "y": 300, "z": 200, "yaw": 0, "pitch": 180, "roll": 0},
+        },
+        {"name": "c", "type": "speed", "data": {"speed": 50}},
+        {
+            "name": "d",
+            "type": "effector",
+            "data": {"x": 300, "y": 300, "z": 0, "yaw": 90, "pitch": 180, "roll": 0},
+        },
+        {
+            "name": "e",
+            "type": "joints",
+            "data": {"j1": 0, "j2": -90, "j3": 90, "j4": 0, "j5": 0, "j6": 0},
+        },
+    ],
+}
+
+
+class TestOptimizer(unittest.TestCase):
+    def test_trapezoid(self):
+        # Full speed after 1s covering 0.5, then 1 more second at speed
+        self.assertAlmostEqual(optimizer.trapezoid(1.5, 1, 1), 2.5)
+        # Triangle
+        self.assertAlmostEqual(optimizer.trapezoid(0.25, 1, 1), 1.0)
+
+    def test_faster_than_written(self):
+        result = optimizer.report(PROGRAM)
+        predicted = result["predicted"]
+        # Saved by the choice of moves alone, every segment keeps the speed it was written at
+        self.assertEqual([s["speed"] for s in predicted["segments"]], [30, 30, 50, 50])
+        self.assertLess(predicted["optimized_s"], predicted["original_s"])
+        self.assertAlmostEqual(
+            predicted["saved_s"], predicted["original_s"] - predicted["optimized_s"]
+        )
+
+    def test_constraints(self):
+        rewritten, segments = optimizer.optimize(
+            PROGRAM, constraints={"max_speed": 80, "linear": [1], "linear_speed": 30}
+        )
+        by_step = {s.step: s for s in segments}
+        self.assertEqual(by_step[1].move, "linear")
+        self.assertEqual(by_step[1].speed, 30)
+        self.assertTrue(all(s.speed <= 80 for s in segments))
+
+        # The straight line keeps its effector command, preceded by its speed
+        types = [c["type"] for c in rewritten["commands"]]
+        self.assertEqual(types[types.index("effector") - 1], "speed")
+
+    def test_rewritten_program_predicts_what_was_optimized(self):
+        rewritten, segments = optimizer.optimize(PROGRAM)
+        seconds, _ = optimizer.predict(rewritten)
+        self.assertAlmostEqual(seconds, sum(s.seconds for s in segments), places=2)
@@ -0,0 +1,61 @@
+import math
+import unittest
+from staubli.robot.machine import EffectorLocation
+from staubli.robot.path import (
+    angle_between,
+    densify,
+    quaternion_to_zyz,
+    rotate,
+    zyz_to_quaternion,
+)
+
+
+class TestPath(unittest.TestCase):
+    def test_zyz_round_trip(self):
+        for yaw, pitch, roll in [
+            (10, 20, 30),
+            (-170, 95, 45),
+            (180, 0, 180),
+            (30, 180, 10),
+        ]:
+            q = zyz_to_quaternion(yaw, pitch, roll)
+            back = zyz_to_quaternion(*quaternion_to_zyz(q, yaw_hint=yaw))
+            self.assertAlmostEqual(angle_between(q, back), 0, places=6)
+
+    def test_step_length(self):
+        samples = list(
+            densify(
+                [
+                    EffectorLocation(0, 0, 0, 0, 90, 0),
+                    EffectorLocation(100, 0, 0, 0, 90, 0),
+                ],
+                step=10,
+            )
+        )
+
+        self.assertEqual(len(samples), 11)
+        self.assertAlmostEqual(samples[5].x, 50)
+
+    def test_tool_point_travels_straight(self):
+        tool = EffectorLocation(0, 0, 200, 0, 0, 0)
+        samples = list(
+            densify(
+                [
+                    EffectorLocation(0, 0, 0, 0, 90, 0),
+                    EffectorLocation(0, 0, 0, 0, 90, 90),
+                ],
+                step=1000,
+                angle_step=90,
+                chord=0.5,
+                tool=tool,
+            )
+        )
+
+        self.assertGreater(len(samples), 2)
+        for sample in samples:
+            q = zyz_to_quaternion(sample.yaw, sample.pitch, sample.roll)
+            point = rotate(q, (0, 0, 200))
+            self.assertAlmostEqual(sample.x + point[0], 200)
+            self.assertAlmostEqual(
+                math.hypot(sample.y + point[1], sample.z + point[2]), 0
+            )
@@ -0,0 +1,162 @@
+import time
+import unittest
+from staubli.robot.commands import CommandQueue, QueuedRobot
+from staubli.robot.machine import Robot, SerialTimeout
+from staubli.robot.program import ProgramAborted, ProgramError, compile_program
+from staubli.robot.serial_emulator import SerialEmulator
+
+COMMANDS = [
+    {"type": "speed", "data": {"speed": 50}},
+    {
+        "type": "effector",
+        "data": {"x": 400, "y": 0, "z": 600, "yaw": 0, "pitch": 90, "roll": 0},
+    },
+    {
+        "type": "tool",
+        "data": {"x": 0, "y": 0, "z": 125, "yaw": 0, "pitch": 0, "roll": 0},
+    },
+    {
+        "type": "joints",
+        "data": {"j1": 10, "j2": -80, "j3": 95, "j4": 0, "j5": 30, "j6": 0},
+    },
+]
+
+
+class HangingEmulator(SerialEmulator):
+    """Programs print their first marker and then run until ABORTed."""
+
+    def __init__(self):
+        super().__init__()
+        self.baud = 10**9
+        self.commands = []
+
+    def write(self, cmd_b: bytes):
+        self.commands.append(cmd_b.decode("ascii").rstrip("\r"))
+        super().write(cmd_b)
+
+    def respond(self, cmd: str):
+        if cmd.startswith("EXECUTE "):
+            self.buffer = "<emulator execute response>\n@0\n"
+            return
+        super().respond(cmd)
+
+
+def robot():
+    emulator = SerialEmulator()
+    emulator.baud = 10**9
+    return Robot(emulator), emulator
+
+
+class TestProgram(unittest.TestCase):
+    def test_compile(self):
+        program = compile_program(COMMANDS)
+        self.assertEqual(program.steps, 4)
+        self.assertEqual(program.final_speed, 50)
+        self.assertTrue(program.sets_tool)
+        self.assertEqual(
+            program.locations,
+            [
+                f"do set {program.name}.1 = trans(400,0,600,0,90,0)",
+                f"do set #{program.name}.3 = #PPOINT(10,-80,95,0,30,0)",
+            ],
+        )
+        self.assertIn(f"MOVES {program.name}.1", program.lines)
+        self.assertEqual(program.lines[-1], 'TYPE "@end"')
+
+    def test_checksum_follows_content(self):
+        self.assertEqual(compile_program(COMMANDS).name, compile_program(COMMANDS).name)
+        self.assertNotEqual(
+            compile_program(COMMANDS).name, compile_program(COMMANDS[1:]).name
+        )
+
+    def test_serial_is_rejected(self):
+        with self.assertRaises(ValueError):
+            compile_program([{"type": "serial", "data": {"command": "where"}}])
+
+    def test_run_on_emulator(self):
+        r, emulator = robot()
+        program = compile_program(COMMANDS)
+        progress = []
+
+        result = r.run_program(program, progress.append)
+
+        self.assertEqual(result, {"name": program.name, "uploaded": True, "steps": 4})
+        self.assertEqual(progress, [0, 1, 2, 3])
+        self.assertEqual(emulator.monitor_speed, 50)
+        self.assertEqual(emulator.effector_location.z, 600)
+        self.assertEqual(emulator.joint_location.j1, 10)
+        self.assertEqual(emulator.tool_location.z, 125)
+        self.assertEqual(emulator.buffer, "")
+
+        # Cached, the second run is only the EXECUTE
+        self.assertFalse(r.run_program(program)["uploaded"])
+        self.assertEqual(len(emulator.programs), 1)
+
+    def test_lost_program_is_uploaded_again(self):
+        r, emulator = robot()
+        program = compile_program(COMMANDS)
+        r.run_program(program)
+
+        emulator.programs.clear()
+        with self.assertRaises(ProgramError):
+            r.execute_program(program)
+        self.assertTrue(r.run_program(program)["uploaded"])
+
+    def test_robot_still_answers_after_run(self):
+        r, emulator = robot()
+        r.run_program(compile_program(COMMANDS))
+        self.assertEqual(r.where()[0].z, 600)
+
+    def test_emergency_aborts_running_program(self):
+        emulator = HangingEmulator()
+        queued = QueuedRobot(CommandQueue(Robot(emulator)))
+        running = queued.submit("run_program", compile_program(COMMANDS))
+        while not any(c.startswith("EXECUTE") for c in emulator.commands):
+            time.sleep(0.01)
+
+        queued.submit("flail").result(timeout=2)
+        with self.assertRaises(ProgramAborted):
+            running.result(timeout=0)
+        self.assertLess(emulator.commands.index("ABORT"), len(emulator.commands) - 1)
+
+    def test_lost_end_marker_times_out(self):
+        emulator = HangingEmulator()
+        r = Robot(emulator)
+        r.read_timeout = 0.1
+        with self.assertRaises(SerialTimeout):
+            r.run_program(compile_program(COMMANDS))
+
+    def test_reset_checks_uploaded_programs(self):
+        r, emulator = robot()
+        program = compile_program(COMMANDS)
+        r.run_program(program)
+        # Still in the controller's memory after power comes back
+        r.enable_power()
+        self.assertFalse(r.run_program(program)["uploaded"])
+        emulator.programs.clear()
+        r.flail()
+        self.assertTrue(r.run_program(program)["uploaded"])
+
+    def test_console_commands_keep_uploaded_programs(self):
+        r, emulator = robot()
+        program = compile_program(COMMANDS)
+        r.run_program(program)
+        r.exec("where")
+        self.assertTrue(r.uploaded_checked)
+        self.assertFalse(r.run_program(program)["uploaded"])
+
+        r.exec(f"DELETEP {program.name}")
+        self.assertTrue(r.run_program(program)["uploaded"])
+
+    def test_prune_programs(self):
+        r, emulator = robot()
+        old = compile_program(COMMANDS)
+        new = compile_program(COMMANDS[:2])
+        r.run_program(old)
+        r.run_program(new)
+        emulator.programs["a.main"] = []
+
+        self.assertEqual(r.prune_programs(keep=[new.name]), [old.name])
+        self.assertEqual(set(emulator.programs), {new.name, "a.main"})
+        self.assertEqual(r.uploaded, {new.name})
+        self.assertTrue(r.run_program(old)["uploaded"])
@@ -0,0 +1,115 @@
+import os
+import random
+import tempfile
+import unittest
+from concurrent.futures import Future
+from staubli.robot import kinematics, reach
+from staubli.robot.machine import EffectorLocation, JointLocation
+from staubli.robot.main import ControllerDelegate
+from staubli.robot.state import StatePublisher
+
+FAR = EffectorLocation(900, 900, 0, 0, 90, 0)
+NEAR = EffectorLocation(500, 0, 0, 0, 90, 0)
+
+
+class RecordingRobot:
+    def __init__(self):
+        self.calls = []
+
+    def submit(self, name, *args):
+        self.calls.append(name)
+        future = Future()
+        future.set_result(None)
+        return future
+
+    def __getattr__(self, name):
+        return lambda *args: self.submit(name, *args).result()
+
+
+def setUpModule():
+    global PATH
+    fd, PATH = tempfile.mkstemp(suffix=".bin")
+    with os.fdopen(fd, "wb") as f:
+        f.write(reach.build(cell=250, angle=90, processes=1))
+
+
+def tearDownModule():
+    os.unlink(PATH)
+
+
+class TestReach(unittest.TestCase):
+    def setUp(self):
+        self.path = PATH
+        self.map = reach.ReachMap.open(PATH)
+
+    def test_never_rejects_a_reachable_target(self):
+        random.seed(5)
+        tool = EffectorLocation(0, 0, 100, 0, 0, 0)
+        for _ in range(500):
+            joints = JointLocation(
+                *(random.uniform(low, high) for low, high in kinematics.LIMITS)
+            )
+            self.map.check(kinematics.forward(joints))
+            self.map.check(kinematics.forward(joints, tool), tool)
+
+    def test_rejects_far_targets(self):
+        self.assertEqual(
+            self.map.lookup(EffectorLocation(0, 0, 1400, 0, 0, 0)), reach.UNREACHABLE
+        )
+        with self.assertRaises(reach.Unreachable):
+            self.map.check(EffectorLocation(900, 900, 0, 0, 90, 0))
+        with self.assertRaises(reach.Unreachable):
+            self.map.check(EffectorLocation(5000, 0, 0, 0, 90, 0))
+
+    def test_margin_inside_the_workspace(self):
+        self.assertGreater(self.map.lookup(EffectorLocation(500, 0, 0, 0, 90, 0)), 0)
+
+    def test_rejects_other_files(self):
+        with tempfile.NamedTemporaryFile(suffix=".bin") as f:
+            f.write(b"not a map" * 10)
+            f.flush()
+            with self.assertRaises(ValueError):
+                reach.ReachMap.open(f.name)
+
+    def test_load_retries_a_missing_map(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "reach.bin")
+            self.assertIsNone(reach.load(path))
+            with open(self.path, "rb") as source, open(path, "wb") as f:
+                f.write(source.read())
+            self.assertIsNotNone(reach.load(path))
+            self.assertIs(reach.load(path), reach.load(path))
+
+
+class TestControllerReach(unittest.TestCase):
+    def setUp(self):
+        state = StatePublisher(
+            elbow="above",
+            position={"joints": vars(JointLocation(0, 0, 90, 0, 0, 0))},
+            tool_offset=vars(EffectorLocation(0, 0, 0, 0, 0, 0)),
+        )
+        self.robot = RecordingRobot()
+        self.controller = ControllerDelegate(
+            self.robot, None, state, PATH, positions=[]
+        )
+        self.controller.auto_elbow = False
+
+    def test_path_stops_before_unreachable_sample(self):
+        with self.assertRaises(reach.Unreachable):
+            self.controller.follow([NEAR, NEAR, FAR, NEAR])
+        self.assertEqual(self.robot.calls, ["jog_absolute"] * 2)
+
+    def test_toolpath_stops_before_unreachable_point(self):
+        with self.assertRaises(reach.Unreachable):
+            self.controller.feed([NEAR] * 3 + [FAR])
+        # Checked as the chunk is read, before any of it is queued
+        self.assertEqual(self.robot.calls, [])
+
+    def test_program_is_checked_before_it_runs(self):
+        commands = [
+            {"type": "effector", "data": vars(NEAR)},
+            {"type": "effector", "data": vars(FAR)},
+        ]
+        with self.assertRaisesRegex(reach.Unreachable, "step 1"):
+            self.controller.run_program(commands)
+        self.assertEqual(self.robot.calls, [])
@@ -0,0 +1,94 @@
+import http.client
+import json
+import struct
+import tempfile
+import threading
+import unittest
+from functools import partial
+from http.server import ThreadingHTTPServer
+from staubli.http.router import PACKED_FLOATS, RoutingStaticHTTPRequestHandler
+
+
+class Handler(RoutingStaticHTTPRequestHandler):
+    def api_position(self):
+        return {"effector": {"x": 1.5, "y": -2.0}, "joints": [3, 4.25]}
+
+    def api_echo(self, data):
+        return data
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestRouter(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        handler = partial(Handler, directory=cls.directory.name)
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        cls.server.daemon_threads = True
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        cls.directory.cleanup()
+
+    def setUp(self):
+        self.connection = http.client.HTTPConnection(
+            *self.server.server_address, timeout=5
+        )
+        self.addCleanup(self.connection.close)
+
+    def request(self, method, path, body=None, headers={}):
+        self.connection.request(method, path, body, headers)
+        response = self.connection.getresponse()
+        return response, response.read()
+
+    def test_keep_alive_with_packed_floats(self):
+        response, body = self.request("GET", "/api/position")
+        socket = self.connection.sock
+        self.assertEqual(response.version, 11)
+        self.assertEqual(int(response.getheader("Content-Length")), len(body))
+        self.assertEqual(
+            json.loads(body), {"effector": {"x": 1.5, "y": -2.0}, "joints": [3, 4.25]}
+        )
+
+        response, body = self.request(
+            "GET", "/api/position", headers={"Accept": PACKED_FLOATS}
+        )
+        # Same connection, the server didn't close it after the first response
+        self.assertIs(self.connection.sock, socket)
+        self.assertEqual(response.getheader("Content-Type"), PACKED_FLOATS)
+        self.assertEqual(int(response.getheader("Content-Length")), len(body))
+        self.assertEqual(
+            struct.unpack(f"<{len(body) // 8}d", body), (1.5, -2.0, 3.0, 4.25)
+        )
+
+    def test_404_drains_body(self):
+        response, _ = self.request(
+            "PUT",
+            "/api/missing",
+            json.dumps({"a": 1}),
+            {"Content-Type": "application/json"},
+        )
+        socket = self.connection.sock
+        self.assertEqual(response.status, 404)
+
+        response, body = self.request(
+            "PUT",
+            "/api/echo",
+            json.dumps({"b": 2}),
+            {"Content-Type": "application/json"},
+        )
+        self.assertIs(self.connection.sock, socket)
+        self.assertEqual(response.status, 200)
+        self.assertEqual(json.loads(body), {"b": 2})
+
+    def test_packed_floats_fall_back_to_json(self):
+        response, body = self.request(
+            "PUT", "/api/echo", json.dumps({"name": "a"}), {"Accept": PACKED_FLOATS}
+        )
+        self.assertEqual(response.getheader("Content-Type"), "application/json")
+        self.assertEqual(json.loads(body), {"name": "a"})
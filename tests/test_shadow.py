@@ -0,0 +1,78 @@
+import unittest
+from staubli.robot.machine import EffectorLocation, Robot
+from staubli.robot.program import compile_program
+from staubli.robot.serial_emulator import Faults, SerialEmulator
+
+
+class CountingEmulator(SerialEmulator):
+    def __init__(self, faults=None):
+        super().__init__(faults)
+        self.baud = 10**9
+        self.commands = []
+
+    def write(self, cmd_b: bytes):
+        self.commands.append(cmd_b.decode("ascii").rstrip("\r"))
+        super().write(cmd_b)
+
+
+class TestShadow(unittest.TestCase):
+    def setUp(self):
+        self.emulator = CountingEmulator()
+        self.robot = Robot(self.emulator)
+
+    def test_repeated_settings_are_skipped(self):
+        tool = EffectorLocation(0, 0, 100, 0, 0, 0)
+        for _ in range(3):
+            self.robot.speed(20)
+            self.robot.tool_transform(tool)
+            self.robot.below()
+        self.assertEqual(
+            self.emulator.commands,
+            [
+                "speed 20",
+                "do set hand.tool = trans(0,0,100,0,0,0)",
+                "TOOL hand.tool",
+                "do below",
+            ],
+        )
+        self.assertEqual(self.robot.skipped, {"speed": 2, "tool": 2, "elbow": 2})
+
+        self.robot.speed(30)
+        self.assertEqual(self.emulator.commands[-1], "speed 30")
+
+    def test_elbow_seeded_from_where(self):
+        self.robot.where()
+        sent = len(self.emulator.commands)
+        # The emulator starts straight up, which counts as above
+        self.robot.above()
+        self.assertEqual(len(self.emulator.commands), sent)
+        self.robot.below()
+        self.assertEqual(self.emulator.commands[-1], "do below")
+
+    def test_tool_not_seeded_from_listl(self):
+        # LISTL shows the hand.tool variable, not the TOOL in effect
+        self.emulator.tool_location = EffectorLocation(0, 0, 50, 0, 0, 0)
+        self.robot.tool_offset()
+        self.robot.tool_transform(EffectorLocation(0, 0, 50, 0, 0, 0))
+        self.assertEqual(self.emulator.commands[-1], "TOOL hand.tool")
+
+    def test_console_and_errors_invalidate(self):
+        self.robot.speed(20)
+        self.robot.exec("where")
+        self.robot.speed(20)
+        self.assertEqual(self.emulator.commands.count("speed 20"), 2)
+
+        self.emulator.faults = Faults(error=1.0)
+        self.robot.above()
+        self.emulator.faults = None
+        self.assertEqual(self.robot.shadow, {})
+        self.robot.above()
+        self.assertEqual(self.emulator.commands.count("do above"), 2)
+
+    def test_program_speed(self):
+        program = compile_program(
+            [{"name": "", "type": "speed", "data": {"speed": 40}}], 20
+        )
+        self.robot.run_program(program)
+        self.robot.speed(40)
+        self.assertEqual(self.robot.skipped["speed"], 1)
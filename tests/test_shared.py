@@ -0,0 +1,64 @@
+import multiprocessing
+import unittest
+from staubli.robot.shared import SharedState
+from staubli.robot.state import StatePublisher
+
+
+def state(i: float) -> dict:
+    location = dict(zip(("x", "y", "z", "yaw", "pitch", "roll"), [i] * 6))
+    joints = dict(zip(("j1", "j2", "j3", "j4", "j5", "j6"), [i] * 6))
+    return {
+        "position": {"effector": location, "joints": joints},
+        "tool_offset": location,
+        "speed": i,
+        "elbow": "below",
+        "busy": True,
+    }
+
+
+def read_consistently(shared: SharedState, reads: int, torn):
+    for _ in range(reads):
+        _, read = shared.read()
+        values = set(read["position"]["effector"].values()) | set(
+            read["position"]["joints"].values()
+        )
+        if len(values | {read["speed"]}) != 1:
+            torn.value += 1
+
+
+class TestSharedState(unittest.TestCase):
+    def setUp(self):
+        self.shared = SharedState(create=True)
+
+    def tearDown(self):
+        self.shared.close()
+        self.shared.unlink()
+
+    def test_round_trip(self):
+        self.shared.write(3, state(1.5))
+        self.assertEqual(self.shared.read(), (3, state(1.5)))
+        self.assertEqual(self.shared.version(), 3)
+        self.assertEqual(self.shared.sequence() % 2, 0)
+
+    def test_follows_publisher(self):
+        publisher = StatePublisher(speed=20, elbow="above", busy=False)
+        self.shared.publish_from(publisher)
+        publisher.update(speed=50)
+        snapshot = self.shared.snapshot()
+        self.assertEqual(snapshot["version"], 1)
+        self.assertEqual(snapshot["state"]["speed"], 50)
+
+    def test_readers_never_see_a_torn_write(self):
+        context = multiprocessing.get_context("fork")
+        torn = context.Value("i", 0)
+        self.shared.write(1, state(0))
+        reader = context.Process(
+            target=read_consistently, args=(self.shared, 20000, torn)
+        )
+        reader.start()
+        i = 0
+        while reader.is_alive():
+            i += 1
+            self.shared.write(i, state(float(i)))
+        reader.join()
+        self.assertEqual(torn.value, 0)
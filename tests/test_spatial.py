@@ -0,0 +1,99 @@
+import math
+import os
+import random
+import tempfile
+import unittest
+from staubli.robot.data import Positions
+from staubli.robot.machine import EffectorLocation
+from staubli.robot.spatial import PointIndex
+
+
+def random_location(rng):
+    return EffectorLocation(
+        rng.uniform(-800, 800),
+        rng.uniform(-800, 800),
+        rng.uniform(0, 1000),
+        rng.uniform(-180, 180),
+        rng.uniform(0, 180),
+        rng.uniform(-180, 180),
+    )
+
+
+class TestPointIndex(unittest.TestCase):
+    def setUp(self):
+        rng = random.Random(4)
+        self.points = [random_location(rng) for _ in range(500)]
+        self.queries = [random_location(rng) for _ in range(50)]
+        self.index = PointIndex()
+        # Incremental inserts exercise the rebuild path too
+        for i, point in enumerate(self.points):
+            self.index.insert(point, i)
+
+    def distance(self, a, b):
+        return self.index.distance(a, b)
+
+    def test_nearest_matches_brute_force(self):
+        for query in self.queries:
+            expected = min(
+                range(len(self.points)),
+                key=lambda i: self.distance(query, self.points[i]),
+            )
+            distance, found = self.index.nearest(query)
+            self.assertEqual(found, expected)
+            self.assertAlmostEqual(
+                distance, self.distance(query, self.points[expected])
+            )
+
+    def test_within_matches_brute_force(self):
+        for query in self.queries:
+            expected = {
+                i for i, p in enumerate(self.points) if self.distance(query, p) <= 400
+            }
+            found = {i for _, i in self.index.within(query, 400)}
+            self.assertEqual(found, expected)
+
+    def test_flipped_quaternion_is_same_orientation(self):
+        index = PointIndex()
+        index.insert(EffectorLocation(0, 0, 0, 180, 0, 180), "home")
+        distance, found = index.nearest(EffectorLocation(0, 0, 0, 0, 0, 0))
+        self.assertEqual(found, "home")
+        self.assertAlmostEqual(distance, 0, places=6)
+
+    def test_near_half_turn_straddling_sign_flip(self):
+        # yaw + roll through 180 takes w through zero, the two keys have opposite signs
+        taught = EffectorLocation(400, 0, 500, 90, 90, 89.9)
+        query = EffectorLocation(400, 0, 500, 90, 90, 90.1)
+        index = PointIndex()
+        index.insert(taught, "taught")
+        index.insert(EffectorLocation(700, 0, 500, 90, 90, 90.1), "decoy")
+
+        distance, found = index.nearest(query)
+        self.assertEqual(found, "taught")
+        self.assertLess(distance, 1)
+        self.assertEqual([value for _, value in index.within(query, 50)], ["taught"])
+
+
+class TestPositions(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(directory.name)
+
+    def test_teach_merges_duplicates_and_saves(self):
+        positions = Positions.load()
+        home = EffectorLocation(0, 0, 900, 180, 0, 180)
+        self.assertEqual(positions.teach(home), (0, True))
+        self.assertEqual(
+            positions.teach(EffectorLocation(0, 0, 900.5, 180, 0, 180)), (0, False)
+        )
+        self.assertEqual(
+            positions.teach(EffectorLocation(0, 0, 800, 180, 0, 180)), (1, True)
+        )
+
+        reloaded = Positions.load()
+        self.assertEqual(len(reloaded), 2)
+        self.assertEqual(reloaded[0], ("position 1", home))
+        self.assertEqual(
+            reloaded.nearest(EffectorLocation(0, 0, 810, 180, 0, 180))[1], 1
+        )
@@ -0,0 +1,96 @@
+import json
+import unittest
+from staubli.http.websockets import websocket_handler
+from staubli.robot.machine import EffectorLocation, JointLocation
+from staubli.robot.state import RobotStateTracker, StatePublisher
+
+
+class FakeSocket:
+    def __init__(self, *received):
+        self.received = [json.dumps(r) for r in received]
+        self.sent = []
+
+    def __iter__(self):
+        return iter(self.received)
+
+    def send(self, message):
+        self.sent.append(json.loads(message))
+
+
+class CountingRobot:
+    def __init__(self):
+        self.wheres = 0
+
+    def where(self):
+        self.wheres += 1
+        return EffectorLocation(1, 2, 3, 4, 5, 6), JointLocation(0, 0, 0, 0, 0, 0)
+
+    def tool_offset(self):
+        return EffectorLocation(0, 0, 0, 0, 0, 0)
+
+
+class TestStatePublisher(unittest.TestCase):
+    def setUp(self):
+        self.state = StatePublisher(speed=20, busy=False)
+        self.messages = []
+        self.state.subscribe(self.messages.append)
+
+    def test_versions_increase(self):
+        self.state.update(speed=30)
+        self.state.update(busy=True)
+        self.assertEqual([m["version"] for m in self.messages], [1, 2])
+        self.assertEqual(self.state.snapshot()["version"], 2)
+
+    def test_delta_has_only_changed_fields(self):
+        self.state.update(speed=20, busy=True)
+        self.assertEqual(self.messages, [{"version": 1, "delta": {"busy": True}}])
+
+    def test_unchanged_update_is_not_published(self):
+        self.state.update(speed=20)
+        self.assertEqual(self.messages, [])
+        self.assertEqual(self.state.version, 0)
+
+    def test_every_subscribe_starts_from_snapshot(self):
+        self.state.update(speed=30)
+        first = FakeSocket({"subscribe": "state"})
+        websocket_handler(self.state, first)
+        self.state.update(speed=40)
+        # A client back after a dropped socket has missed deltas, it gets the state as it is now
+        again = FakeSocket({"subscribe": "state"})
+        websocket_handler(self.state, again)
+        self.assertEqual(
+            first.sent,
+            [{"channel": "state", "version": 1, "state": {"speed": 30, "busy": False}}],
+        )
+        self.assertEqual(
+            again.sent,
+            [{"channel": "state", "version": 2, "state": {"speed": 40, "busy": False}}],
+        )
+
+
+class TestRobotStateTracker(unittest.TestCase):
+    def setUp(self):
+        self.state = StatePublisher()
+        self.tracker = RobotStateTracker(self.state)
+        self.robot = CountingRobot()
+        self.tracker.idle(self.robot)
+
+    def test_burst_of_moves_reads_position_once(self):
+        for _ in range(5):
+            self.tracker.dispatched()
+            self.tracker.completed(
+                "jog_joint", (JointLocation(0, 0, 0, 0, 0, 0),), None
+            )
+        self.tracker.idle(self.robot)
+        self.assertEqual(self.robot.wheres, 2)
+        self.assertEqual(self.state.state["position"]["effector"]["x"], 1)
+        self.assertFalse(self.state.state["busy"])
+
+    def test_settings_are_published_without_a_read(self):
+        self.tracker.completed("speed", (50,), None)
+        self.tracker.completed("below", (), None)
+        self.tracker.idle(self.robot)
+        self.assertEqual(self.robot.wheres, 1)
+        self.assertEqual(
+            (self.state.state["speed"], self.state.state["elbow"]), (50, "below")
+        )
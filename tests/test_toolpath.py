@@ -0,0 +1,158 @@
+import io
+import os
+import tempfile
+import unittest
+from concurrent.futures import Future
+from staubli.robot import kinematics, toolpath
+from staubli.robot.commands import CommandQueue, QueuedRobot
+from staubli.robot.machine import EffectorLocation, JointLocation, Robot, SerialTimeout
+from staubli.robot.serial_emulator import Faults, SerialEmulator
+
+
+class LazyFuture(Future):
+    """A move that only runs once someone waits for it."""
+
+    def result(self, timeout=None):
+        if not self.done():
+            self.set_result(None)
+        return super().result(timeout)
+
+
+class FakeRobot:
+    def __init__(self):
+        self.futures = []
+        self.most_outstanding = 0
+        self.names = []
+
+    def submit(self, name, *args):
+        self.names.append(name)
+        future = LazyFuture()
+        self.futures.append(future)
+        outstanding = sum(1 for f in self.futures if not f.done())
+        self.most_outstanding = max(self.most_outstanding, outstanding)
+        return future
+
+
+class FailingEmulator(SerialEmulator):
+    """Drops off the line for good after a number of moves."""
+
+    def __init__(self, moves: int):
+        super().__init__()
+        self.baud = 10**9
+        self.moves = 0
+        self.fail_after = moves
+
+    def write(self, cmd_b: bytes):
+        if cmd_b.startswith(b"do moves"):
+            self.moves += 1
+            if self.moves == self.fail_after:
+                self.faults = Faults(disconnect=1.0, disconnect_seconds=60)
+        super().write(cmd_b)
+
+
+class TestToolpath(unittest.TestCase):
+    def test_csv_header_in_any_order(self):
+        lines = ["z,x,y,roll\n", "1,2,3,45\n", "\n", "# comment\n", "4,5,6,90\n"]
+        points = list(toolpath.parse_csv(lines))
+        self.assertEqual(points[0], EffectorLocation(2, 3, 1, 0, 180, 45))
+        self.assertEqual(points[1].x, 5)
+
+    def test_csv_without_header(self):
+        points = list(toolpath.parse_csv(["1,2,3\n", "1,2,3,10,20,30\n"]))
+        self.assertEqual(points[0], EffectorLocation(1, 2, 3, *toolpath.DOWN))
+        self.assertEqual(points[1], EffectorLocation(1, 2, 3, 10, 20, 30))
+
+    def test_csv_errors_name_the_line(self):
+        with self.assertRaisesRegex(ValueError, "line 2") as raised:
+            list(toolpath.parse_csv(["1,2,3\n", "1,secret,3\n"]))
+        # The file's contents never make it into the error
+        self.assertNotIn("secret", str(raised.exception))
+
+    def test_paths_stay_in_the_toolpath_directory(self):
+        with tempfile.TemporaryDirectory() as directory:
+            inside = os.path.join(directory, "parts", "a.csv")
+            self.assertEqual(
+                toolpath.resolve("parts/a.csv", directory), os.path.realpath(inside)
+            )
+            for path in ("../a.csv", "/etc/passwd", "parts/../../a.csv"):
+                with self.assertRaises(PermissionError):
+                    toolpath.resolve(path, directory)
+            os.symlink("/etc", os.path.join(directory, "etc"))
+            with self.assertRaises(PermissionError):
+                toolpath.resolve("etc/passwd", directory)
+        with self.assertRaises(PermissionError):
+            toolpath.resolve("a.csv", "")
+
+    def test_gcode(self):
+        program = io.BytesIO(
+            b"G21 G90 (absolute mm)\n"
+            b"G0 X10 Y20 Z5 ; rapid\n"
+            b"M3 S1000\n"
+            b"G91\n"
+            b"G1 X1 F100\n"
+            b"G20 G1 Z1\n"
+        )
+        points = list(toolpath.parse_gcode(toolpath.read_lines(program)))
+        self.assertEqual(
+            [p.to_list()[:3] for p in points],
+            [[10, 20, 5], [11, 20, 5], [11, 20, 30.4]],
+        )
+
+    def test_gcode_arcs_are_rejected(self):
+        with self.assertRaisesRegex(ValueError, "line 1"):
+            list(toolpath.parse_gcode(["G2 X1 Y1 I1\n"]))
+
+    def test_fixture(self):
+        fixture = EffectorLocation(400, 0, 100, 90, 0, 0)
+        point = next(
+            toolpath.apply_fixture([EffectorLocation(10, 0, 0, 0, 0, 0)], fixture)
+        )
+        # Rotated 90 degrees about z, the fixture's x is the world's y
+        self.assertAlmostEqual(point.x, 400)
+        self.assertAlmostEqual(point.y, 10)
+        self.assertAlmostEqual(point.z, 100)
+
+    def test_feed_is_bounded(self):
+        robot = FakeRobot()
+        most_ahead = 0
+
+        def locations():
+            nonlocal most_ahead
+            for i in range(1000):
+                done = sum(1 for f in robot.futures if f.done())
+                most_ahead = max(most_ahead, i - done)
+                yield EffectorLocation(i, 0, 0, 0, 0, 0)
+
+        count = toolpath.feed(robot, locations(), chunk_size=10, chunks_ahead=2)
+        self.assertEqual(count, 1000)
+        self.assertEqual(len(robot.futures), 1000)
+        self.assertLessEqual(robot.most_outstanding, 2 * 10)
+        # Parsing never runs more than the queued chunks plus the one being built ahead
+        self.assertLessEqual(most_ahead, 3 * 10)
+
+    def test_feed_switches_elbow_once(self):
+        start = JointLocation(0, -60, 100, 0, 30, 0)
+        planner = kinematics.ElbowPlanner(start, "above")
+        locations = [
+            kinematics.forward(JointLocation(0, -60, j3, 0, 30, 0))
+            for j3 in (80, 70, 60, 50)
+        ]
+        robot = FakeRobot()
+        self.assertEqual(
+            toolpath.feed(robot, locations, chunk_size=2, planner=planner), 4
+        )
+        self.assertEqual(robot.names, ["below", "jog_joint"] + ["jog_absolute"] * 3)
+
+    def test_feed_cancels_queued_moves_on_failure(self):
+        emulator = FailingEmulator(moves=3)
+        robot = Robot(emulator)
+        robot.read_timeout = 0.1
+        queued = QueuedRobot(CommandQueue(robot))
+        locations = [EffectorLocation(400, 0, 600 - i, 0, 180, 0) for i in range(40)]
+
+        with self.assertRaises(SerialTimeout):
+            toolpath.feed(queued, locations, chunk_size=5, chunks_ahead=2)
+        # Behind anything still queued
+        queued.submit("where").exception()
+        # The failed move and at most the one already dispatched behind it
+        self.assertLessEqual(emulator.moves, 4)
@@ -0,0 +1,33 @@
+import unittest
+from staubli.trace import Tracer
+
+
+class TestTracer(unittest.TestCase):
+    def test_exports_chrome_trace(self):
+        tracer = Tracer(size=10)
+        with tracer.span("outer", "http"):
+            with tracer.span("inner", "serial", bytes=3):
+                pass
+
+        trace = tracer.chrome_trace()
+        spans = [e for e in trace["traceEvents"] if e["ph"] == "X"]
+
+        self.assertEqual([s["name"] for s in spans], ["inner", "outer"])
+        self.assertEqual(spans[0]["args"], {"bytes": 3})
+        self.assertGreaterEqual(spans[1]["dur"], spans[0]["dur"])
+
+    def test_ring_drops_oldest(self):
+        tracer = Tracer(size=2)
+        for name in ["a", "b", "c"]:
+            with tracer.span(name):
+                pass
+
+        self.assertEqual([e[0] for e in tracer.events], ["b", "c"])
+
+    def test_disabled_records_nothing(self):
+        tracer = Tracer()
+        tracer.enabled = False
+        with tracer.span("ignored"):
+            pass
+
+        self.assertEqual(len(tracer.events), 0)
@@ -0,0 +1,53 @@
+import queue
+import threading
+import unittest
+from staubli.http.workers import RemoteRobot, serve_robot
+from staubli.robot import toolpath
+from staubli.robot.commands import CommandQueue, QueuedRobot
+from staubli.robot.machine import EffectorLocation, Robot
+from staubli.robot.serial_emulator import Faults, SerialEmulator
+
+
+class FailingEmulator(SerialEmulator):
+    """Drops off the line for good after a number of moves."""
+
+    def __init__(self, moves: int):
+        super().__init__()
+        self.baud = 10**9
+        self.moves = 0
+        self.fail_after = moves
+
+    def write(self, cmd_b: bytes):
+        if cmd_b.startswith(b"do moves"):
+            self.moves += 1
+            if self.moves == self.fail_after:
+                self.faults = Faults(disconnect=1.0, disconnect_seconds=60)
+        super().write(cmd_b)
+
+
+class TestWorkers(unittest.TestCase):
+    def setUp(self):
+        self.emulator = FailingEmulator(moves=3)
+        robot = Robot(self.emulator)
+        robot.read_timeout = 0.1
+        requests = queue.Queue()
+        responses = [queue.Queue()]
+        # Thread queues stand in for the process ones, the owner loop is the same
+        threading.Thread(
+            target=serve_robot,
+            args=(QueuedRobot(CommandQueue(robot)), requests, responses, []),
+            daemon=True,
+        ).start()
+        self.remote = RemoteRobot(0, requests, responses[0])
+
+    def test_cancelled_feed_cancels_in_the_owner(self):
+        locations = [EffectorLocation(400, 0, 600 - i, 0, 180, 0) for i in range(40)]
+
+        with self.assertRaises(RuntimeError):
+            toolpath.feed(self.remote, locations, chunk_size=5, chunks_ahead=2)
+        # Behind anything still queued in the owner
+        self.remote.submit("where").exception(timeout=5)
+        # The failed move and at most the one already dispatched behind it
+        self.assertLessEqual(self.emulator.moves, 4)
+        # Replies to the cancelled moves didn't stop this worker hearing from the owner
+        self.assertEqual(self.remote.submit("positions.__len__").result(timeout=5), 0)